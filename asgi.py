@@ -0,0 +1,11 @@
+import os
+from dotenv import load_dotenv
+
+dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
+if os.path.exists(dotenv_path):
+    load_dotenv(dotenv_path)
+
+from myblog import create_app
+from myblog.asgi import AsgiApp
+
+app = AsgiApp(create_app('production'))
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""端点基准测试: 用 forge 的批量生成器在 SQLite 文件中造数据, 通过 test_client
+访问 blog, admin, auth 蓝本的每个路由, 记录 p50/p95 延迟, SQL 语句数和峰值内存.
+
+    python -m benchmarks.bench --output baseline.json
+    python -m benchmarks.bench --compare baseline.json
+"""
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+from datetime import datetime
+
+import click
+from flask import url_for
+from sqlalchemy import event, func
+
+from myblog import create_app
+from myblog.counters import rebuild_counters
+from myblog.extensions import db
+from myblog.fakes import fake_admin, bulk_topics, bulk_posts, bulk_comments, bulk_thoughts
+from myblog.models import Admin, Category, Comment, Post, Thought, Topic
+from myblog.search import search_index
+
+BLUEPRINTS = ('blog', 'admin', 'auth')
+
+# client: anonymous 匿名访问, admin 已登录, fresh 每次请求使用新的匿名客户端,
+# login 每次请求前重新登录 (登录不计时)
+Endpoint = namedtuple('Endpoint', ['name', 'endpoint', 'method', 'view_args', 'query', 'data', 'client'])
+
+# 会新建或删除数据的路由不参与测量, 否则每次请求面对的数据集都不同
+SKIPPED = {
+    ('admin.new_thought', 'POST'), ('admin.edit_thought', 'POST'), ('admin.delete_thought', 'POST'),
+    ('admin.new_post', 'POST'), ('admin.edit_post', 'POST'), ('admin.delete_post', 'POST'),
+    ('admin.delete_comment', 'POST'), ('admin.new_topic', 'POST'), ('admin.edit_topic', 'POST'),
+    ('admin.delete_topic', 'POST'), ('admin.merge_topic', 'POST'),
+    ('blog.index', 'POST'), ('blog.show_post', 'POST'), ('admin.reset_query_stats', 'POST'),
+    ('admin.reset_timing_stats', 'POST'), ('admin.retry_task', 'POST'),
+}
+
+ADMIN_USERNAME = 'admin'
+ADMIN_PASSWORD = 'helloflask'
+
+
+def seed(app, posts, comments, topics, thoughts, batch=10000):
+    """建立表并写入测试数据, 与 flask initdb 和 flask forge --bulk 相同"""
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([Category(name=name) for name in ('Math', 'CS', 'Physics', 'Life')])
+        db.session.commit()
+        fake_admin()
+        bulk_topics(topics, batch)
+        bulk_posts(posts, batch)
+        bulk_comments(comments, batch)
+        bulk_thoughts(thoughts, batch)
+        rebuild_counters()
+        search_index.rebuild()
+
+
+def sample_ids():
+    """取一组存在的 id 用于构造 URL, 深分页取中间的页码"""
+    post_count = Post.query.count()
+    oldest = db.session.query(func.min(Post.create_time)).scalar() or datetime.utcnow()
+    return dict(
+        year=oldest.year, month=oldest.month,
+        post_id=db.session.query(Post.id).order_by(Post.comment_count.desc()).limit(1).scalar(),
+        category_id=db.session.query(Post.category_id).limit(1).scalar(),
+        topic_id=db.session.query(Post.topic_id).limit(1).scalar(),
+        thought_id=db.session.query(Thought.id).limit(1).scalar(),
+        comment_id=db.session.query(Comment.id).filter_by(reviewed=True).limit(1).scalar(),
+        deep_page=max(post_count // 2 // 10, 1),
+        search=(db.session.query(Post.title).limit(1).scalar() or 'blog').split()[0],
+    )
+
+
+def endpoints(ids):
+    admin = Admin.query.first()
+    post_id, topic_id = ids['post_id'], ids['topic_id']
+    return [
+        Endpoint('blog.index', 'blog.index', 'GET', {}, {}, None, 'anonymous'),
+        Endpoint('blog.index@deep', 'blog.index', 'GET', {}, {'page': ids['deep_page']}, None, 'anonymous'),
+        Endpoint('blog.about', 'blog.about', 'GET', {}, {}, None, 'anonymous'),
+        Endpoint('blog.thought', 'blog.thought', 'GET', {}, {}, None, 'anonymous'),
+        Endpoint('blog.archive', 'blog.archive', 'GET', {}, {}, None, 'anonymous'),
+        Endpoint('blog.archive@month', 'blog.archive', 'GET', {'year': ids['year'], 'month': ids['month']}, {},
+                 None, 'anonymous'),
+        Endpoint('blog.show_category', 'blog.show_category', 'GET',
+                 {'category_id': ids['category_id']}, {}, None, 'anonymous'),
+        Endpoint('blog.show_topic', 'blog.show_topic', 'GET', {'topic_id': topic_id}, {}, None, 'anonymous'),
+        Endpoint('blog.show_post', 'blog.show_post', 'GET', {'post_id': post_id}, {}, None, 'anonymous'),
+        Endpoint('blog.show_post@admin', 'blog.show_post', 'GET', {'post_id': post_id}, {}, None, 'admin'),
+        Endpoint('blog.search', 'blog.search', 'GET', {}, {'q': ids['search']}, None, 'anonymous'),
+        Endpoint('blog.csrf_token', 'blog.csrf_token', 'GET', {}, {}, None, 'anonymous'),
+        Endpoint('blog.reply_comment', 'blog.reply_comment', 'GET',
+                 {'comment_id': ids['comment_id']}, {}, None, 'anonymous'),
+        Endpoint('auth.login', 'auth.login', 'GET', {}, {}, None, 'anonymous'),
+        Endpoint('auth.login@post', 'auth.login', 'POST', {}, {},
+                 dict(username=ADMIN_USERNAME, password=ADMIN_PASSWORD), 'fresh'),
+        Endpoint('auth.logout', 'auth.logout', 'GET', {}, {}, None, 'login'),
+        Endpoint('admin.settings', 'admin.settings', 'GET', {}, {}, None, 'admin'),
+        Endpoint('admin.settings@post', 'admin.settings', 'POST', {}, {},
+                 dict(name=admin.name, blog_title=admin.blog_title, about=admin.about), 'admin'),
+        Endpoint('admin.new_thought', 'admin.new_thought', 'GET', {}, {}, None, 'admin'),
+        Endpoint('admin.manage_thought', 'admin.manage_thought', 'GET', {}, {}, None, 'admin'),
+        Endpoint('admin.edit_thought', 'admin.edit_thought', 'GET',
+                 {'thought_id': ids['thought_id']}, {}, None, 'admin'),
+        Endpoint('admin.manage_post', 'admin.manage_post', 'GET', {}, {}, None, 'admin'),
+        Endpoint('admin.new_post', 'admin.new_post', 'GET', {}, {}, None, 'admin'),
+        Endpoint('admin.edit_post', 'admin.edit_post', 'GET', {'post_id': post_id}, {}, None, 'admin'),
+        Endpoint('admin.set_comment', 'admin.set_comment', 'POST', {'post_id': post_id}, {}, {}, 'admin'),
+        Endpoint('admin.manage_comment', 'admin.manage_comment', 'GET', {}, {}, None, 'admin'),
+        Endpoint('admin.manage_comment@unread', 'admin.manage_comment', 'GET', {}, {'filter': 'unread'},
+                 None, 'admin'),
+        Endpoint('admin.approve_comment', 'admin.approve_comment', 'POST',
+                 {'comment_id': ids['comment_id']}, {}, {}, 'admin'),
+        Endpoint('admin.manage_topic', 'admin.manage_topic', 'GET', {}, {}, None, 'admin'),
+        Endpoint('admin.new_topic', 'admin.new_topic', 'GET', {}, {}, None, 'admin'),
+        Endpoint('admin.edit_topic', 'admin.edit_topic', 'GET', {'topic_id': topic_id}, {}, None, 'admin'),
+        Endpoint('admin.query_stats', 'admin.query_stats', 'GET', {}, {}, None, 'admin'),
+        Endpoint('admin.timing_stats', 'admin.timing_stats', 'GET', {}, {}, None, 'admin'),
+        Endpoint('admin.task_stats', 'admin.task_stats', 'GET', {}, {}, None, 'admin'),
+    ]
+
+
+def uncovered(app, specs):
+    """没有被测量也没有列入 SKIPPED 的路由, 新增路由时提醒补充"""
+    covered = set((spec.endpoint, spec.method) for spec in specs) | SKIPPED
+    missing = []
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint.split('.')[0] not in BLUEPRINTS:
+            continue
+        for method in sorted(rule.methods - {'HEAD', 'OPTIONS'}):
+            if (rule.endpoint, method) not in covered:
+                missing.append((rule.endpoint, method))
+    return missing
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[int(round((len(values) - 1) * q))]
+
+
+class Runner(object):
+
+    def __init__(self, app):
+        self.app = app
+        self.statements = 0
+        self.anonymous = app.test_client()
+        self.admin = self.login(app.test_client())
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.statements += 1
+
+    @staticmethod
+    def login(client):
+        client.post('/auth/login', data=dict(username=ADMIN_USERNAME, password=ADMIN_PASSWORD))
+        return client
+
+    def client(self, kind):
+        if kind == 'anonymous':
+            return self.anonymous
+        if kind == 'admin':
+            return self.admin
+        if kind == 'fresh':
+            return self.app.test_client()
+        return self.login(self.app.test_client())
+
+    def request(self, spec, url):
+        client = self.client(spec.client)
+        self.statements = 0
+        start = time.perf_counter()
+        response = client.open(url, method=spec.method, data=spec.data)
+        elapsed = time.perf_counter() - start
+        return response.status_code, elapsed, self.statements
+
+    def measure(self, spec, url, requests, warmup):
+        for i in range(warmup):
+            self.request(spec, url)
+
+        timings, queries = [], []
+        for i in range(requests):
+            status, elapsed, statements = self.request(spec, url)
+            timings.append(elapsed * 1000)
+            queries.append(statements)
+
+        # tracemalloc 会明显拖慢请求, 单独跑一次来测峰值内存
+        tracemalloc.start()
+        self.request(spec, url)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        return dict(status=status, p50_ms=round(percentile(timings, 0.5), 3),
+                    p95_ms=round(percentile(timings, 0.95), 3), queries=max(queries),
+                    peak_kb=round(peak / 1024.0, 1))
+
+
+def run(app, requests=20, warmup=2, only=None):
+    with app.test_request_context():
+        specs = endpoints(sample_ids())
+        urls = dict((spec.name, url_for(spec.endpoint, **dict(spec.view_args, **spec.query)))
+                    for spec in specs)
+        missing = uncovered(app, specs)
+        db.session.remove()
+
+    runner = Runner(app)
+    results = {}
+    for spec in specs:
+        if only and spec.name not in only:
+            continue
+        results[spec.name] = runner.measure(spec, urls[spec.name], requests, warmup)
+    return results, missing
+
+
+def compare(baseline, results, tolerance=0.25, min_delta_ms=1.0):
+    """和基线比较, 返回 [(端点, 指标, 基线值, 当前值)];
+    延迟和内存超过容差才算退化, SQL 语句数增加即算退化"""
+    regressions = []
+    for name, current in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if current['queries'] > base['queries']:
+            regressions.append((name, 'queries', base['queries'], current['queries']))
+        for metric in ('p50_ms', 'p95_ms'):
+            if current[metric] > base[metric] * (1 + tolerance) and current[metric] - base[metric] >= min_delta_ms:
+                regressions.append((name, metric, base[metric], current[metric]))
+        if current['peak_kb'] > base['peak_kb'] * (1 + tolerance):
+            regressions.append((name, 'peak_kb', base['peak_kb'], current['peak_kb']))
+    return regressions
+
+
+def format_table(results):
+    lines = ['%-30s %6s %10s %10s %6s %10s' % ('endpoint', 'status', 'p50 ms', 'p95 ms', 'sql', 'peak KB')]
+    for name, result in sorted(results.items()):
+        lines.append('%-30s %6d %10.2f %10.2f %6d %10.1f' % (
+            name, result['status'], result['p50_ms'], result['p95_ms'], result['queries'], result['peak_kb']))
+    return '\n'.join(lines)
+
+
+@click.command()
+@click.option('--database', help='SQLite file to use, seeded if it does not exist. Default is a temporary file.')
+@click.option('--posts', default=2000, help='Posts to generate, default is 2000.')
+@click.option('--comments', default=20000, help='Comments to generate, default is 20000.')
+@click.option('--topics', default=40, help='Topics to generate, default is 40.')
+@click.option('--thoughts', default=500, help='Thoughts to generate, default is 500.')
+@click.option('--requests', default=20, help='Measured requests per endpoint, default is 20.')
+@click.option('--warmup', default=2, help='Unmeasured requests per endpoint, default is 2.')
+@click.option('--only', multiple=True, help='Only measure the given endpoint name, can be repeated.')
+@click.option('--output', type=click.Path(), help='Write the results to a JSON baseline.')
+@click.option('--compare', 'baseline_path', type=click.Path(exists=True), help='Compare with a JSON baseline.')
+@click.option('--tolerance', default=0.25, help='Allowed latency and memory growth, default is 0.25.')
+def main(database, posts, comments, topics, thoughts, requests, warmup, only, output, baseline_path,
+         tolerance):
+    """Benchmark every blog, admin and auth route against a generated dataset."""
+    if database is None:
+        database = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    database = os.path.abspath(database)
+
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + database
+    app.config['SQLALCHEMY_RECORD_QUERIES'] = False
+
+    if not os.path.exists(database):
+        click.echo('Seeding %s with %d posts and %d comments...' % (database, posts, comments))
+        seed(app, posts, comments, topics, thoughts)
+
+    results, missing = run(app, requests, warmup, only)
+    click.echo(format_table(results))
+    for endpoint, method in missing:
+        click.echo('Not measured: %s %s' % (method, endpoint))
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(dict(meta=dict(posts=posts, comments=comments, requests=requests,
+                                     python=platform.python_version()),
+                           endpoints=results), f, indent=2, sort_keys=True)
+        click.echo('Baseline written to %s.' % output)
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)['endpoints']
+        regressions = compare(baseline, results, tolerance)
+        for name, metric, before, after in regressions:
+            click.echo('REGRESSION %s %s: %s -> %s' % (name, metric, before, after))
+        click.echo('%d regressions.' % len(regressions))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""WSGI 和 ASGI 入口在相同并发下的对比: WSGI 为每个并发请求一个线程 (与多线程服务器相同),
+ASGI 使用 asgi.py 的 AsgiApp. 请求中 --viral 比例访问同一篇文章, 其余轮流访问 blog 的其他只读页面.
+
+    python -m benchmarks.concurrency --concurrency 32 --requests 2000
+"""
+import asyncio
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import url_for
+from werkzeug.test import EnvironBuilder
+
+from myblog import create_app
+from myblog.asgi import AsgiApp, call_wsgi
+from myblog.extensions import db
+
+from benchmarks.bench import percentile, sample_ids, seed
+
+
+def workload(app, total, viral):
+    with app.test_request_context():
+        ids = sample_ids()
+        hot = url_for('blog.show_post', post_id=ids['post_id'])
+        others = [url_for('blog.index'), url_for('blog.thought'), url_for('blog.archive'), url_for('blog.about'),
+                  url_for('blog.show_topic', topic_id=ids['topic_id']),
+                  url_for('blog.show_category', category_id=ids['category_id'])]
+        others += [url_for('blog.show_post', post_id=post_id) for post_id in range(1, 21)]
+        db.session.remove()
+    paths = []
+    for i in range(total):
+        # 按比例均匀地穿插热门文章
+        if int((i + 1) * viral) > int(i * viral):
+            paths.append(hot)
+        else:
+            paths.append(others[i % len(others)])
+    return paths
+
+
+def summary(timings, wall):
+    timings = [timing * 1000 for timing in timings]
+    return dict(rps=len(timings) / wall, p50_ms=percentile(timings, 0.5), p95_ms=percentile(timings, 0.95),
+                p99_ms=percentile(timings, 0.99))
+
+
+def run_wsgi(app, paths, concurrency):
+    def request(path):
+        environ = EnvironBuilder(path=path).get_environ()
+        start = time.perf_counter()
+        call_wsgi(app, environ)
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        start = time.perf_counter()
+        timings = list(pool.map(request, paths))
+        return summary(timings, time.perf_counter() - start)
+
+
+def run_asgi(app, paths, concurrency):
+    asgi = AsgiApp(app)
+
+    async def request(semaphore, path):
+        scope = dict(type='http', http_version='1.1', method='GET', scheme='http', path=path, root_path='',
+                     query_string=b'', headers=[(b'host', b'localhost')], server=('localhost', 80),
+                     client=('127.0.0.1', 1234))
+
+        async def receive():
+            return dict(type='http.request', body=b'', more_body=False)
+
+        async def send(message):
+            pass
+
+        async with semaphore:
+            start = time.perf_counter()
+            await asgi(scope, receive, send)
+            return time.perf_counter() - start
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+        start = time.perf_counter()
+        timings = await asyncio.gather(*[request(semaphore, path) for path in paths])
+        return summary(timings, time.perf_counter() - start)
+
+    loop = asyncio.new_event_loop()
+    try:
+        result = loop.run_until_complete(main())
+    finally:
+        loop.close()
+        asgi.read_pool.shutdown()
+        asgi.pool.shutdown()
+    result['coalesced'] = asgi.coalesced
+    return result
+
+
+@click.command()
+@click.option('--database', help='SQLite file to use, seeded if it does not exist. Default is a temporary file.')
+@click.option('--posts', default=2000, help='Posts to generate, default is 2000.')
+@click.option('--comments', default=20000, help='Comments to generate, default is 20000.')
+@click.option('--concurrency', default=32, help='Requests in flight, default is 32.')
+@click.option('--requests', default=2000, help='Requests per entry point, default is 2000.')
+@click.option('--viral', default=0.8, help='Share of requests for the same post, default is 0.8.')
+@click.option('--profile', default='sqlite-production', help='Database profile, default is sqlite-production.')
+def main(database, posts, comments, concurrency, requests, viral, profile):
+    """Compare the WSGI and ASGI entry points on the blog read path under the same concurrency."""
+    if database is None:
+        database = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    database = os.path.abspath(database)
+
+    app = create_app('testing')
+    app.config.update(SQLALCHEMY_DATABASE_URI='sqlite:///' + database, SQLALCHEMY_RECORD_QUERIES=False,
+                      MYBLOG_DB_PROFILE=profile, MYBLOG_SERVER_TIMING=False)
+    if not os.path.exists(database):
+        click.echo('Seeding %s with %d posts and %d comments...' % (database, posts, comments))
+        seed(app, posts, comments, 40, 500)
+
+    paths = workload(app, requests, viral)
+    # 预热模板和连接池
+    run_wsgi(app, paths[:50], concurrency)
+    click.echo('%-6s %10s %10s %10s %10s %10s' % ('entry', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'coalesced'))
+    for name, runner in (('wsgi', run_wsgi), ('asgi', run_asgi)):
+        result = runner(app, paths, concurrency)
+        click.echo('%-6s %10.1f %10.2f %10.2f %10.2f %10s' % (
+            name, result['rps'], result['p50_ms'], result['p95_ms'], result['p99_ms'],
+            result.get('coalesced', '-')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+"""add rendered post body
+
+Revision ID: 3f6b2c1d9a4e
+Revises: 71d15d7c9cbd
+Create Date: 2026-10-18 09:12:31.402118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6b2c1d9a4e'
+down_revision = '71d15d7c9cbd'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('post', sa.Column('body_html', sa.Text(), nullable=True))
+    op.add_column('post', sa.Column('toc_html', sa.Text(), nullable=True))
+    op.add_column('post', sa.Column('body_hash', sa.String(length=40), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('post') as batch_op:
+        batch_op.drop_column('body_hash')
+        batch_op.drop_column('toc_html')
+        batch_op.drop_column('body_html')
@@ -0,0 +1,38 @@
+"""add counter cache
+
+Revision ID: 9c2d41e7b5a3
+Revises: 3f6b2c1d9a4e
+Create Date: 2026-10-18 14:03:52.817305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c2d41e7b5a3'
+down_revision = '3f6b2c1d9a4e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # run `flask recount` afterwards to fill in the counters
+    op.create_table('counter',
+    sa.Column('name', sa.String(length=30), nullable=False),
+    sa.Column('value', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.add_column('category', sa.Column('post_count', sa.Integer(), server_default='0', nullable=True))
+    op.add_column('topic', sa.Column('post_count', sa.Integer(), server_default='0', nullable=True))
+    op.add_column('post', sa.Column('comment_count', sa.Integer(), server_default='0', nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('post') as batch_op:
+        batch_op.drop_column('comment_count')
+    with op.batch_alter_table('topic') as batch_op:
+        batch_op.drop_column('post_count')
+    with op.batch_alter_table('category') as batch_op:
+        batch_op.drop_column('post_count')
+    op.drop_table('counter')
@@ -0,0 +1,37 @@
+"""add hot path indexes
+
+Revision ID: b7e4d2a9f6c3
+Revises: a8d3f6e2c1b4
+Create Date: 2026-10-18 23:12:05.381640
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e4d2a9f6c3'
+down_revision = 'a8d3f6e2c1b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_comment_post_id_reviewed_timestamp', 'comment', ['post_id', 'reviewed', 'timestamp'], unique=False)
+    op.create_index('ix_comment_reviewed_timestamp', 'comment', ['reviewed', 'timestamp'], unique=False)
+    op.create_index('ix_comment_from_admin_timestamp', 'comment', ['from_admin', 'timestamp'], unique=False)
+    op.create_index(op.f('ix_comment_replied_id'), 'comment', ['replied_id'], unique=False)
+    op.create_index('ix_post_topic_id_create_time', 'post', ['topic_id', 'create_time'], unique=False)
+    op.create_index('ix_post_category_id_create_time', 'post', ['category_id', 'create_time'], unique=False)
+    if op.get_bind().dialect.name == 'sqlite':
+        # 收集统计信息, 让查询规划器知道新索引的选择性
+        op.execute('ANALYZE')
+
+
+def downgrade():
+    op.drop_index('ix_post_category_id_create_time', table_name='post')
+    op.drop_index('ix_post_topic_id_create_time', table_name='post')
+    op.drop_index(op.f('ix_comment_replied_id'), table_name='comment')
+    op.drop_index('ix_comment_from_admin_timestamp', table_name='comment')
+    op.drop_index('ix_comment_reviewed_timestamp', table_name='comment')
+    op.drop_index('ix_comment_post_id_reviewed_timestamp', table_name='comment')
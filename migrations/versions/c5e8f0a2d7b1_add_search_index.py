@@ -0,0 +1,39 @@
+"""add search index
+
+Revision ID: c5e8f0a2d7b1
+Revises: 9c2d41e7b5a3
+Create Date: 2026-10-18 18:05:21.403118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e8f0a2d7b1'
+down_revision = '9c2d41e7b5a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # run `flask reindex` afterwards to fill in the index
+    op.create_table('search_term',
+    sa.Column('term', sa.String(length=40), nullable=False),
+    sa.Column('doc', sa.Integer(), nullable=False),
+    sa.Column('weight', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('term', 'doc')
+    )
+    op.create_index(op.f('ix_search_term_doc'), 'search_term', ['doc'], unique=False)
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        options = [row[0] for row in bind.execute('PRAGMA compile_options')]
+        if 'ENABLE_FTS5' in options:
+            op.execute('CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(title, body)')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute('DROP TABLE IF EXISTS search_fts')
+    op.drop_index(op.f('ix_search_term_doc'), table_name='search_term')
+    op.drop_table('search_term')
@@ -0,0 +1,26 @@
+"""add thought update time
+
+Revision ID: d3b9e6f1a2c8
+Revises: b7e4d2a9f6c3
+Create Date: 2026-10-18 23:48:12.204517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3b9e6f1a2c8'
+down_revision = 'b7e4d2a9f6c3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('thought', sa.Column('update_time', sa.DateTime(), nullable=True))
+    op.execute('UPDATE thought SET update_time = timestamp')
+
+
+def downgrade():
+    with op.batch_alter_table('thought') as batch_op:
+        batch_op.drop_column('update_time')
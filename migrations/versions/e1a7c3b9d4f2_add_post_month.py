@@ -0,0 +1,30 @@
+"""add post month
+
+Revision ID: e1a7c3b9d4f2
+Revises: c5e8f0a2d7b1
+Create Date: 2026-10-18 20:41:09.126734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1a7c3b9d4f2'
+down_revision = 'c5e8f0a2d7b1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # run `flask recount` afterwards to fill in the monthly counts
+    op.create_table('post_month',
+    sa.Column('year', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('month', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('count', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('year', 'month')
+    )
+
+
+def downgrade():
+    op.drop_table('post_month')
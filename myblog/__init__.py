@@ -1,20 +1,29 @@
 # -*- coding: utf-8 -*-
 
+import json
 import logging
 import os
+import threading
 from logging.handlers import RotatingFileHandler
 from flask.logging import default_handler
 
 import click
 from flask import Flask, render_template, request
-from flask_sqlalchemy import get_debug_queries
 from flask_login import current_user
 from flask_wtf.csrf import CSRFError
+from sqlalchemy.orm import undefer_group
+from werkzeug.middleware.proxy_fix import ProxyFix
 
+from myblog.advisor import advise
 from myblog.blueprints.admin import admin_bp
 from myblog.blueprints.auth import auth_bp
 from myblog.blueprints.blog import blog_bp
-from myblog.extensions import bootstrap, db, login_manager, csrf, moment, toolbar, migarte
+from myblog.extensions import bootstrap, db, login_manager, csrf, moment, toolbar, migarte, site_context, page_cache, \
+    query_profiler, request_timer, image_pipeline, static_assets, login_guard
+from myblog import counters
+from myblog.counters import check_counters, rebuild_counters
+from myblog.search import search_index
+from myblog.tasks import task_queue
 from myblog.models import Admin, Category, Post, Comment, Thought, Topic
 from myblog.settings import config
 
@@ -26,6 +35,9 @@ def create_app(config_name=None):
 
     app = Flask('myblog')
     app.config.from_object(config[config_name])
+    proxies = app.config['MYBLOG_PROXY_FIX']
+    if proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
 
     register_logging(app)
     register_extensions(app)
@@ -34,7 +46,6 @@ def create_app(config_name=None):
     register_template_context(app)
     register_commands(app)
     register_errors(app)
-    register_request_handlers(app)
 
     return app
 
@@ -43,15 +54,16 @@ def register_logging(app):
     
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
-    file_handler = RotatingFileHandler(os.path.join(basedir, 'logs/myblog.log'),
-                                       maxBytes=10 * 1024 * 1024, backupCount=10)
-    file_handler.setFormatter(formatter)
-    file_handler.setLevel(logging.INFO)
-
     default_handler.setLevel(logging.INFO)
 
     if not app.debug:
-        app.logger.addHandler(file_handler)
+        # 测试时不写日志文件
+        if app.config['MYBLOG_LOG_FILE']:
+            file_handler = RotatingFileHandler(app.config['MYBLOG_LOG_FILE'],
+                                               maxBytes=10 * 1024 * 1024, backupCount=10)
+            file_handler.setFormatter(formatter)
+            file_handler.setLevel(logging.INFO)
+            app.logger.addHandler(file_handler)
         app.logger.addHandler(default_handler)
 
 
@@ -63,6 +75,15 @@ def register_extensions(app):
     moment.init_app(app)
     #toolbar.init_app(app)
     migarte.init_app(app, db)
+    site_context.init_app(app)
+    page_cache.init_app(app)
+    query_profiler.init_app(app)
+    request_timer.init_app(app)
+    search_index.init_app(app)
+    task_queue.init_app(app)
+    image_pipeline.init_app(app)
+    static_assets.init_app(app)
+    login_guard.init_app(app)
     #sslify.init_app(app)
 
 
@@ -81,17 +102,17 @@ def register_shell_context(app):
 def register_template_context(app):
     @app.context_processor
     def make_template_context():
-        admin = Admin.query.first()
-        categories = Category.query.order_by(Category.id).all()
-        topics = Topic.query.order_by(Topic.name).all()
+        with request_timer.track('context'):
+            snapshot = site_context.get()
 
-        if current_user.is_authenticated:
-            unread_comments = Comment.query.filter_by(reviewed=False).count()
-        else:
-            unread_comments = None
+            if current_user.is_authenticated:
+                # 未读评论数只显示给管理员, 不放进快照, 访客评论不会改变公开页面的 ETag
+                unread_comments = counters.get('comment.unreviewed')
+            else:
+                unread_comments = None
 
         return dict(
-            admin=admin, categories=categories, topics=topics,
+            admin=snapshot.admin, categories=snapshot.categories, topics=snapshot.topics,
             unread_comments=unread_comments)
 
 
@@ -115,6 +136,9 @@ def register_commands(app):
 
         db.session.add_all([Math, Computer, Physics, Life])
         db.session.commit()
+        rebuild_counters()
+        search_index.rebuild()
+        site_context.invalidate()
 
         click.echo('Initialized databases.')
 
@@ -144,6 +168,7 @@ def register_commands(app):
             db.session.add(admin)
 
         db.session.commit()
+        site_context.invalidate()
         click.echo('Done.')
 
     @app.cli.command()
@@ -151,27 +176,230 @@ def register_commands(app):
     @click.option('--topic', default=8, help='Quantity of topics, default is 8.')
     @click.option('--post', default=50, help='Quantity of posts, default is 50.')
     @click.option('--comment', default=500, help='Quantity of comments, default is 500.')
-    def forge(thought, topic, post, comment):
+    @click.option('--bulk', is_flag=True, help='Insert rows in batches, for large load-testing datasets.')
+    @click.option('--batch', default=10000, help='Rows per INSERT batch in bulk mode, default is 10000.')
+    def forge(thought, topic, post, comment, bulk, batch):
         """Generate fake datas."""
         from myblog.fakes import fake_admin, fake_thoughts, fake_topics, fake_comments, fake_posts
 
-        click.echo('Generating the administrator...')
-        fake_admin()
+        if bulk:
+            from myblog.fakes import bulk_topics, bulk_posts, bulk_comments, bulk_thoughts
+
+            def progress(done, total, elapsed):
+                click.echo('  %d/%d rows, %d rows/sec' % (done, total, done / elapsed if elapsed else 0))
+
+            if Admin.query.first() is None:
+                click.echo('Generating the administrator...')
+                fake_admin()
+
+            for name, count, generate in [('topics', topic, bulk_topics), ('posts', post, bulk_posts),
+                                          ('comments', comment, bulk_comments),
+                                          ('thoughts', thought, bulk_thoughts)]:
+                click.echo('Generating %d %s...' % (count, name))
+                generate(count, batch, progress)
+        else:
+            click.echo('Generating the administrator...')
+            fake_admin()
+
+            click.echo('Generating %d topics...' % topic)
+            fake_topics(topic)
+
+            click.echo('Generating %d posts...' % post)
+            fake_posts(post)
 
-        click.echo('Generating %d topics...' % topic)
-        fake_topics(topic)
+            click.echo('Generating %d comments...' % comment)
+            fake_comments(comment)
 
-        click.echo('Generating %d posts...' % post)
-        fake_posts(post)
+            click.echo('Generating %d thoughts...' % thought)
+            fake_thoughts(thought)
 
-        click.echo('Generating %d comments...' % comment)
-        fake_comments(comment)
+        rebuild_counters()
+        if bulk:
+            click.echo('Rebuilding the search index...')
+            search_index.rebuild()
+        site_context.invalidate()
+        click.echo('Done.')
 
-        click.echo('Generating %d thoughts...' % thought)
-        fake_thoughts(thought)
+    @app.cli.command()
+    @click.option('--batch', default=100, help='Posts rendered per transaction, default is 100.')
+    @click.option('--force', is_flag=True, help='Render posts even if their body did not change.')
+    def render(batch, force):
+        """Render the Markdown of existing posts to HTML."""
+        last_id = 0
+        rendered = 0
+        while True:
+            posts = Post.query.options(undefer_group('content')).filter(Post.id > last_id) \
+                .order_by(Post.id).limit(batch).all()
+            if not posts:
+                break
+            for post in posts:
+                if post.render_body(force=force):
+                    rendered += 1
+            last_id = posts[-1].id
+            db.session.commit()
+            db.session.expunge_all()
+            click.echo('Rendered %d posts...' % rendered)
 
         click.echo('Done.')
 
+    @app.cli.command()
+    @click.option('--check', is_flag=True, help='Only report the counters that are out of date.')
+    def recount(check):
+        """Verify and rebuild the cached counters."""
+        mismatches = check_counters()
+        for name, cached, actual in mismatches:
+            click.echo('%s: cached %s, actual %s' % (name, cached, actual))
+        click.echo('%d counters out of date.' % len(mismatches))
+
+        if not check:
+            rebuild_counters()
+            site_context.invalidate()
+            click.echo('Counters rebuilt.')
+
+    @app.cli.command()
+    @click.option('--batch', default=500, help='Rows indexed per transaction, default is 500.')
+    def reindex(batch):
+        """Rebuild the search index of posts, thoughts and comments."""
+        click.echo('Rebuilding the %s search index...' % search_index.backend.name)
+        search_index.rebuild(batch, lambda table, indexed: click.echo('Indexed %d %ss...' % (indexed, table)))
+        click.echo('Done.')
+
+    @app.cli.command()
+    @click.option('--force', is_flag=True, help='Process images even if their variants are up to date.')
+    def images(force):
+        """Generate resized WebP and JPEG variants of the images under static/img."""
+        if not image_pipeline.available:
+            raise click.UsageError('Pillow is not installed.')
+
+        totals = [0, 0]
+
+        def progress(record):
+            # 与原图比较的是最大宽度下最小的那个文件, 即支持该格式的浏览器实际下载的大小
+            largest = max(record['variants'], key=lambda variant: variant['width'])
+            compressed = min([item['bytes'] for item in largest['files'].values()] or [record['bytes']])
+            totals[0] += record['bytes']
+            totals[1] += compressed
+            click.echo('%s: %dx%d, %d -> %d bytes' % (record['source'], record['width'], record['height'],
+                                                      record['bytes'], compressed))
+
+        records = image_pipeline.backfill(force, progress)
+        click.echo('Processed %d images, %d -> %d bytes.' % (len(records), totals[0], totals[1]))
+
+    @app.cli.group('assets')
+    def assets_group():
+        """Build the fingerprinted static asset bundles."""
+
+    @assets_group.command('build')
+    @click.option('--clean', is_flag=True, help='Remove the files of previous builds.')
+    def build_assets(clean):
+        """Concatenate, fingerprint and precompress the static bundles."""
+        for name, path, sources, sizes in static_assets.build(clean):
+            click.echo('%s: %d files -> %s, %d bytes, gzip %d%s' % (
+                name, sources, path, sizes['raw'], sizes['gz'], ', brotli %d' % sizes['br'] if 'br' in sizes else ''))
+        page_cache.clear()
+        site_context.invalidate()
+        click.echo('Done.')
+
+    @app.cli.command()
+    @click.option('--threads', default=1, help='Worker threads, default is 1.')
+    @click.option('--once', is_flag=True, help='Run the tasks that are due and exit.')
+    def worker(threads, once):
+        """Run the background tasks queued by the admin pages."""
+        task_queue.recover()
+        if once:
+            click.echo('Ran %d tasks.' % task_queue.run_pending())
+            return
+
+        click.echo('Running tasks with %d threads, press CTRL+C to stop.' % threads)
+        stop = threading.Event()
+        workers = task_queue.start(app, threads, stop)
+        try:
+            while any(thread.is_alive() for thread in workers):
+                stop.wait(1)
+        except KeyboardInterrupt:
+            click.echo('Waiting for the running tasks...')
+            stop.set()
+            app.extensions['task_queue'].wakeup.set()
+            for thread in workers:
+                thread.join()
+
+    @app.cli.command('merge-topic')
+    @click.argument('source')
+    @click.argument('target')
+    def merge_topic(source, target):
+        """Move every post of SOURCE topic into TARGET topic, then delete SOURCE."""
+        source_topic = Topic.query.filter_by(name=source).first()
+        target_topic = Topic.query.filter_by(name=target).first()
+        if source_topic is None or target_topic is None:
+            raise click.BadParameter('Topic not found.')
+        if source_topic.id == 1 or source_topic.id == target_topic.id:
+            raise click.BadParameter('Can not merge this topic.')
+
+        page_cache.purge_topic(source_topic.id)
+        moved = source_topic.merge_into(target_topic)
+        site_context.invalidate()
+        page_cache.purge('blog.show_topic', topic_id=target_topic.id)
+        click.echo('Moved %d posts into %s.' % (moved, target))
+
+    @app.cli.command('query-stats')
+    @click.option('--endpoint', help='Only show statements of this endpoint.')
+    @click.option('--limit', default=20, help='Quantity of statements, default is 20.')
+    @click.option('--json', 'as_json', is_flag=True, help='Dump the statistics as JSON.')
+    @click.option('--reset', is_flag=True, help='Clear the statistics after dumping.')
+    def query_stats(endpoint, limit, as_json, reset):
+        """Dump the SQL statistics collected by every worker."""
+        rows = query_profiler.report(endpoint, limit)
+        if as_json:
+            click.echo(json.dumps(rows, indent=2))
+        else:
+            for row in rows:
+                click.echo('%8d %10.1fms %8.2fms %8.2fms %6d  %s  %s' % (
+                    row['count'], row['total_ms'], row['avg_ms'], row['max_ms'], row['rows'],
+                    row['endpoint'], row['statement']))
+            click.echo('%d statements.' % len(rows))
+        if reset:
+            query_profiler.reset()
+            click.echo('Statistics cleared.')
+
+    @app.cli.command()
+    @click.option('--endpoint', help='Only show this endpoint.')
+    @click.option('--json', 'as_json', is_flag=True, help='Dump the histograms as JSON.')
+    @click.option('--reset', is_flag=True, help='Clear the histograms after dumping.')
+    def perf(endpoint, as_json, reset):
+        """Show request latency percentiles collected by every worker."""
+        rows = request_timer.report(endpoint)
+        if as_json:
+            click.echo(json.dumps(rows, indent=2))
+        else:
+            click.echo('%-32s %-8s %8s %9s %9s %9s %9s %9s' % (
+                'endpoint', 'metric', 'count', 'mean', 'p50', 'p90', 'p99', 'max'))
+            for row in rows:
+                click.echo('%-32s %-8s %8d %8.1fms %8.1fms %8.1fms %8.1fms %8.1fms' % (
+                    row['endpoint'], row['metric'], row['count'], row['mean'], row['p50'], row['p90'],
+                    row['p99'], row['max']))
+        if reset:
+            request_timer.reset()
+            click.echo('Histograms cleared.')
+
+    @app.cli.command('db-advise')
+    @click.option('--min-rows', default=0, help='Hide full scans of tables with fewer rows, default is 0.')
+    @click.option('--json', 'as_json', is_flag=True, help='Dump the findings as JSON.')
+    def db_advise(min_rows, as_json):
+        """Explain the queries of every view and report full table or index scans and temporary sorts."""
+        try:
+            findings = advise(min_rows)
+        except RuntimeError as e:
+            raise click.UsageError(str(e))
+        if as_json:
+            click.echo(json.dumps(findings, indent=2))
+            return
+        for finding in findings:
+            rows = '%8d rows' % finding['rows'] if finding['rows'] is not None else ' ' * 13
+            click.echo('%s  %s  [%s]' % (rows, finding['detail'], ', '.join(finding['endpoints'])))
+            click.echo('    %s' % finding['statement'])
+        click.echo('%d full table scans, %d full index scans, %d temporary sorts.' % tuple(
+            sum(finding['kind'] == kind for finding in findings) for kind in ('scan', 'index scan', 'sort')))
+
 
 def register_errors(app):
     @app.errorhandler(400)
@@ -189,15 +417,3 @@ def register_errors(app):
     @app.errorhandler(CSRFError)
     def handle_csrf_error(e):
         return render_template('errors/400.html', description=e.description), 400
-
-
-def register_request_handlers(app):
-    @app.after_request
-    def query_profiler(response):
-        for q in get_debug_queries():
-            if q.duration >= app.config['MYBLOG_SLOW_QUERY_THRESHOLD']:
-                app.logger.warning(
-                    'Slow query: Duration: %fs\n Context: %s\nQuery: %s\n '
-                    % (q.duration, q.context, q.statement)
-                )
-        return response
\ No newline at end of file
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+import re
+
+from flask import current_app, url_for
+from sqlalchemy import event, func
+from sqlalchemy.engine import Engine
+
+from myblog.extensions import db
+from myblog.models import Admin, Comment, Job, Post, Thought
+
+BLUEPRINTS = ('blog', 'admin')
+
+# 需要额外查询参数才会执行不同查询的视图
+VARIANTS = {
+    'blog.index': [{}, {'page': 2}],
+    'blog.search': [{'q': 'blog'}],
+    'admin.manage_comment': [{}, {'filter': 'unread'}, {'filter': 'admin'}],
+}
+
+KINDS = ('scan', 'index scan', 'sort')
+
+_scan = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?( USING (?:COVERING )?INDEX \w+)?$')
+_sort = re.compile(r'^USE TEMP B-TREE FOR (.+)$')
+_where = re.compile(r'\sWHERE\s')
+_alias = re.compile(r'\b(\w+) AS (\w+)\b')
+
+
+def sample_view_args():
+    """每种 URL 参数取一个存在的值, 文章取评论最多的一篇"""
+    oldest = db.session.query(func.min(Post.create_time)).scalar()
+    values = dict(
+        post_id=db.session.query(Post.id).order_by(Post.comment_count.desc()).limit(1).scalar(),
+        category_id=db.session.query(Post.category_id).limit(1).scalar(),
+        topic_id=db.session.query(Post.topic_id).limit(1).scalar(),
+        thought_id=db.session.query(Thought.id).limit(1).scalar(),
+        comment_id=db.session.query(Comment.id).filter_by(reviewed=True).limit(1).scalar(),
+        job_id=db.session.query(Job.id).limit(1).scalar(),
+    )
+    if oldest is not None:
+        values.update(year=oldest.year, month=oldest.month)
+    return dict((name, value) for name, value in values.items() if value is not None)
+
+
+def view_requests(app, values):
+    """(endpoint, 是否需要登录, URL 参数, 查询参数), 缺少样本数据的路由跳过"""
+    for rule in sorted(app.url_map.iter_rules(), key=lambda rule: rule.rule):
+        if 'GET' not in rule.methods or rule.endpoint.split('.')[0] not in BLUEPRINTS:
+            continue
+        if not rule.arguments <= set(values):
+            continue
+        view_args = dict((name, values[name]) for name in rule.arguments)
+        for query in VARIANTS.get(rule.endpoint, [{}]):
+            yield rule.endpoint, rule.endpoint.startswith('admin.'), view_args, query
+
+
+def capture_selects():
+    """返回列表和移除监听的函数, 列表收集所有引擎执行的 (SELECT 语句, 参数)"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    return statements, lambda: event.remove(Engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def explain(connection, statement, parameters):
+    cursor = connection.cursor()
+    try:
+        cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+        return [row[3] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def problems(plan, statement):
+    """查询计划中的全表扫描, 带条件的全索引扫描和临时排序, 返回 [(表名, 类型, 计划描述)].
+    没有条件时按索引顺序扫描配合 LIMIT 只读取一页, 不算问题"""
+    aliases = dict((alias, table) for table, alias in _alias.findall(statement))
+    found = []
+    for detail in plan:
+        match = _scan.match(detail)
+        if match:
+            table = aliases.get(match.group(1), match.group(1))
+            # 子查询的结果不是表, 没有索引可用
+            if table not in db.metadata.tables:
+                continue
+            if not match.group(2):
+                found.append((table, 'scan', detail))
+            elif _where.search(statement):
+                found.append((table, 'index scan', detail))
+            continue
+        match = _sort.match(detail)
+        if match:
+            found.append((None, 'sort', detail))
+    return found
+
+
+def advise(min_rows=0):
+    """访问 blog 和 admin 蓝本的每个 GET 视图, 对其中的 SELECT 执行 EXPLAIN QUERY PLAN,
+    返回全表扫描和临时排序, 每条语句只出现一次, 附带执行它的视图, 按表的行数倒序"""
+    app = current_app._get_current_object()
+    if db.engine.url.get_backend_name() != 'sqlite':
+        raise RuntimeError('EXPLAIN QUERY PLAN needs SQLite.')
+
+    values = sample_view_args()
+    admin = Admin.query.first()
+    anonymous, logged_in = app.test_client(), app.test_client()
+    if admin is not None:
+        with logged_in.session_transaction() as session:
+            session['_user_id'] = str(admin.id)
+            session['_fresh'] = True
+
+    # 整页缓存会跳过视图, 分析期间关闭
+    page_cache, app.extensions['page_cache'] = app.extensions.get('page_cache'), None
+    statements, stop = capture_selects()
+    executed = {}
+    try:
+        for endpoint, login, view_args, query in view_requests(app, values):
+            if login and admin is None:
+                continue
+            with app.test_request_context():
+                url = url_for(endpoint, **dict(view_args, **query))
+            del statements[:]
+            (logged_in if login else anonymous).get(url)
+            for statement, parameters in statements:
+                entry = executed.setdefault(statement, [parameters, []])
+                if endpoint not in entry[1]:
+                    entry[1].append(endpoint)
+    finally:
+        stop()
+        app.extensions['page_cache'] = page_cache
+
+    results, counts = [], {}
+    connection = db.engine.raw_connection()
+    try:
+        for statement, (parameters, endpoints) in executed.items():
+            for table, kind, detail in problems(explain(connection, statement, parameters), statement):
+                if table is not None and table not in counts:
+                    counts[table] = connection.execute('SELECT count(*) FROM "%s"' % table).fetchone()[0]
+                rows = counts.get(table)
+                if rows is not None and rows < min_rows:
+                    continue
+                results.append(dict(table=table, kind=kind, detail=detail, rows=rows,
+                                    endpoints=endpoints, statement=' '.join(statement.split())))
+    finally:
+        connection.close()
+    results.sort(key=lambda result: (KINDS.index(result['kind']), -(result['rows'] or 0), result['detail']))
+    return results
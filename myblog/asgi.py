@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from itsdangerous import BadSignature
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_cookie
+
+# 请求带有这些头时结果与访问者有关, 不合并
+_PRIVATE_HEADERS = ('HTTP_AUTHORIZATION', 'HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE')
+
+
+def make_environ(scope, body):
+    """由 ASGI 的 HTTP scope 和请求体构造 WSGI environ"""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else 'HTTP_' + name
+        value = value.decode('latin-1')
+        if key in environ:
+            # HTTP/2 把每个 cookie 作为单独的头发送, 合并时要用 "; " 分隔
+            value = environ[key] + ('; ' if key == 'HTTP_COOKIE' else ',') + value
+        environ[key] = value
+    return environ
+
+
+def call_wsgi(app, environ):
+    """在当前线程执行 WSGI 应用, 返回 (状态码, ASGI 格式的响应头, 响应体)"""
+    started = []
+    chunks = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [status, headers]
+        return chunks.append
+
+    iterable = app(environ, start_response)
+    try:
+        for chunk in iterable:
+            chunks.append(chunk)
+    finally:
+        if hasattr(iterable, 'close'):
+            iterable.close()
+    status, headers = started
+    return (int(status.split(' ', 1)[0]),
+            [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+            b''.join(chunks))
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+class AsgiApp(object):
+    """ASGI 入口, 与 wsgi.py 是同一个 Flask 应用, 共享模板, 模型和缓存.
+    MYBLOG_ASGI_READ_ENDPOINTS 的 GET 请求在只读线程池中执行, 同一 URL 同时到达的匿名请求只执行一次,
+    其余请求在事件循环中等待同一个结果, 不占用线程也不占用数据库连接; 管理和登录等其他请求使用另一个线程池,
+    读者再多也不会让它们排队. SQLAlchemy 1.3 没有 asyncio 接口, 数据库访问仍然在线程中进行"""
+
+    def __init__(self, app):
+        self.app = app
+        self.read_endpoints = frozenset(app.config['MYBLOG_ASGI_READ_ENDPOINTS'])
+        self.read_pool = ThreadPoolExecutor(app.config['MYBLOG_ASGI_READ_THREADS'], 'myblog-read')
+        self.pool = ThreadPoolExecutor(app.config['MYBLOG_ASGI_THREADS'], 'myblog-sync')
+        self.inflight = {}
+        self.coalesced = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.read_pool.shutdown(wait=True)
+                self.pool.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        environ = make_environ(scope, await read_body(receive))
+        if environ['REQUEST_METHOD'] not in ('GET', 'HEAD') or self.endpoint(environ) not in self.read_endpoints:
+            status, headers, body = await self.run(self.pool, environ)
+        elif self.is_shared(environ):
+            status, headers, body = await self.coalesce(environ)
+        else:
+            status, headers, body = await self.run(self.read_pool, environ)
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    def endpoint(self, environ):
+        try:
+            return self.app.url_map.bind_to_environ(environ).match()[0]
+        except HTTPException:
+            return None
+
+    def is_shared(self, environ):
+        """匿名读者且不是条件请求: 响应与访问者无关, 可以共用"""
+        if any(name in environ for name in _PRIVATE_HEADERS):
+            return False
+        cookies = parse_cookie(environ)
+        if self.app.config.get('REMEMBER_COOKIE_NAME', 'remember_token') in cookies:
+            return False
+        value = cookies.get(self.app.session_cookie_name)
+        if not value:
+            return True
+        serializer = self.app.session_interface.get_signing_serializer(self.app)
+        try:
+            session = serializer.loads(value)
+        except BadSignature:
+            return True
+        return '_user_id' not in session and '_flashes' not in session
+
+    async def run(self, pool, environ):
+        return await asyncio.get_running_loop().run_in_executor(pool, call_wsgi, self.app, environ)
+
+    async def coalesce(self, environ):
+        """同一 URL (含主机名和协议) 的请求共用正在进行的渲染, 共用的响应去掉 Set-Cookie"""
+        key = (environ['REQUEST_METHOD'], environ['wsgi.url_scheme'], environ.get('HTTP_HOST'),
+               environ['PATH_INFO'], environ['QUERY_STRING'])
+        future = self.inflight.get(key)
+        if future is None:
+            future = self.inflight[key] = asyncio.ensure_future(self.run(self.read_pool, environ))
+            future.add_done_callback(lambda done: self.inflight.pop(key, None))
+            return await asyncio.shield(future)
+
+        self.coalesced += 1
+        status, headers, body = await asyncio.shield(future)
+        return status, [(name, value) for name, value in headers if name != b'set-cookie'], body
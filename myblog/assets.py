@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+
+from flask import current_app, request, send_from_directory, url_for
+from markupsafe import Markup
+
+try:
+    import brotli
+except ImportError:  # 没有安装 brotli 时只生成 gzip 版本
+    brotli = None
+
+try:
+    import rcssmin
+    import rjsmin
+except ImportError:  # 没有安装压缩工具时直接合并, 大部分源文件本身已经压缩过
+    rcssmin = rjsmin = None
+
+DIST_DIR = 'dist'
+
+# 每个页面需要的文件合并为一个, 顺序即加载顺序
+BUNDLES = {
+    'base.css': ['css/bootstrap.min.css', 'fontawesome-free/css/all.min.css', 'css/clean-blog.css'],
+    'base.js': ['js/jquery.min.js', 'js/bootstrap.bundle.min.js', 'js/clean-blog.min.js'],
+    'editormd-view.js': ['editormd/lib/marked.min.js', 'editormd/lib/prettify.min.js',
+                         'editormd/lib/raphael.min.js', 'editormd/lib/underscore.min.js',
+                         'editormd/lib/sequence-diagram.min.js', 'editormd/lib/flowchart.min.js',
+                         'editormd/lib/jquery.flowchart.min.js', 'editormd/editormd.min.js'],
+}
+
+# 单独引用的文件只加上内容摘要
+SINGLES = ['editormd/css/editormd.preview.min.css', 'js/moment-with-locales.min.js', 'lib/L2Dwidget.min.js']
+
+_css_url = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+_source_map = re.compile(r'^\s*//[#@] sourceMappingURL=.*$|/\*[#@] sourceMappingURL=.*?\*/', re.M)
+
+
+def _rewrite_css_urls(css, source, output_dir):
+    """构建后的 CSS 位于 dist 目录下, 把其中的相对路径改为相对于新的位置"""
+    directory = posixpath.dirname(source)
+
+    def replace(match):
+        quote, target = match.groups()
+        if target.startswith(('data:', 'http:', 'https:', '//', '/', '#')):
+            return match.group(0)
+        return 'url(%s%s%s)' % (quote, posixpath.relpath(posixpath.normpath(posixpath.join(directory, target)),
+                                                          output_dir), quote)
+    return _css_url.sub(replace, css)
+
+
+def concat(static_folder, name, sources):
+    """读取并合并源文件, 有压缩工具时同时压缩"""
+    output_dir = posixpath.dirname(posixpath.join(DIST_DIR, name))
+    parts = []
+    for source in sources:
+        with open(os.path.join(static_folder, source), encoding='utf-8') as f:
+            text = _source_map.sub('', f.read())
+        if name.endswith('.css'):
+            text = _rewrite_css_urls(text, source, output_dir)
+            parts.append(rcssmin.cssmin(text) if rcssmin else text)
+        else:
+            parts.append(rjsmin.jsmin(text) if rjsmin else text)
+    # 分号避免前一个脚本没有以分号结尾时与下一个脚本连在一起
+    return ('\n' if name.endswith('.css') else ';\n').join(parts).encode('utf-8')
+
+
+def write_asset(static_folder, name, content):
+    """写入带内容摘要的文件以及 .gz 和 .br 版本, 返回 (相对 static 的路径, 各版本的字节数)"""
+    stem, ext = posixpath.splitext(name)
+    path = '%s/%s.%s%s' % (DIST_DIR, stem, hashlib.sha1(content).hexdigest()[:10], ext)
+    full_path = os.path.join(static_folder, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    sizes = dict(raw=len(content))
+    compressed = [('gz', gzip.compress(content, 9, mtime=0))]
+    if brotli is not None:
+        compressed.append(('br', brotli.compress(content, quality=11)))
+    for suffix, data in [('', content)] + compressed:
+        with open(full_path + ('.' + suffix if suffix else ''), 'wb') as f:
+            f.write(data)
+        if suffix:
+            sizes[suffix] = len(data)
+    return path, sizes
+
+
+class Assets(object):
+    """静态资源构建结果: manifest 把源文件名和包名映射到带摘要的文件名, url_for('static') 自动使用映射后的名称,
+    带摘要的文件以 immutable 缓存头返回, 浏览器支持时返回预先压缩的版本"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['assets'] = self.load(app)
+        app.add_template_global(self.bundle)
+        app.before_request(lambda: self.refresh(app))
+
+        @app.url_defaults
+        def hashed_static(endpoint, values):
+            if endpoint == 'static' and 'filename' in values:
+                values['filename'] = app.extensions['assets'].get(values['filename'], values['filename'])
+
+        static = app.view_functions['static']
+
+        def send_static(filename):
+            if not filename.startswith(DIST_DIR + '/'):
+                return static(filename=filename)
+            response = self.send_compressed(app, filename)
+            response.cache_control.public = True
+            response.cache_control.max_age = app.config['MYBLOG_ASSETS_MAX_AGE']
+            response.cache_control.immutable = True
+            return response
+
+        app.view_functions['static'] = send_static
+
+    @staticmethod
+    def manifest_path(app):
+        return os.path.join(app.static_folder, DIST_DIR, 'manifest.json')
+
+    def _mtime(self, app):
+        try:
+            return os.stat(self.manifest_path(app)).st_mtime_ns
+        except OSError:
+            return None
+
+    def load(self, app):
+        app.extensions['assets.mtime'] = self._mtime(app)
+        try:
+            with open(self.manifest_path(app)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def refresh(self, app):
+        """manifest 变化时重新读取, 其他进程执行 flask assets build 后不需要重启"""
+        if self._mtime(app) != app.extensions.get('assets.mtime'):
+            app.extensions['assets'] = self.load(app)
+
+    @staticmethod
+    def send_compressed(app, filename):
+        accepted = request.accept_encodings
+        for suffix, encoding in (('br', 'br'), ('gz', 'gzip')):
+            if accepted[encoding] and os.path.exists(os.path.join(app.static_folder, filename + '.' + suffix)):
+                response = send_from_directory(app.static_folder, filename + '.' + suffix,
+                                               mimetype=mimetypes.guess_type(filename)[0])
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(app.static_folder, filename)
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def build(self, clean=False, bundles=None, singles=None):
+        """构建所有包和单独的文件, 写入 manifest, 返回 [(名称, 路径, 源文件数, 各版本的字节数)]"""
+        app = current_app._get_current_object()
+        static_folder = app.static_folder
+        manifest, results = {}, []
+        for name, sources in sorted((BUNDLES if bundles is None else bundles).items()):
+            path, sizes = write_asset(static_folder, name, concat(static_folder, name, sources))
+            manifest['bundles/' + name] = path
+            results.append((name, path, len(sources), sizes))
+        for source in SINGLES if singles is None else singles:
+            path, sizes = write_asset(static_folder, source, concat(static_folder, source, [source]))
+            manifest[source] = path
+            results.append((source, path, 1, sizes))
+
+        previous = self.load(app)
+        with open(self.manifest_path(app), 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        if clean:
+            self.clean(app, manifest, previous)
+        app.extensions['assets'] = self.load(app)
+        return results
+
+    @staticmethod
+    def clean(app, manifest, previous=None):
+        """删除不在 manifest 中的旧文件; 上一次构建的文件总是保留, 还没有重新读取 manifest 的进程和缓存的页面仍在引用"""
+        keep = set(manifest.values()) | set((previous or {}).values())
+        root = os.path.join(app.static_folder, DIST_DIR)
+        for directory, dirs, files in os.walk(root):
+            for name in files:
+                path = posixpath.join(DIST_DIR, os.path.relpath(os.path.join(directory, name), root)
+                                      .replace(os.sep, '/'))
+                if name != 'manifest.json' and re.sub(r'\.(gz|br)$', '', path) not in keep:
+                    os.remove(os.path.join(directory, name))
+
+    def bundle(self, name):
+        """输出一个包的标签: 构建过时只有一个带摘要的文件, 否则逐个引用源文件"""
+        manifest = current_app.extensions['assets']
+        filenames = ['bundles/' + name] if 'bundles/' + name in manifest else BUNDLES[name]
+        template = '<link rel="stylesheet" href="%s">' if name.endswith('.css') else '<script src="%s"></script>'
+        return Markup('\n'.join(template % url_for('static', filename=filename) for filename in filenames))
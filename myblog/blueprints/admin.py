@@ -6,9 +6,14 @@ from datetime import datetime
 from flask import render_template, flash, redirect, url_for, request, current_app, Blueprint
 from flask_login import login_required, current_user
 
-from myblog.extensions import db
+from myblog.extensions import db, site_context, page_cache, query_profiler, request_timer
 from myblog.forms import SettingForm, PostForm, CategoryForm, TopicForm, ThoughtForm
-from myblog.models import Post, Category, Topic, Comment, Thought
+from myblog.models import Admin, Post, Category, Topic, Comment, Thought, Job
+from myblog import counters
+from myblog.pagination import keyset_paginate, paginate_with_total
+from myblog.render import hash_body
+from myblog.queries import manage_post_listing, post_detail, topic_summaries
+from myblog.tasks import task_queue
 from myblog.utils import redirect_back
 
 
@@ -20,11 +25,15 @@ def settings():
     form = SettingForm()
 
     if form.validate_on_submit():
-        current_user.name = form.name.data
-        current_user.blog_title = form.blog_title.data
-        current_user.about = form.about.data
+        # current_user 是缓存的快照, 修改需要加载数据库中的管理员
+        admin = Admin.query.get_or_404(current_user.id)
+        admin.name = form.name.data
+        admin.blog_title = form.blog_title.data
+        admin.about = form.about.data
 
         db.session.commit()
+        site_context.invalidate()
+        page_cache.clear()
         
         flash('Setting updated.', 'success')
 
@@ -47,6 +56,7 @@ def new_thought():
         thought = Thought(body=body)
         db.session.add(thought)
         db.session.commit()
+        page_cache.purge('blog.thought')
         flash('Thought created.', 'success')
     
         return redirect(url_for('blog.thought'))
@@ -59,7 +69,8 @@ def new_thought():
 def manage_thought():
     page = request.args.get('page', 1, type=int)
     per_page = current_app.config['MYBLOG_MANAGE_THOUGHT_PER_PAGE']
-    pagination = Thought.query.order_by(Thought.timestamp.desc()).paginate(page, per_page=per_page)
+    pagination = paginate_with_total(Thought.query.order_by(Thought.timestamp.desc()), page, per_page,
+                                     counters.get('thought'))
     thoughts = pagination.items
 
     return render_template('admin/manage_thought.html', page=page, pagination=pagination, thoughts=thoughts)
@@ -72,7 +83,9 @@ def edit_thought(thought_id):
     
     if form.validate_on_submit():
         thought.body = form.body.data
+        thought.update_time = datetime.utcnow()
         db.session.commit()
+        page_cache.purge('blog.thought')
         flash('Thought updated.', 'success')
         return redirect(url_for('blog.thought'))
 
@@ -85,6 +98,7 @@ def delete_thought(thought_id):
     thought = Thought.query.get_or_404(thought_id)
     db.session.delete(thought)
     db.session.commit()
+    page_cache.purge('blog.thought')
     flash('Thought deleted.', 'success')
     return redirect_back()
 
@@ -93,8 +107,8 @@ def delete_thought(thought_id):
 @login_required
 def manage_post():
     page = request.args.get('page', 1, type=int)
-    pagination = Post.query.order_by(Post.create_time.desc()).paginate(
-        page, per_page=current_app.config['MYBLOG_MANAGE_POST_PER_PAGE'])
+    pagination = paginate_with_total(manage_post_listing(), page, current_app.config['MYBLOG_MANAGE_POST_PER_PAGE'],
+                                     counters.get('post'))
     posts = pagination.items
 
     return render_template('admin/manage_post.html', page=page, pagination=pagination, posts=posts)
@@ -117,7 +131,8 @@ def new_post():
         # category_id = form.category.data
         # post = Post(title=title, body=body, category_id=category_id)
         db.session.add(post)
-        db.session.commit()
+        db.session.flush()
+        task_queue.enqueue('post.render', post_id=post.id)
 
         img_list = request.files.getlist('image')
         img_path = current_app.root_path  + '/static/img/' + str(topic.name)
@@ -126,6 +141,9 @@ def new_post():
             for f in img_list:
                 filename = f.filename
                 f.save(os.path.join(img_path, filename))
+                task_queue.enqueue('images.process', relpath='%s/%s' % (topic.name, filename))
+        db.session.commit()
+        page_cache.purge_post(post)
 
         flash('Post created.', 'success')
         return redirect(url_for('blog.show_post', post_id=post.id))
@@ -137,21 +155,28 @@ def new_post():
 @login_required
 def edit_post(post_id):
     form = PostForm()
-    post = Post.query.get_or_404(post_id)
+    post = post_detail().get_or_404(post_id)
     
     if form.validate_on_submit():
+        page_cache.purge_post(post)
         post.title = form.title.data
         post.subtitle = form.subtitle.data
         post.body = form.body.data
         post.update_time = datetime.utcnow()
         post.category = Category.query.get(form.category.data)
         post.topic = Topic.query.get(form.topic.data)
-        db.session.commit()
+        if hash_body(post.body) != post.body_hash:
+            # 渲染完成前文章页由浏览器渲染, 不会显示旧的内容
+            post.body_html = post.toc_html = None
+            task_queue.enqueue('post.render', post_id=post.id)
 
         img_path = current_app.root_path  + '/static/img/' + str(post.topic.name)
         for f in request.files.getlist('image'):
             filename = f.filename
             f.save(os.path.join(img_path, filename))
+            task_queue.enqueue('images.process', relpath='%s/%s' % (post.topic.name, filename))
+        db.session.commit()
+        page_cache.purge_post(post)
 
         flash('Post updated.', 'success')
         return redirect(url_for('blog.show_post', post_id=post.id))
@@ -168,6 +193,7 @@ def edit_post(post_id):
 @login_required
 def delete_post(post_id):
     post = Post.query.get_or_404(post_id)
+    page_cache.purge_post(post)
     db.session.delete(post)
     db.session.commit()
     flash('Post deleted.', 'success')
@@ -185,6 +211,7 @@ def set_comment(post_id):
         post.can_comment = True
         flash('Comment enabled.', 'success')
     db.session.commit()
+    page_cache.purge('blog.show_post', post_id=post_id)
     return redirect_back()
 
 
@@ -192,18 +219,21 @@ def set_comment(post_id):
 @login_required
 def manage_comment():
     filter_rule = request.args.get('filter', 'all')  # 'all', 'unreviewed', 'admin'
-    page = request.args.get('page', 1, type=int)
     per_page = current_app.config['MYBLOG_COMMENT_PER_PAGE']
     if filter_rule == 'unread':
         filtered_comments = Comment.query.filter_by(reviewed=False)
+        total = counters.get('comment.unreviewed')
     elif filter_rule == 'admin':
         filtered_comments = Comment.query.filter_by(from_admin=True)
+        total = counters.get('comment.admin')
     else:
         filtered_comments = Comment.query
+        total = counters.get('comment')
 
-    pagination = filtered_comments.order_by(Comment.timestamp.desc()).paginate(page, per_page=per_page)
+    pagination = keyset_paginate(filtered_comments, Comment.timestamp, Comment.id, per_page)
     comments = pagination.items
-    return render_template('admin/manage_comment.html', comments=comments, pagination=pagination)
+    return render_template('admin/manage_comment.html', comments=comments, pagination=pagination,
+                           total=total)
 
 
 @admin_bp.route('/comment/<int:comment_id>/approve', methods=['POST'])
@@ -212,6 +242,7 @@ def approve_comment(comment_id):
     comment = Comment.query.get_or_404(comment_id)
     comment.reviewed = True
     db.session.commit()
+    page_cache.purge('blog.show_post', post_id=comment.post_id)
     flash('Comment published.', 'success')
     return redirect_back()
 
@@ -220,8 +251,10 @@ def approve_comment(comment_id):
 @login_required
 def delete_comment(comment_id):
     comment = Comment.query.get_or_404(comment_id)
+    post_id = comment.post_id
     db.session.delete(comment)
     db.session.commit()
+    page_cache.purge('blog.show_post', post_id=post_id)
     flash('Comment deleted.', 'success')
     return redirect_back()
 
@@ -229,7 +262,7 @@ def delete_comment(comment_id):
 @admin_bp.route('/topic/manage')
 @login_required
 def manage_topic():
-    return render_template('admin/manage_topic.html')
+    return render_template('admin/manage_topic.html', topics=topic_summaries())
 
 
 @admin_bp.route('/topic/new', methods=['GET', 'POST'])
@@ -244,11 +277,13 @@ def new_topic():
         description = form.description.data
         topic = Topic(name=name, category=category, theme=theme, description=description)
         db.session.add(topic)
-        db.session.commit()
 
         img_path = current_app.root_path  + '/static/img/' + str(topic.name)
-        os.mkdir(img_path)  
+        os.makedirs(img_path, exist_ok=True)
         image.save(os.path.join(img_path, theme))
+        task_queue.enqueue('images.process', relpath='%s/%s' % (topic.name, theme))
+        db.session.commit()
+        site_context.invalidate()
 
         flash('Topic created.', 'success')
         return redirect(url_for('.manage_topic'))
@@ -270,6 +305,8 @@ def edit_topic(topic_id):
         topic.category = Category.query.get(form.category.data)
         topic.description = form.description.data
         db.session.commit()
+        site_context.invalidate()
+        page_cache.purge_topic(topic.id)
         flash('Topic updated.', 'success')
         return redirect(url_for('.manage_topic'))
 
@@ -287,6 +324,79 @@ def delete_topic(topic_id):
         flash('You can not delete the default topic.', 'warning')
         return redirect(url_for('blog.index'))
 
+    page_cache.purge_topic(topic.id)
     topic.delete()
+    site_context.invalidate()
+    page_cache.purge('blog.show_topic', topic_id=1)
     flash('Topic deleted.', 'success')
-    return redirect(url_for('.manage_topic'))
\ No newline at end of file
+    return redirect(url_for('.manage_topic'))
+
+
+@admin_bp.route('/topic/<int:topic_id>/merge', methods=['POST'])
+@login_required
+def merge_topic(topic_id):
+    topic = Topic.query.get_or_404(topic_id)
+    target = Topic.query.get_or_404(request.form.get('target', type=int))
+    if topic.id == 1 or target.id == topic.id:
+        flash('You can not merge this topic.', 'warning')
+        return redirect(url_for('.manage_topic'))
+
+    page_cache.purge_topic(topic.id)
+    moved = topic.merge_into(target)
+    site_context.invalidate()
+    page_cache.purge('blog.show_topic', topic_id=target.id)
+    flash('Topic merged, %d posts moved.' % moved, 'success')
+    return redirect(url_for('.manage_topic'))
+
+
+@admin_bp.route('/stats/queries')
+@login_required
+def query_stats():
+    endpoint = request.args.get('view')
+    rows = query_profiler.report(endpoint, limit=100)
+    return render_template('admin/query_stats.html', rows=rows, endpoint=endpoint,
+                           sample_rate=current_app.config['MYBLOG_QUERY_SAMPLE_RATE'])
+
+
+@admin_bp.route('/stats/queries/reset', methods=['POST'])
+@login_required
+def reset_query_stats():
+    query_profiler.reset()
+    flash('Query statistics cleared.', 'success')
+    return redirect(url_for('.query_stats'))
+
+
+@admin_bp.route('/stats/timing')
+@login_required
+def timing_stats():
+    endpoint = request.args.get('view')
+    return render_template('admin/timing_stats.html', rows=request_timer.report(endpoint), endpoint=endpoint,
+                           window=current_app.config['MYBLOG_TIMING_WINDOW'])
+
+
+@admin_bp.route('/stats/timing/reset', methods=['POST'])
+@login_required
+def reset_timing_stats():
+    request_timer.reset()
+    flash('Timing histograms cleared.', 'success')
+    return redirect(url_for('.timing_stats'))
+
+
+@admin_bp.route('/stats/tasks')
+@login_required
+def task_stats():
+    jobs = Job.query.filter(Job.status != 'done').order_by(Job.id.desc()).limit(50).all()
+    return render_template('admin/task_stats.html', stats=task_queue.stats(), jobs=jobs,
+                           workers=current_app.config['MYBLOG_TASK_WORKERS'])
+
+
+@admin_bp.route('/stats/tasks/<int:job_id>/retry', methods=['POST'])
+@login_required
+def retry_task(job_id):
+    job = Job.query.get_or_404(job_id)
+    if job.status != 'failed':
+        flash('Only failed tasks can be retried.', 'warning')
+    else:
+        task_queue.retry(job)
+        flash('Task queued again.', 'success')
+    return redirect(url_for('.task_stats'))
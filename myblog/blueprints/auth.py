@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
 
-from flask import render_template, flash, redirect, url_for, Blueprint
+from flask import render_template, flash, redirect, request, url_for, Blueprint
 from flask_login import login_user, logout_user, login_required, current_user
 
+from myblog.extensions import db, login_guard
 from myblog.forms import LoginForm
 from myblog.models import Admin
 from myblog.utils import redirect_back
@@ -18,20 +19,36 @@ def login():
         return redirect(url_for('blog.index'))
 
     form = LoginForm()
+    ip = request.remote_addr
+
+    # 被限制的 IP 在查询数据库和计算哈希之前就被拒绝
+    wait = login_guard.retry_after(ip) if request.method == 'POST' else 0
+    if wait:
+        return too_many_attempts(form, wait)
 
     if form.validate_on_submit():
         username = form.username.data
         password = form.password.data
         remember = form.remember.data
+
+        wait = login_guard.retry_after(ip, username)
+        if wait:
+            return too_many_attempts(form, wait)
+
         admin = Admin.query.first()
 
         if admin:
-            if username == admin.username and admin.validate_password(password):
+            if login_guard.verify(admin, username, password):
+                if admin.needs_rehash():
+                    admin.set_password(password)
+                    db.session.commit()
+                login_guard.succeeded(ip, username)
                 login_user(admin, remember)
                 flash('Welcome back.', 'info')
 
                 return redirect_back()
 
+            login_guard.failed(ip, username)
             flash('Invalid username or password.', 'warning')
         else:
             flash('No account.', 'warning')
@@ -39,6 +56,11 @@ def login():
     return render_template('auth/login.html', form=form)
 
 
+def too_many_attempts(form, wait):
+    flash('Too many failed logins, please try again in %d minutes.' % ((wait + 59) // 60), 'warning')
+    return render_template('auth/login.html', form=form), 429, {'Retry-After': str(wait)}
+
+
 @auth_bp.route('/logout')
 @login_required
 def logout():
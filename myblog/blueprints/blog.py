@@ -1,78 +1,120 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
 
-from flask import render_template, flash, redirect, url_for, request, current_app, Blueprint
+from flask import render_template, flash, redirect, url_for, request, current_app, Blueprint, abort, jsonify
 from flask_login import login_required, current_user
+from flask_wtf.csrf import generate_csrf
 
-from myblog.extensions import db
+from myblog.extensions import db, page_cache
 from myblog.forms import ThoughtForm, SettingForm, PostForm, CategoryForm, TopicForm, AdminCommentForm, CommentForm
 from myblog.models import Post, Category, Topic, Comment, Thought
+from myblog.conditional import conditional, posts_validator, post_validator, thoughts_validator, \
+    archive_validator
+from myblog import counters
+from myblog.pagination import keyset_paginate, paginate_with_total
+from myblog.queries import post_listing, post_detail, archive_index, archive_posts
+from myblog.search import search_index
 from myblog.utils import redirect_back
 
 
 blog_bp = Blueprint('blog', __name__)
 
 @blog_bp.route('/', methods=['GET', 'POST'])
+@page_cache.cached
+@conditional(posts_validator)
 def index():
     page = request.args.get('page', 1, type=int)
     per_page = current_app.config['MYBLOG_POST_PER_PAGE']
-    pagination = Post.query.order_by(Post.create_time.desc()).paginate(page, per_page=per_page)
+    pagination = paginate_with_total(post_listing(), page, per_page, counters.get('post'))
     posts = pagination.items
 
     return render_template('blog/index.html', pagination=pagination, posts=posts)
 
 
+@blog_bp.route('/search')
+def search():
+    q = request.args.get('q', '').strip()
+    if not q:
+        flash('Enter keyword about post, thought or comment.', 'warning')
+        return redirect_back()
+
+    kind = request.args.get('kind')
+    page = request.args.get('page', 1, type=int)
+    per_page = current_app.config['MYBLOG_SEARCH_RESULT_PER_PAGE']
+    pagination, terms = search_index.search(q, kind, page, per_page)
+    return render_template('blog/search.html', q=q, kind=kind, pagination=pagination, results=pagination.items)
+
+
 @blog_bp.route('/about')
 def about():
     return render_template('blog/about.html')
 
 
 @blog_bp.route('/thought')
+@page_cache.cached
+@conditional(thoughts_validator)
 def thought():
-    page = request.args.get('page', 1, type=int)
     per_page = current_app.config['MYBLOG_THOUGHT_PER_PAGE']
-    pagination = Thought.query.order_by(Thought.timestamp.desc()).paginate(page, per_page=per_page)
+    pagination = keyset_paginate(Thought.query, Thought.timestamp, Thought.id, per_page)
     thoughts = pagination.items
 
     return render_template('blog/thought.html', thoughts=thoughts, pagination=pagination)
 
 @blog_bp.route('/archive')
-def archive():
-    page = request.args.get('page', 1, type=int)
-    pagination = Post.query.order_by(Post.create_time.desc()).paginate(page, per_page=100)
-    posts = pagination.items
-
-    return render_template('blog/archive.html', posts=posts, pagination=pagination)
+@blog_bp.route('/archive/<int:year>/<int:month>')
+@page_cache.cached
+@conditional(archive_validator)
+def archive(year=None, month=None):
+    years = archive_index()
+    if year is None:
+        if years:
+            year, month = years[0].year, years[0].months[0].month
+    elif not any(item.year == year and item.month == month for entry in years for item in entry.months):
+        abort(404)
+
+    pagination = None
+    posts = []
+    if year is not None:
+        pagination = archive_posts(year, month, current_app.config['MYBLOG_ARCHIVE_PER_PAGE'])
+        posts = pagination.items
+    return render_template('blog/archive.html', years=years, year=year, month=month, posts=posts,
+                           pagination=pagination)
 
 
 @blog_bp.route('/category/<int:category_id>')
+@page_cache.cached
+@conditional(posts_validator)
 def show_category(category_id):
     category = Category.query.get_or_404(category_id)
     page = request.args.get('page', 1, type=int)
     per_page = current_app.config['MYBLOG_POST_PER_PAGE']
-    pagination = Post.query.with_parent(category).order_by(Post.create_time.desc()).paginate(page, per_page)
+    pagination = paginate_with_total(post_listing(category), page, per_page, category.post_count)
     posts = pagination.items
 
     return render_template('blog/category.html', category=category, pagination=pagination, posts=posts)
 
 
 @blog_bp.route('/topic/<int:topic_id>')
+@page_cache.cached
+@conditional(posts_validator)
 def show_topic(topic_id):
     topic = Topic.query.get_or_404(topic_id)
     page = request.args.get('page', 1, type=int)
     per_page = current_app.config['MYBLOG_POST_PER_PAGE']
-    pagination = Post.query.with_parent(topic).order_by(Post.create_time.desc()).paginate(page, per_page)
+    pagination = paginate_with_total(post_listing(topic), page, per_page, topic.post_count)
     posts = pagination.items
 
     return render_template('blog/topic.html', topic=topic, pagination=pagination, posts=posts)
 
 
 @blog_bp.route('/post/<int:post_id>', methods=['GET', 'POST'])
+@page_cache.cached
+@conditional(post_validator)
 def show_post(post_id):
-    post = Post.query.get_or_404(post_id)
+    post = post_detail().get_or_404(post_id)
     page = request.args.get('page', 1, type=int)
     per_page = current_app.config['MYBLOG_COMMENT_PER_PAGE']
-    pagination = Comment.query.with_parent(post).filter_by(reviewed=True).order_by(Comment.timestamp.asc()).paginate(page, per_page)
+    pagination, comment_tree = post.comment_tree(page, per_page)
     comments = pagination.items
 
     if current_user.is_authenticated:
@@ -82,7 +124,8 @@ def show_post(post_id):
         from_admin = True
         reviewed = True
     else:
-        form = CommentForm()
+        # 访客看到的文章页不带 CSRF 令牌, 这样可以被整页缓存, 令牌由页面脚本从 csrf_token 取回; 提交时照常校验
+        form = CommentForm() if request.method == 'POST' else CommentForm(meta={'csrf': False})
         from_admin = False
         reviewed = False
 
@@ -101,6 +144,8 @@ def show_post(post_id):
             comment.replied = replied_comment
         db.session.add(comment)
         db.session.commit()
+        if reviewed:
+            page_cache.purge('blog.show_post', post_id=post_id)
 
         if current_user.is_authenticated:  # send message based on authentication status
             flash('Comment published.', 'success')
@@ -109,7 +154,15 @@ def show_post(post_id):
 
         return redirect(url_for('.show_post', post_id=post_id))
 
-    return render_template('blog/post.html', post=post, pagination=pagination, form=form, comments=comments)
+    return render_template('blog/post.html', post=post, pagination=pagination, form=form, comments=comments,
+                           comment_tree=comment_tree)
+
+
+@blog_bp.route('/csrf-token')
+def csrf_token():
+    response = jsonify(token=generate_csrf())
+    response.cache_control.no_store = True
+    return response
 
 
 @blog_bp.route('/reply/comment/<int:comment_id>')
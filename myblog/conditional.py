@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+from functools import wraps
+
+from flask import current_app, request, make_response
+from sqlalchemy import func
+from werkzeug.http import is_resource_modified
+
+from myblog.extensions import db, site_context
+from myblog.models import Post, Comment, Thought
+from myblog.utils import is_anonymous_read
+
+
+def conditional(validator):
+    """根据 validator(**view_args) 返回的版本材料和站点上下文的版本生成 ETag,
+    客户端缓存仍然有效时直接返回 304, 不执行视图. 删除和审核较早的内容, 修改设置时最新时间不变,
+    所以不发送 Last-Modified, If-Modified-Since 总是得到完整的响应"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not is_anonymous_read():
+                return f(*args, **kwargs)
+            token = validator(**kwargs)
+            if token is None:
+                return f(*args, **kwargs)
+
+            etag = hashlib.sha1(repr((site_context.get().version, token)).encode('utf-8')).hexdigest()
+            if not is_resource_modified(request.environ, etag=etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.cache_control.no_cache = True
+            return response
+        return decorated_function
+    return decorator
+
+
+def posts_validator(**filters):
+    """文章列表: 最新的创建/修改时间和文章数, 删除文章也会改变版本"""
+    return tuple(db.session.query(
+        func.max(Post.update_time), func.max(Post.create_time), func.count(Post.id)).filter_by(**filters).one())
+
+
+def archive_validator(year=None, month=None):
+    """归档页列出所有年月的文章数, 任何文章改变都会改变版本"""
+    return posts_validator()
+
+
+def post_validator(post_id):
+    """文章页: 文章的修改时间, 以及已审核评论的最新时间和数量"""
+    comments = Comment.query.filter_by(post_id=post_id, reviewed=True)
+    row = db.session.query(
+        Post.update_time, Post.can_comment,
+        comments.with_entities(func.max(Comment.timestamp)).as_scalar(),
+        comments.with_entities(func.count(Comment.id)).as_scalar()).filter(Post.id == post_id).first()
+    return None if row is None else tuple(row)
+
+
+def thoughts_validator():
+    """想法页: 最新的发布/修改时间和想法数, 修改想法也会改变版本"""
+    return tuple(db.session.query(
+        func.max(Thought.timestamp), func.max(Thought.update_time), func.count(Thought.id)).one())
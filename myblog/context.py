@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from collections import namedtuple
+
+from flask_login import UserMixin
+
+from myblog.utils import VersionStamp, cache_path
+
+
+class AdminInfo(UserMixin, namedtuple('AdminInfo', ['id', 'username', 'name', 'blog_title', 'about'])):
+    """快照中的管理员, 同时是 load_user 返回的用户对象, 已登录的请求不再查询管理员;
+    只读, 修改管理员时需要另外加载 Admin"""
+    __slots__ = ()
+
+CategoryInfo = namedtuple('CategoryInfo', ['id', 'name'])
+TopicInfo = namedtuple('TopicInfo', ['id', 'name', 'theme', 'description', 'category_id'])
+
+Snapshot = namedtuple('Snapshot', ['version', 'admin', 'categories', 'topics'])
+
+
+class SiteContext(object):
+    """缓存每个页面都需要的管理员, 类型和话题, 只在版本戳变化时重建; 版本参与公开页面的 ETag"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # 版本戳总是放在缓存目录中, 命令行中的修改也能通知到正在运行的 worker
+        app.extensions['site_context'] = _State(VersionStamp(cache_path(app, 'context.version')))
+
+    @staticmethod
+    def _state():
+        from flask import current_app
+        return current_app.extensions['site_context']
+
+    def get(self):
+        state = self._state()
+        version = state.stamp.read()
+        snapshot = state.snapshot
+        if snapshot is None or version is None or snapshot.version != version:
+            with state.lock:
+                snapshot = state.snapshot
+                if snapshot is None or version is None or snapshot.version != version:
+                    if version is None:
+                        version = state.stamp.bump()
+                    snapshot = state.snapshot = build_snapshot(version)
+        return snapshot
+
+    def invalidate(self):
+        """数据改变后调用, 下一次请求会重建快照"""
+        state = self._state()
+        state.snapshot = None
+        state.stamp.bump()
+
+
+class _State(object):
+
+    def __init__(self, stamp):
+        self.stamp = stamp
+        self.snapshot = None
+        self.lock = threading.Lock()
+
+
+def build_snapshot(version):
+    from myblog.models import Admin, Category, Topic
+
+    admin = Admin.query.first()
+    if admin is not None:
+        admin = AdminInfo(admin.id, admin.username, admin.name, admin.blog_title, admin.about)
+
+    categories = tuple(CategoryInfo(c.id, c.name) for c in Category.query.order_by(Category.id))
+    topics = tuple(TopicInfo(t.id, t.name, t.theme, t.description, t.category_id)
+                   for t in Topic.query.order_by(Topic.name))
+
+    return Snapshot(version, admin, categories, topics)
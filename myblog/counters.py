@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+from collections import defaultdict
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import bindparam, event, extract, func
+from sqlalchemy.orm.attributes import get_history
+
+from myblog.extensions import db
+from myblog.models import Post, Comment, Thought, Topic, Category, Counter, PostMonth
+
+
+def total_queries():
+    """每个全局计数器对应的真实计数查询"""
+    return {
+        'post': Post.query,
+        'comment': Comment.query,
+        'comment.unreviewed': Comment.query.filter_by(reviewed=False),
+        'comment.admin': Comment.query.filter_by(from_admin=True),
+        'thought': Thought.query,
+        'topic': Topic.query,
+    }
+
+
+# 计数列, 被计数一方的外键, 附加条件
+COUNTED_COLUMNS = [
+    (Post.comment_count, Comment.post_id, [Comment.reviewed == True]),
+    (Topic.post_count, Post.topic_id, []),
+    (Category.post_count, Post.category_id, []),
+]
+
+
+def grouped_counts(key, criteria):
+    """一次 GROUP BY 得到每个 id 的真实计数, 代替逐行的关联子查询,
+    后者在数据量大时需要反复扫描整张表"""
+    return db.session.query(key, func.count()).filter(key != None, *criteria).group_by(key)
+
+
+def get(name):
+    """读取全局计数器, 还没有用 flask recount 建立时退回 COUNT(*)"""
+    counter = Counter.query.get(name)
+    if counter is None:
+        return total_queries()[name].count()
+    return counter.value
+
+
+def month_counts():
+    """每个月的真实文章数: {(年, 月): 数量}"""
+    year, month = extract('year', Post.create_time), extract('month', Post.create_time)
+    return dict(((year, month), count) for year, month, count in
+                db.session.query(year, month, func.count()).filter(Post.create_time != None).group_by(year, month))
+
+
+def check_counters():
+    """比较缓存的计数和真实计数, 返回 [(名称, 缓存值, 真实值)]"""
+    mismatches = []
+    for name, query in total_queries().items():
+        counter = Counter.query.get(name)
+        actual = query.count()
+        if counter is None or counter.value != actual:
+            mismatches.append((name, counter.value if counter else None, actual))
+
+    for column, key, criteria in COUNTED_COLUMNS:
+        model = column.class_
+        counts = dict(grouped_counts(key, criteria))
+        for id, cached in db.session.query(model.id, column).order_by(model.id):
+            if cached != counts.get(id, 0):
+                mismatches.append(('%s.%s[%d]' % (model.__tablename__, column.key, id), cached, counts.get(id, 0)))
+
+    cached = dict(((row.year, row.month), row.count) for row in PostMonth.query if row.count)
+    actual = month_counts()
+    for key in sorted(set(cached) | set(actual)):
+        if cached.get(key, 0) != actual.get(key, 0):
+            mismatches.append(('post_month[%d-%02d]' % key, cached.get(key), actual.get(key, 0)))
+    return mismatches
+
+
+def rebuild_counters():
+    """用真实计数重写所有计数器"""
+    for name, query in total_queries().items():
+        db.session.merge(Counter(name=name, value=query.count()))
+    for column, key, criteria in COUNTED_COLUMNS:
+        table = column.class_.__table__
+        column.class_.query.update({column: 0}, synchronize_session=False)
+        counts = [dict(_id=id, _count=count) for id, count in grouped_counts(key, criteria)]
+        if counts:
+            db.session.execute(table.update().where(table.c.id == bindparam('_id'))
+                               .values({column.key: bindparam('_count')}), counts)
+
+    PostMonth.query.delete(synchronize_session=False)
+    months = [dict(year=year, month=month, count=count) for (year, month), count in month_counts().items()]
+    if months:
+        db.session.execute(PostMonth.__table__.insert(), months)
+    db.session.commit()
+
+
+def adjust(totals=None, columns=None):
+    """批量 UPDATE/DELETE 不会触发 flush 事件, 由调用者在同一事务中显式调整计数器"""
+    deltas = _Deltas()
+    deltas.totals.update(totals or {})
+    deltas.columns.update(columns or {})
+    deltas.apply(db.session.connection())
+
+
+def _state(obj, attrs, old):
+    values = []
+    for attr in attrs:
+        history = get_history(obj, attr)
+        if old and history.deleted:
+            values.append(history.deleted[0])
+        elif old and history.unchanged:
+            values.append(history.unchanged[0])
+        elif old and history.added:
+            values.append(None)
+        else:
+            values.append(getattr(obj, attr))
+    return values
+
+
+def _changed(obj, attrs):
+    return any(get_history(obj, attr).has_changes() for attr in attrs)
+
+
+class _Deltas(object):
+
+    def __init__(self):
+        self.totals = defaultdict(int)
+        self.columns = defaultdict(int)
+        self.months = defaultdict(int)
+
+    def add(self, obj, sign, old=False):
+        if isinstance(obj, Comment):
+            post_id, reviewed, from_admin = _state(obj, ['post_id', 'reviewed', 'from_admin'], old)
+            self.totals['comment'] += sign
+            if not reviewed:
+                self.totals['comment.unreviewed'] += sign
+            if from_admin:
+                self.totals['comment.admin'] += sign
+            if reviewed and post_id is not None:
+                self.columns[(Post.comment_count, post_id)] += sign
+        elif isinstance(obj, Post):
+            topic_id, category_id, create_time = _state(obj, ['topic_id', 'category_id', 'create_time'], old)
+            self.totals['post'] += sign
+            if create_time is not None:
+                self.months[(create_time.year, create_time.month)] += sign
+            if topic_id is not None:
+                self.columns[(Topic.post_count, topic_id)] += sign
+            if category_id is not None:
+                self.columns[(Category.post_count, category_id)] += sign
+        elif isinstance(obj, Thought):
+            self.totals['thought'] += sign
+        elif isinstance(obj, Topic):
+            self.totals['topic'] += sign
+
+    def apply(self, connection):
+        table = Counter.__table__
+        for name, delta in self.totals.items():
+            if delta:
+                connection.execute(table.update().where(table.c.name == name)
+                                   .values(value=table.c.value + delta))
+        for (column, id), delta in self.columns.items():
+            if delta:
+                table = column.class_.__table__
+                connection.execute(table.update().where(table.c.id == id)
+                                   .values({column.key: func.coalesce(table.c[column.key], 0) + delta}))
+        table = PostMonth.__table__
+        for (year, month), delta in self.months.items():
+            if delta:
+                result = connection.execute(table.update().where((table.c.year == year) & (table.c.month == month))
+                                            .values(count=table.c.count + delta))
+                if not result.rowcount:
+                    connection.execute(table.insert().values(year=year, month=month, count=delta))
+
+
+TRACKED = {Comment: ['post_id', 'reviewed', 'from_admin'], Post: ['topic_id', 'category_id', 'create_time']}
+
+
+@event.listens_for(SignallingSession, 'after_flush')
+def update_counters(session, flush_context):
+    """在同一个事务中根据本次 flush 的新增, 删除和修改更新计数器"""
+    deltas = _Deltas()
+    for obj in session.new:
+        deltas.add(obj, 1)
+    for obj in session.deleted:
+        deltas.add(obj, -1, old=True)
+    for obj in session.dirty:
+        attrs = TRACKED.get(type(obj))
+        if attrs and _changed(obj, attrs):
+            deltas.add(obj, -1, old=True)
+            deltas.add(obj, 1)
+    deltas.apply(session.connection())
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, _EngineConnector
+from sqlalchemy import event, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+# 数据库引擎的配置方案: 连接时执行的 SQLite PRAGMA, 写连接池, 以及可选的只读连接池
+PROFILES = {
+    'default': dict(pragmas=[], pool={}, read_pool=None),
+    'sqlite-development': dict(
+        pragmas=[('journal_mode', 'WAL'), ('busy_timeout', 5000)],
+        pool=dict(pool_size=2, max_overflow=5),
+        read_pool=None),
+    'sqlite-production': dict(
+        # WAL 让读和写互不阻塞; NORMAL 在 WAL 下只在检查点时 fsync, 断电最多丢失最后几个事务, 不会损坏数据库
+        pragmas=[('journal_mode', 'WAL'), ('synchronous', 'NORMAL'), ('busy_timeout', 5000),
+                 ('cache_size', -32000), ('mmap_size', 256 * 1024 * 1024), ('temp_store', 'MEMORY')],
+        # SQLite 同时只有一个写者, 写连接少一些, 读连接多一些
+        pool=dict(pool_size=2, max_overflow=3, pool_timeout=10),
+        read_pool=dict(pool_size=5, max_overflow=10, pool_timeout=10)),
+}
+
+
+def get_profile(app):
+    profile = dict(PROFILES[app.config['MYBLOG_DB_PROFILE']])
+    pragmas = list(profile['pragmas'])
+    overrides = app.config['MYBLOG_DB_PRAGMAS'] or {}
+    profile['pragmas'] = [(name, overrides.get(name, value)) for name, value in pragmas] + \
+        [(name, value) for name, value in sorted(overrides.items()) if name not in dict(pragmas)]
+    return profile
+
+
+def apply_pragmas(engine, pragmas):
+    """每个新连接都执行 PRAGMA; journal_mode 等保存在数据库文件中, 其余只对该连接有效"""
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
+
+
+def is_read_only_view():
+    """读者的只读视图: 配置的蓝本中的 GET 和 HEAD 请求"""
+    return has_request_context() and request.method in ('GET', 'HEAD') and \
+        request.blueprint in current_app.config['MYBLOG_DB_READ_BLUEPRINTS']
+
+
+class RoutingSession(SignallingSession):
+    """只读视图中的查询使用只读连接池, flush 仍然使用写连接池"""
+
+    def __init__(self, db, **options):
+        self.db = db
+        SignallingSession.__init__(self, db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and g.get('db_read_only'):
+            engine = self.db.get_read_engine(self.app)
+            if engine is not None:
+                return engine
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class ProfiledSQLAlchemy(SQLAlchemy):
+    """按 MYBLOG_DB_PROFILE 选择的方案创建引擎: SQLite 文件数据库使用连接池而不是每次新建连接,
+    每个连接执行方案中的 PRAGMA; 方案带有只读连接池时, 只读视图的查询不占用写连接"""
+
+    def init_app(self, app):
+        app.extensions['db_profile'] = _State()
+        super(ProfiledSQLAlchemy, self).init_app(app)
+
+        @app.before_request
+        def route_reads():
+            g.db_read_only = is_read_only_view()
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        super(ProfiledSQLAlchemy, self).apply_driver_hacks(app, sa_url, options)
+        profile = get_profile(app)
+        if sa_url.drivername != 'sqlite':
+            options.update(profile['pool'])
+            return
+        options['pragmas'] = profile['pragmas']
+        if sa_url.database not in (None, '', ':memory:') and profile['pool']:
+            # 连接池中的连接会被不同线程取出, 同一时刻只有一个线程使用
+            options['poolclass'] = QueuePool
+            options.setdefault('connect_args', {})['check_same_thread'] = False
+            options.update(profile['pool'])
+
+    def create_engine(self, sa_url, engine_opts):
+        pragmas = engine_opts.pop('pragmas', None)
+        engine = super(ProfiledSQLAlchemy, self).create_engine(sa_url, engine_opts)
+        if pragmas:
+            apply_pragmas(engine, pragmas)
+        return engine
+
+    def get_read_engine(self, app=None):
+        """只读连接池, 方案没有只读连接池时返回 None; 默认连接同一个数据库, SQLite 连接设置 query_only"""
+        app = self.get_app(app)
+        read_pool = get_profile(app)['read_pool']
+        if not read_pool:
+            return None
+        uri = app.config['MYBLOG_DB_READ_URI'] or app.config['SQLALCHEMY_DATABASE_URI']
+        if make_url(uri).database in (None, '', ':memory:'):
+            return None
+        state = app.extensions['db_profile']
+        with state.lock:
+            if state.read_uri != uri:
+                sa_url = make_url(uri)
+                options = _EngineConnector(self, app).get_options(sa_url, app.config['SQLALCHEMY_ECHO'])
+                options.update(read_pool)
+                if sa_url.drivername == 'sqlite':
+                    options['pragmas'] = options.get('pragmas', []) + [('query_only', 1)]
+                state.read_engine, state.read_uri = self.create_engine(sa_url, options), uri
+            return state.read_engine
+
+
+class _State(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.read_engine = None
+        self.read_uri = None
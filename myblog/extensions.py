@@ -4,26 +4,43 @@ from flask_bootstrap import Bootstrap
 from flask_login import LoginManager
 from flask_moment import Moment
 from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
 from flask_wtf import CSRFProtect
 from flask_debugtoolbar import DebugToolbarExtension
 from flask_sslify import SSLify
 
+from myblog.assets import Assets
+from myblog.context import SiteContext
+from myblog.database import ProfiledSQLAlchemy
+from myblog.images import ImagePipeline
+from myblog.pagecache import PageCache
+from myblog.profiler import QueryProfiler
+from myblog.security import LoginGuard
+from myblog.timing import RequestTimer
+
 bootstrap = Bootstrap()
-db = SQLAlchemy()
+db = ProfiledSQLAlchemy()
 login_manager = LoginManager()
 csrf = CSRFProtect()
 moment = Moment()
 toolbar = DebugToolbarExtension()
 migarte = Migrate()
+site_context = SiteContext()
+page_cache = PageCache()
+query_profiler = QueryProfiler()
+request_timer = RequestTimer()
+image_pipeline = ImagePipeline()
+static_assets = Assets()
+login_guard = LoginGuard()
 #sslify = SSLify()
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    from myblog.models import Admin
-    user = Admin.query.get(int(user_id))
-    return user
+    """使用页面上下文快照中的管理员, 修改管理员后调用 site_context.invalidate()"""
+    admin = site_context.get().admin
+    if admin is not None and str(admin.id) == user_id:
+        return admin
+    return None
 
 login_manager.login_view = 'auth.login'
 
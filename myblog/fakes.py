@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
 import random
+import time
+from datetime import datetime, timedelta
+from itertools import islice
 
 from faker import Faker
+from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError
 
 from myblog.extensions import db
@@ -122,4 +126,123 @@ def fake_thoughts(count=20):
 
         db.session.add(thought)
 
-    db.session.commit()
\ No newline at end of file
+    db.session.commit()
+
+
+def _chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class _Pool(object):
+    """Faker 每次调用约需几百微秒, 批量模式先生成固定数量的样本再随机抽取"""
+
+    def __init__(self, factory, size=1000):
+        self.values = [factory() for i in range(max(min(size, 1000), 1))]
+
+    def __call__(self):
+        return random.choice(self.values)
+
+
+def _random_time(days):
+    return datetime.utcnow() - timedelta(seconds=random.randint(0, days * 86400))
+
+
+def bulk_insert(model, rows, total, batch=10000, progress=None):
+    """分批用 Core INSERT 写入 rows (字典生成器), 每批提交一次, 内存中只保留一批,
+    progress(已写入, 总数, 秒数) 用于报告进度"""
+    start = time.perf_counter()
+    done = 0
+    for chunk in _chunks(rows, batch):
+        db.session.execute(model.__table__.insert(), chunk)
+        db.session.commit()
+        done += len(chunk)
+        if progress is not None:
+            progress(done, total, time.perf_counter() - start)
+    return done
+
+
+def _id_range(model):
+    """批量生成的数据 id 连续, 只取最小和最大 id, 不把所有 id 读进内存"""
+    low, high = db.session.query(func.min(model.id), func.max(model.id)).one()
+    if low is None:
+        raise RuntimeError('No %s found, generate them first.' % model.__tablename__)
+    return low, high
+
+
+def bulk_topics(count=8, batch=10000, progress=None):
+    category_ids = [id for id, in db.session.query(Category.id).order_by(Category.id)]
+    offset = db.session.query(func.count(Topic.id)).scalar()
+    rows = (dict(name=('%s-%d' % (fake.word(), offset + i))[:20],
+                 category_id=category_ids[i % len(category_ids)],
+                 description=('%d %s' % (offset + i, fake.sentence()))[:255],
+                 post_count=0)
+            for i in range(count))
+    return bulk_insert(Topic, rows, count, batch, progress)
+
+
+def bulk_posts(count=50, batch=10000, progress=None):
+    topics = db.session.query(Topic.id, Topic.category_id).all()
+    if not topics:
+        raise RuntimeError('No topic found, generate them first.')
+
+    title, subtitle, body = _Pool(lambda: fake.text(60), count), _Pool(lambda: fake.text(255), count), \
+        _Pool(lambda: fake.text(2000), min(count, 200))
+
+    def rows():
+        for i in range(count):
+            topic_id, category_id = random.choice(topics)
+            create_time = _random_time(3650)
+            yield dict(title=title(), subtitle=subtitle(), body=body(),
+                       category_id=category_id, topic_id=topic_id,
+                       create_time=create_time, update_time=create_time,
+                       can_comment=True, comment_count=0)
+
+    return bulk_insert(Post, rows(), count, batch, progress)
+
+
+def bulk_comments(count=500, batch=10000, progress=None):
+    """与 fake_comments 的比例相同: 另有 10% 未审核, 10% 来自管理员, 10% 回复"""
+    post_low, post_high = _id_range(Post)
+    salt = int(count * 0.1)
+    total = count + salt * 3
+    name, email, sentence = _Pool(fake.name, total), _Pool(fake.email, total), _Pool(fake.sentence, total)
+
+    def comment(**kwargs):
+        row = dict(author=name(), email=email(), body=sentence(),
+                   timestamp=_random_time(365), reviewed=True, from_admin=False,
+                   post_id=random.randint(post_low, post_high), replied_id=None)
+        row.update(kwargs)
+        return row
+
+    def rows():
+        for i in range(count):
+            yield comment()
+        for i in range(salt):
+            yield comment(reviewed=False)
+            yield comment(author='Syntomic', email='mima@example.com', from_admin=True)
+
+    def replies(comment_low, comment_high):
+        for i in range(salt):
+            yield comment(replied_id=random.randint(comment_low, comment_high))
+
+    start = time.perf_counter()
+
+    def report(base):
+        if progress is None:
+            return None
+        return lambda done, _, elapsed: progress(base + done, total, time.perf_counter() - start)
+
+    done = bulk_insert(Comment, rows(), total, batch, report(0))
+    comment_low, comment_high = _id_range(Comment)
+    done += bulk_insert(Comment, replies(comment_low, comment_high), total, batch, report(done))
+    return done
+
+
+def bulk_thoughts(count=20, batch=10000, progress=None):
+    rows = (dict(body=fake.sentence(), timestamp=_random_time(365)) for i in range(count))
+    return bulk_insert(Thought, rows, count, batch, progress)
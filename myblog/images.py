@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import threading
+
+from flask import current_app, url_for
+from markupsafe import Markup
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # 没有安装 Pillow 时只保存原图, 模板使用原图
+    Image = ImageOps = None
+
+VARIANT_DIR = '_variants'
+EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+MIMETYPES = {'avif': 'image/avif', 'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+SAVE_OPTIONS = {
+    'avif': lambda quality: dict(format='AVIF', quality=quality),
+    'webp': lambda quality: dict(format='WEBP', quality=quality, method=6),
+    'jpeg': lambda quality: dict(format='JPEG', quality=quality, optimize=True, progressive=True),
+}
+
+
+def sidecar_path(root, relpath):
+    return os.path.join(root, VARIANT_DIR, relpath + '.json')
+
+
+def variant_path(relpath, width, fmt):
+    return '%s/%s-%d.%s' % (VARIANT_DIR, os.path.splitext(relpath)[0], width, fmt)
+
+
+def process_image(root, relpath, widths=(480, 960, 1600), formats=('webp', 'jpeg'), quality=80):
+    """为 <root>/<relpath> 生成各个宽度和格式的版本, 保存时不带 EXIF 等元数据,
+    把原图和各版本的尺寸写入旁边的 JSON 文件, 返回这条记录"""
+    source = os.path.join(root, relpath)
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or 'A' in image.getbands() else 'RGB')
+        width, height = image.size
+
+        variants = []
+        for target in sorted(set(min(size, width) for size in widths)):
+            resized = image if target == width else \
+                image.resize((target, max(1, round(height * target / width))), Image.LANCZOS)
+            files = {}
+            for fmt in formats:
+                path = variant_path(relpath, target, fmt)
+                os.makedirs(os.path.dirname(os.path.join(root, path)), exist_ok=True)
+                output = resized.convert('RGB') if fmt == 'jpeg' else resized
+                output.save(os.path.join(root, path), **SAVE_OPTIONS[fmt](quality))
+                size = os.path.getsize(os.path.join(root, path))
+                # 已经压缩得很好的原图, 重新编码后可能反而更大, 这时不使用该版本
+                if size >= os.path.getsize(source):
+                    os.remove(os.path.join(root, path))
+                    continue
+                files[fmt] = dict(path=path, bytes=size)
+            variants.append(dict(width=target, height=resized.height, files=files))
+
+    record = dict(source=relpath, width=width, height=height, bytes=os.path.getsize(source),
+                  mtime=os.path.getmtime(source), variants=variants)
+    path = sidecar_path(root, relpath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(record, f)
+    os.replace(path + '.tmp', path)
+    return record
+
+
+def find_images(root):
+    """root 下所有可以处理的图片, 不包括生成的版本"""
+    for directory, dirs, files in os.walk(root):
+        dirs[:] = sorted(name for name in dirs if name != VARIANT_DIR)
+        for name in sorted(files):
+            if name.lower().endswith(EXTENSIONS):
+                yield os.path.relpath(os.path.join(directory, name), root).replace(os.sep, '/')
+
+
+class ImagePipeline(object):
+    """上传图片的处理流水线: 生成缩小和重新压缩的版本, 模板据此输出 image-set 和媒体查询.
+    上传时由后台任务调用 process, 不占用请求线程"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['image_pipeline'] = _State(os.path.join(app.static_folder, 'img'))
+        app.add_template_global(self.masthead_style)
+
+    @staticmethod
+    def _state():
+        return current_app.extensions['image_pipeline']
+
+    @property
+    def available(self):
+        return Image is not None
+
+    def process(self, relpath):
+        """处理 static/img 下的一张图片, 返回记录"""
+        config = current_app.config
+        return process_image(self._state().root, relpath, config['MYBLOG_IMAGE_WIDTHS'],
+                             config['MYBLOG_IMAGE_FORMATS'], config['MYBLOG_IMAGE_QUALITY'])
+
+    def backfill(self, force=False, progress=None):
+        """处理还没有生成版本, 或者在生成之后被替换的图片, 返回处理过的记录"""
+        root = self._state().root
+        records = []
+        for relpath in find_images(root):
+            record = None if force else self.record(relpath)
+            if record is not None and record['mtime'] >= os.path.getmtime(os.path.join(root, relpath)):
+                continue
+            try:
+                record = self.process(relpath)
+            except Exception:
+                current_app.logger.exception('Failed to process image %s' % relpath)
+                continue
+            records.append(record)
+            if progress is not None:
+                progress(record)
+        return records
+
+    def record(self, relpath):
+        """读取图片的尺寸记录, 按 JSON 文件的修改时间缓存在进程内, 没有时返回 None"""
+        state = self._state()
+        path = sidecar_path(state.root, relpath)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+        with state.lock:
+            cached = state.records.get(relpath)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        try:
+            with open(path) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        with state.lock:
+            state.records[relpath] = (mtime, record)
+        return record
+
+    def masthead_style(self, relpath, selector='.masthead'):
+        """页头背景图的 <style>: 按视口宽度选择版本, 支持的浏览器通过 image-set 选择格式"""
+        relpath = relpath.strip()
+        record = self.record(relpath) if relpath else None
+        if not record or not record['variants']:
+            url = url_for('static', filename='img/' + relpath)
+            return Markup('<style>%s{background-image:url("%s")}</style>' % (selector, url))
+
+        rules = []
+        variants = sorted(record['variants'], key=lambda variant: variant['width'], reverse=True)
+        for index, variant in enumerate(variants):
+            files = [(fmt, url_for('static', filename='img/' + variant['files'][fmt]['path']))
+                     for fmt in current_app.config['MYBLOG_IMAGE_FORMATS'] if fmt in variant['files']]
+            if files:
+                rule = '%s{background-image:url("%s");background-image:image-set(%s)}' % (
+                    selector, files[-1][1],
+                    ','.join('url("%s") type("%s")' % (url, MIMETYPES[fmt]) for fmt, url in files))
+            else:
+                rule = '%s{background-image:url("%s")}' % (selector, url_for('static', filename='img/' + relpath))
+            if index:
+                rule = '@media (max-width:%dpx){%s}' % (variant['width'], rule)
+            rules.append(rule)
+        return Markup('<style>%s</style>' % '\n'.join(rules))
+
+
+class _State(object):
+
+    def __init__(self, root):
+        self.root = root
+        self.records = {}
+        self.lock = threading.Lock()
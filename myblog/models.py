@@ -1,11 +1,18 @@
 # -*- coding: utf-8 -*-
 
+from collections import namedtuple
 from datetime import datetime
 
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.orm import joinedload
+from werkzeug.security import check_password_hash
 
 from myblog.extensions import db
+from myblog.pagination import paginate_with_total
+from myblog.render import hash_body, needs_client_render, render_markdown
+from myblog.security import hash_password, needs_rehash
+
+CommentNode = namedtuple('CommentNode', ['comment', 'children'])
 
 
 class Admin(db.Model, UserMixin):
@@ -18,16 +25,21 @@ class Admin(db.Model, UserMixin):
     about = db.Column(db.Text)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def validate_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    def needs_rehash(self):
+        """哈希参数与当前配置不同, 登录成功时用明文密码重新计算"""
+        return needs_rehash(self.password_hash)
+
 
 class Category(db.Model):
     """类型模型, 存储类型名称, 建立关系属性: 话题, 文章"""
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(30), unique=True)
+    post_count = db.Column(db.Integer, default=0)
 
     topics = db.relationship('Topic', back_populates='category')
     posts = db.relationship('Post', back_populates='category')
@@ -40,6 +52,7 @@ class Topic(db.Model):
     name = db.Column(db.String(20), unique=True)
     theme = db.Column(db.String(20), unique=True)
     description = db.Column(db.String(255), unique=True)
+    post_count = db.Column(db.Integer, default=0)
 
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'))
     
@@ -48,25 +61,44 @@ class Topic(db.Model):
 
     def delete(self):
         """删除话题以后,其下的文章将会成为第一个话题下的文章"""
-        first_topic = Topic.query.get(1)
-        posts = self.posts[:]
-        for post in posts:
-            post.topic = first_topic
+        self.merge_into(Topic.query.get(1))
+
+    def merge_into(self, target):
+        """把文章整体移到目标话题后删除本话题, 在一个事务中用 UPDATE 和 DELETE 完成, 不加载文章"""
+        from myblog import counters
 
-        db.session.delete(self)
+        if target is None or target.id == self.id:
+            raise ValueError('Can not merge a topic into itself.')
+
+        moved = Post.query.filter_by(topic_id=self.id) \
+            .update({Post.topic_id: target.id}, synchronize_session=False)
+        Topic.query.filter_by(id=self.id).delete(synchronize_session='evaluate')
+        # 批量语句不经过 flush, 计数器要显式调整
+        counters.adjust(totals={'topic': -1}, columns={(Topic.post_count, target.id): moved})
         db.session.commit()
+        return moved
 
 
 class Post(db.Model):
-    """文章模型, 存储文章的标题, 副标题, 内容, 创建时间和修改时间, 是否可评论, 及其类型和话题, 建立关系属性: 类型, 话题, 评论"""
+    """文章模型, 存储文章的标题, 副标题, 内容, 创建时间和修改时间, 是否可评论, 及其类型和话题, 建立关系属性: 类型, 话题, 评论.
+    内容和渲染结果属于延迟加载的 content 组, 列表页不会读取, 需要时用 undefer_group('content') 一次加载"""
+    # 话题页和类型页按创建时间倒序列出其下的文章
+    __table_args__ = (db.Index('ix_post_topic_id_create_time', 'topic_id', 'create_time'),
+                      db.Index('ix_post_category_id_create_time', 'category_id', 'create_time'))
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(60))
     subtitle = db.Column(db.String(255))
     theme = db.Column(db.String(60))
-    body = db.Column(db.Text)
+    body = db.deferred(db.Column(db.Text), group='content')
+    body_html = db.deferred(db.Column(db.Text), group='content')
+    toc_html = db.deferred(db.Column(db.Text), group='content')
+    body_length = db.column_property(db.func.length(body.expression), deferred=True)
+    body_hash = db.Column(db.String(40))
     create_time = db.Column(db.DateTime, default=datetime.utcnow, index = True)
     update_time = db.Column(db.DateTime, default=datetime.utcnow)
     can_comment = db.Column(db.Boolean, default=True)
+    comment_count = db.Column(db.Integer, default=0)
 
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'))
     topic_id = db.Column(db.Integer, db.ForeignKey('topic.id'))
@@ -75,9 +107,38 @@ class Post(db.Model):
     topic = db.relationship('Topic', back_populates='posts')
     comments = db.relationship('Comment', back_populates='post', cascade='all, delete-orphan')
 
+    def render_body(self, force=False):
+        """内容改变时重新渲染 HTML 和目录, 返回是否重新渲染;
+        使用公式, 流程图等功能的文章不在服务端渲染, body_html 保持为空, 由浏览器中的 editormd 渲染"""
+        digest = hash_body(self.body)
+        client = needs_client_render(self.body)
+        if not force and digest == self.body_hash and (self.body_html is None) == client:
+            return False
+        if client:
+            self.body_html = self.toc_html = None
+        else:
+            self.body_html, self.toc_html = render_markdown(self.body)
+        self.body_hash = digest
+        return True
+
+    def reviewed_comments(self):
+        """已审核的评论, 被回复的评论在同一条查询中一并加载"""
+        return Comment.query.with_parent(self).filter_by(reviewed=True) \
+            .options(joinedload(Comment.replied)).order_by(Comment.timestamp.asc())
+
+    def comment_tree(self, page, per_page):
+        """分页加载评论并组织成回复树, 返回 (pagination, 树的根节点列表)"""
+        pagination = paginate_with_total(self.reviewed_comments(), page, per_page, self.comment_count)
+        return pagination, Comment.build_tree(pagination.items)
+
 
 class Comment(db.Model):
     """评论模型, 存储作者, 邮箱, 是否来自管理员, 是否审查过, 创建时间, 及其文章, 回复, 建立关系属性: 文章, 回复(邻接列表关系)"""
+    # 文章页按时间列出已审核的评论; 评论管理页按时间列出未审核的或管理员的评论
+    __table_args__ = (db.Index('ix_comment_post_id_reviewed_timestamp', 'post_id', 'reviewed', 'timestamp'),
+                      db.Index('ix_comment_reviewed_timestamp', 'reviewed', 'timestamp'),
+                      db.Index('ix_comment_from_admin_timestamp', 'from_admin', 'timestamp'))
+
     id = db.Column(db.Integer, primary_key=True)
     author = db.Column(db.String(30))
     email = db.Column(db.String(254))
@@ -88,15 +149,67 @@ class Comment(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
   
     post_id = db.Column(db.Integer, db.ForeignKey('post.id'))
-    replied_id = db.Column(db.Integer, db.ForeignKey('comment.id'))
+    replied_id = db.Column(db.Integer, db.ForeignKey('comment.id'), index=True)
     
     post = db.relationship('Post', back_populates='comments')
     replied = db.relationship('Comment', back_populates='replies', remote_side=[id])
     replies = db.relationship('Comment', back_populates='replied', cascade='all, delete-orphan')
 
+    @staticmethod
+    def build_tree(comments):
+        """把一页评论组织成嵌套结构: 回复挂在同页的父评论下, 父评论不在本页的回复作为根节点"""
+        nodes = {comment.id: CommentNode(comment, []) for comment in comments}
+        roots = []
+        for comment in comments:
+            parent = nodes.get(comment.replied_id)
+            if parent is not None:
+                parent.children.append(nodes[comment.id])
+            else:
+                roots.append(nodes[comment.id])
+        return roots
+
 
 class Thought(db.Model):
-    """想法模型, 存储想法和时间"""
+    """想法模型, 存储想法, 发布时间和修改时间"""
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.String(200))
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
\ No newline at end of file
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    update_time = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class Counter(db.Model):
+    """计数器模型, 缓存文章, 评论, 想法, 话题的总数以及未审核和管理员的评论数"""
+    name = db.Column(db.String(30), primary_key=True)
+    value = db.Column(db.Integer, default=0)
+
+
+class PostMonth(db.Model):
+    """每个月的文章数量, 由计数器维护, 用于归档页"""
+    year = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    month = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, default=0)
+
+
+class SearchTerm(db.Model):
+    """倒排索引, 非 SQLite 数据库的全文搜索使用: 词, 文档编号 (id * 4 + 类型) 和权重"""
+    term = db.Column(db.String(40), primary_key=True)
+    doc = db.Column(db.Integer, primary_key=True, index=True)
+    weight = db.Column(db.Integer, default=1)
+
+
+class Job(db.Model):
+    """后台任务: 任务名, JSON 参数, 状态 (pending, running, done, failed), 已尝试次数和最多尝试次数,
+    创建时间, 最早可以执行的时间, 最近一次开始和结束的时间, 以及最近一次的错误"""
+    __table_args__ = (db.Index('ix_job_status_run_at', 'status', 'run_at'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(60))
+    payload = db.Column(db.Text)
+    status = db.Column(db.String(10), default='pending')
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer, default=3)
+    error = db.Column(db.Text)
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+    run_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started = db.Column(db.DateTime)
+    finished = db.Column(db.DateTime)
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import pickle
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request, session, make_response
+
+from myblog.utils import cache_path, is_anonymous_read
+
+
+class MemoryBackend(object):
+    """进程内的 LRU 缓存"""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, base, page):
+        with self._lock:
+            entry = self._entries.get((base, page))
+            if entry is not None:
+                self._entries.move_to_end((base, page))
+            return entry
+
+    def set(self, base, page, entry):
+        with self._lock:
+            self._entries[(base, page)] = entry
+            self._entries.move_to_end((base, page))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def purge(self, base):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == base]:
+                del self._entries[key]
+
+    def purge_endpoint(self, endpoint):
+        with self._lock:
+            for key in [key for key in self._entries if key[0].split('|', 1)[0] == endpoint]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _digest(value):
+    return hashlib.sha1(str(value).encode('utf-8')).hexdigest()
+
+
+class FileBackend(object):
+    """磁盘缓存, 多个 worker 共享同一目录, 因此清除对所有 worker 生效"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, base, page=None):
+        # <目录>/<endpoint>/<视图参数>/<页码>, 可以一次清除一个 endpoint 的所有页面
+        path = os.path.join(self._endpoint_path(base.split('|', 1)[0]), _digest(base))
+        if page is None:
+            return path
+        return os.path.join(path, _digest(page))
+
+    def _endpoint_path(self, endpoint):
+        return os.path.join(self.directory, _digest(endpoint))
+
+    def get(self, base, page):
+        try:
+            with open(self._path(base, page), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.PickleError, EOFError):
+            return None
+
+    def set(self, base, page, entry):
+        path = self._path(base, page)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def purge(self, base):
+        shutil.rmtree(self._path(base), ignore_errors=True)
+
+    def purge_endpoint(self, endpoint):
+        shutil.rmtree(self._endpoint_path(endpoint), ignore_errors=True)
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+backends = {
+    'memory': lambda app: MemoryBackend(app.config['MYBLOG_PAGE_CACHE_SIZE']),
+    'file': lambda app: FileBackend(cache_path(app, 'pages')),
+}
+
+
+def make_base(endpoint, view_args):
+    return endpoint + ''.join('|%s=%s' % item for item in sorted(view_args.items()))
+
+
+class PageCache(object):
+    """匿名读者的整页缓存, 键为 endpoint, 视图参数和页码 (或分页游标);
+    放在 conditional 外层, 这样缓存的响应中包括 ETag"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        name = app.config.get('MYBLOG_PAGE_CACHE')
+        app.extensions['page_cache'] = backends[name](app) if name else None
+
+    @property
+    def backend(self):
+        return current_app.extensions['page_cache']
+
+    def cached(self, f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            backend = self.backend
+            if backend is None or set(request.args) - {'page', 'cursor'} or not is_anonymous_read():
+                return f(*args, **kwargs)
+
+            base = make_base(request.endpoint, request.view_args)
+            page = request.args.get('cursor') or request.args.get('page', 1, type=int)
+            entry = backend.get(base, page)
+            if entry is not None and entry[0] > time.time():
+                expires, status, headers, body = entry
+                # 缓存的响应带有 conditional 生成的 ETag, 命中时直接处理 If-None-Match, 不查询数据库
+                return current_app.response_class(body, status=status, headers=headers).make_conditional(request)
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200 and not response.direct_passthrough and not session.modified:
+                expires = time.time() + current_app.config['MYBLOG_PAGE_CACHE_TIMEOUT']
+                headers = [(k, v) for k, v in response.headers if k.lower() != 'set-cookie']
+                backend.set(base, page, (expires, response.status_code, headers, response.get_data()))
+            return response
+        return decorated_function
+
+    def purge(self, endpoint, **view_args):
+        """清除某个页面的所有分页"""
+        if self.backend is not None:
+            self.backend.purge(make_base(endpoint, view_args))
+
+    def purge_endpoint(self, endpoint):
+        """清除某个 endpoint 所有视图参数的页面"""
+        if self.backend is not None:
+            self.backend.purge_endpoint(endpoint)
+
+    def purge_post(self, post):
+        """文章改变时清除它出现的所有列表页和文章页; 每个归档页都显示各月的文章数, 因此清除全部归档页"""
+        self.purge('blog.index')
+        self.purge_endpoint('blog.archive')
+        self.purge('blog.show_post', post_id=post.id)
+        if post.topic_id is not None:
+            self.purge('blog.show_topic', topic_id=post.topic_id)
+        if post.category_id is not None:
+            self.purge('blog.show_category', category_id=post.category_id)
+
+    def purge_topic(self, topic_id):
+        """话题改变时清除话题页, 以及其下文章出现的文章页和列表页"""
+        if self.backend is None:
+            return
+        from myblog.extensions import db
+        from myblog.models import Post
+
+        self.purge('blog.index')
+        self.purge('blog.show_topic', topic_id=topic_id)
+        category_ids = set()
+        for post_id, category_id in db.session.query(Post.id, Post.category_id).filter_by(topic_id=topic_id):
+            self.purge('blog.show_post', post_id=post_id)
+            category_ids.add(category_id)
+        for category_id in category_ids:
+            self.purge('blog.show_category', category_id=category_id)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
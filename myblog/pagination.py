@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from flask import abort, request, url_for
+from flask_sqlalchemy import Pagination
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(direction, timestamp, id):
+    data = json.dumps([direction, timestamp.isoformat(), id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, timestamp, id = json.loads(data.decode('utf-8'))
+        if direction not in ('next', 'prev'):
+            raise ValueError(direction)
+        return direction, datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S.%f' if '.' in timestamp
+                                            else '%Y-%m-%dT%H:%M:%S'), int(id)
+    except (binascii.Error, ValueError, TypeError, UnicodeDecodeError):
+        abort(400)
+
+
+class KeysetPagination(object):
+    """keyset 分页: 以 (时间, id) 作为游标按时间倒序翻页, 不需要 COUNT 和 OFFSET,
+    因此翻到第几页的代价都一样"""
+
+    def __init__(self, query, column, id_column, per_page, cursor=None):
+        self.per_page = per_page
+        self.has_prev = self.has_next = False
+
+        if cursor is None:
+            direction = 'next'
+        else:
+            direction, timestamp, id = decode_cursor(cursor)
+            if direction == 'next':
+                query = query.filter(or_(column < timestamp, and_(column == timestamp, id_column < id)))
+            else:
+                query = query.filter(or_(column > timestamp, and_(column == timestamp, id_column > id)))
+
+        if direction == 'next':
+            query = query.order_by(column.desc(), id_column.desc())
+        else:
+            query = query.order_by(column.asc(), id_column.asc())
+
+        items = query.limit(per_page + 1).all()
+        more = len(items) > per_page
+        items = items[:per_page]
+        if direction == 'next':
+            self.has_prev = cursor is not None
+            self.has_next = more
+        else:
+            items.reverse()
+            self.has_prev = more
+            self.has_next = True
+
+        self.items = items
+        self._key = lambda item: (getattr(item, column.key), getattr(item, id_column.key))
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.items:
+            return encode_cursor('next', *self._key(self.items[-1]))
+
+    @property
+    def prev_cursor(self):
+        if self.has_prev and self.items:
+            return encode_cursor('prev', *self._key(self.items[0]))
+
+    def next_url(self):
+        return self._url(self.next_cursor)
+
+    def prev_url(self):
+        return self._url(self.prev_cursor)
+
+    @staticmethod
+    def _url(cursor):
+        if cursor is None:
+            return None
+        args = request.args.to_dict()
+        args.pop('page', None)
+        args.update(request.view_args or {})
+        args['cursor'] = cursor
+        return url_for(request.endpoint, **args)
+
+
+def keyset_paginate(query, column, id_column, per_page):
+    """按请求中的 cursor 参数分页"""
+    return KeysetPagination(query, column, id_column, per_page, request.args.get('cursor'))
+
+
+def paginate_with_total(query, page, per_page, total):
+    """页码分页, 总数由调用者从计数器给出, 省去一次 COUNT(*)"""
+    if page < 1:
+        abort(404)
+    items = query.limit(per_page).offset((page - 1) * per_page).all()
+    if not items and page != 1:
+        abort(404)
+    return Pagination(query, page, per_page, total or 0, items)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+import random
+import re
+import threading
+import time
+from functools import lru_cache
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from myblog.utils import WorkerFiles, cache_path
+
+OVERFLOW = '<other statements>'
+
+_literals = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)'), '(?)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(statement):
+    """去掉字面量和多余空白, 同一类语句得到相同的指纹"""
+    for pattern, replacement in _literals:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+class QueryStats(object):
+    """进程内的聚合结果: (endpoint, 指纹) -> [次数, 总秒数, 最长秒数, 行数]"""
+
+    def __init__(self, size=2000):
+        self.size = size
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def add(self, endpoint, statement, duration, rows):
+        key = (endpoint, statement)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                if len(self.entries) >= self.size:
+                    key = (endpoint, OVERFLOW)
+                    entry = self.entries.get(key)
+                if entry is None:
+                    entry = self.entries[key] = [0, 0.0, 0.0, 0]
+            entry[0] += 1
+            entry[1] += duration
+            entry[2] = max(entry[2], duration)
+            entry[3] += rows
+
+    def records(self):
+        with self.lock:
+            return [[endpoint, statement] + entry for (endpoint, statement), entry in self.entries.items()]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def merge(*record_lists):
+    """合并多个 worker 的记录"""
+    merged = {}
+    for records in record_lists:
+        for endpoint, statement, count, total, longest, rows in records:
+            entry = merged.setdefault((endpoint, statement), [0, 0.0, 0.0, 0])
+            entry[0] += count
+            entry[1] += total
+            entry[2] = max(entry[2], longest)
+            entry[3] += rows
+    return [[endpoint, statement] + entry for (endpoint, statement), entry in merged.items()]
+
+
+class QueryProfiler(object):
+    """基于 engine 事件的查询统计: 按 endpoint 聚合语句指纹的次数, 总时间, 最长时间和行数.
+    每个请求按采样率决定是否统计, 结果定期写入缓存目录, 以便汇总所有 worker"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['query_profiler'] = _State(QueryStats(app.config['MYBLOG_QUERY_STATS_SIZE']),
+                                                  WorkerFiles(cache_path(app, 'queries')))
+
+        @app.before_request
+        def sample_request():
+            g.profile_queries = random.random() < app.config['MYBLOG_QUERY_SAMPLE_RATE']
+
+        @app.after_request
+        def flush_stats(response):
+            state = app.extensions['query_profiler']
+            if time.monotonic() - state.files.flushed >= app.config['MYBLOG_QUERY_STATS_FLUSH']:
+                self.flush()
+            return response
+
+    @staticmethod
+    def _state():
+        return current_app.extensions['query_profiler']
+
+    def flush(self):
+        """把本进程的统计写入缓存目录"""
+        state = self._state()
+        if not state.files.current():
+            state.stats.clear()
+        state.files.write(state.stats.records())
+
+    def collect(self):
+        """汇总所有 worker 写入的统计, 本进程使用内存中的最新结果"""
+        state = self._state()
+        if not state.files.current():
+            state.stats.clear()
+        # 统计是累计的, 只去掉已经退出的 worker 留下的文件
+        return merge(state.stats.records(), *state.files.others(alive=True))
+
+    def report(self, endpoint=None, limit=None):
+        """按总时间倒序的统计, 每项为字典, 时间单位为毫秒"""
+        rows = []
+        for name, statement, count, total, longest, affected in self.collect():
+            if endpoint is not None and name != endpoint:
+                continue
+            rows.append(dict(endpoint=name, statement=statement, count=count,
+                             total_ms=total * 1000, avg_ms=total * 1000 / count, max_ms=longest * 1000,
+                             rows=affected))
+        rows.sort(key=lambda row: row['total_ms'], reverse=True)
+        return rows[:limit] if limit else rows
+
+    def reset(self):
+        """清空所有 worker 的统计"""
+        state = self._state()
+        state.stats.clear()
+        state.files.reset()
+
+
+class _State(object):
+
+    def __init__(self, stats, files):
+        self.stats = stats
+        self.files = files
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_start'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _record_query(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop('query_start', None)
+    if start is None or not has_request_context():
+        return
+    duration = time.perf_counter() - start
+
+    app = current_app._get_current_object()
+    if duration >= app.config['MYBLOG_SLOW_QUERY_THRESHOLD']:
+        app.logger.warning('Slow query: Duration: %fs\n Endpoint: %s\nQuery: %s\n '
+                           % (duration, request.endpoint, statement))
+
+    state = app.extensions.get('query_profiler')
+    if state is not None and g.get('profile_queries'):
+        # SQLite 对 SELECT 不报告行数, 这里只累计驱动给出的受影响行数
+        state.stats.add(request.endpoint or '<unmatched>', fingerprint(statement), duration,
+                        max(cursor.rowcount, 0))
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, undefer, undefer_group
+
+from myblog.extensions import db
+from myblog.models import Post, Topic, Category, PostMonth
+from myblog.pagination import keyset_paginate
+
+TopicSummary = namedtuple('TopicSummary', ['id', 'name', 'category_name', 'post_count'])
+ArchiveMonth = namedtuple('ArchiveMonth', ['year', 'month', 'count'])
+ArchiveYear = namedtuple('ArchiveYear', ['year', 'count', 'months'])
+ArchivePost = namedtuple('ArchivePost', ['id', 'title', 'create_time'])
+
+
+def post_listing(parent=None):
+    """文章列表查询, 预加载话题和类型, 一页的查询次数与文章数量无关, 不读取延迟加载的内容"""
+    query = Post.query
+    if parent is not None:
+        query = query.with_parent(parent)
+    return query.options(joinedload(Post.topic), joinedload(Post.category)) \
+        .order_by(Post.create_time.desc())
+
+
+def post_detail():
+    """文章页和编辑页: 同一条查询加载内容和渲染结果"""
+    return Post.query.options(undefer_group('content'))
+
+
+def manage_post_listing():
+    """文章管理页: 只在数据库中计算内容长度, 不读取内容"""
+    return post_listing().options(undefer(Post.body_length))
+
+
+def topic_summaries():
+    """话题管理页: 一条 GROUP BY 查询得到每个话题的类型名称和文章数, 不加载任何文章"""
+    rows = db.session.query(Topic.id, Topic.name, Category.name, func.count(Post.id)) \
+        .outerjoin(Category, Topic.category_id == Category.id) \
+        .outerjoin(Post, Post.topic_id == Topic.id) \
+        .group_by(Topic.id, Topic.name, Category.name) \
+        .order_by(Topic.name)
+    return [TopicSummary(*row) for row in rows]
+
+
+def archive_index():
+    """按年月的文章数量, 读取计数器维护的 post_month 表, 行数只与月份数有关, 按时间倒序"""
+    rows = db.session.query(PostMonth.year, PostMonth.month, PostMonth.count) \
+        .filter(PostMonth.count > 0).order_by(PostMonth.year.desc(), PostMonth.month.desc())
+
+    months = {}
+    for year, month, count in rows:
+        months.setdefault(year, []).append(ArchiveMonth(year, month, count))
+    return [ArchiveYear(year, sum(item.count for item in months[year]), months[year])
+            for year in sorted(months, reverse=True)]
+
+
+def archive_posts(year, month, per_page):
+    """某个月的文章, 只查询 id, 标题和创建时间, 按 keyset 分页"""
+    start = datetime(year, month, 1)
+    end = datetime(year + month // 12, month % 12 + 1, 1)
+    query = db.session.query(Post.id, Post.title, Post.create_time) \
+        .filter(Post.create_time >= start, Post.create_time < end)
+    pagination = keyset_paginate(query, Post.create_time, Post.id, per_page)
+    pagination.items = [ArchivePost(*row) for row in pagination.items]
+    return pagination
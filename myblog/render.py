@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import re
+
+import markdown
+from markdown.extensions import Extension
+from markdown.postprocessors import Postprocessor
+
+# 公式 ($$...$$ 或 ```math), 流程图和时序图 (```flow, ```seq), 以及 :emoji: 需要 editormd 在浏览器中渲染
+# emoji 短代码前后不能紧挨字母或数字, 以免把 10:30:45 这样的文字当作 emoji
+_client_features = re.compile(r'\$\$|^\s*(?:```|~~~)\s*(?:math|latex|katex|flow|seq|sequence)\s*$'
+                              r'|(?<!\w):[a-z_+-][\w+-]*:(?!\w)', re.M | re.I)
+_task_item = re.compile(r'(<li>(?:\s*<p>)?)\[([ xX])\]\s')
+# 与 editormd 的 htmlDecode: "style,script,iframe" 相同, 删除这些标签及其内容
+_filtered_element = re.compile(r'<(script|style|iframe)\b[^>]*>.*?</\1\s*>', re.S | re.I)
+_filtered_tag = re.compile(r'</?(?:script|style|iframe)\b[^>]*>', re.I)
+
+
+class TaskListPostprocessor(Postprocessor):
+    """- [ ] 和 - [x] 列表项显示为复选框"""
+
+    def run(self, text):
+        def replace(match):
+            checked = ' checked' if match.group(2) != ' ' else ''
+            return '%s<input type="checkbox" disabled%s> ' % (match.group(1), checked)
+        return _task_item.sub(replace, text)
+
+
+class TagFilterPostprocessor(Postprocessor):
+    """删除正文 HTML 中的 script, style 和 iframe"""
+
+    def run(self, text):
+        return _filtered_tag.sub('', _filtered_element.sub('', text))
+
+
+class EditormdExtension(Extension):
+    """editormd 预览中开启的任务列表和标签过滤"""
+
+    def extendMarkdown(self, md):
+        # 优先级低于还原原始 HTML 的 raw_html (30), 在其之后执行
+        md.postprocessors.register(TaskListPostprocessor(md), 'task_list', 10)
+        md.postprocessors.register(TagFilterPostprocessor(md), 'tag_filter', 5)
+
+
+MARKDOWN_EXTENSIONS = ['extra', 'toc', 'sane_lists', EditormdExtension()]
+
+
+def hash_body(body):
+    return hashlib.sha1((body or '').encode('utf-8')).hexdigest()
+
+
+def needs_client_render(body):
+    """正文使用了服务端不支持的 editormd 功能, 仍然由浏览器渲染"""
+    return bool(_client_features.search(body or ''))
+
+
+def render_markdown(body):
+    """把 Markdown 渲染为 HTML, 返回 (html, 目录 html)"""
+    md = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+    html = md.convert(body or '')
+    return html, md.toc
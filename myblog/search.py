@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+import re
+import sqlite3
+from collections import Counter, namedtuple
+
+from flask import abort, current_app, has_app_context, url_for
+from flask_sqlalchemy import Pagination, SignallingSession
+from markupsafe import Markup, escape
+from sqlalchemy import event, func, select, text
+from sqlalchemy.orm import joinedload, load_only, undefer
+from sqlalchemy.orm.attributes import PASSIVE_NO_INITIALIZE, get_history
+
+from myblog.extensions import db
+from myblog.models import Post, Thought, Comment, SearchTerm
+
+# 文档编号为 id * 4 + 类型, 不同类型的文档共用一个索引
+KINDS = {'post': 1, 'thought': 2, 'comment': 3}
+MODELS = {1: Post, 2: Thought, 3: Comment}
+TRACKED = {Post: ['title', 'subtitle', 'body'], Thought: ['body'], Comment: ['author', 'body', 'reviewed']}
+TITLE_WEIGHT = 10
+MAX_TERMS = 10
+
+SearchHit = namedtuple('SearchHit', ['kind', 'obj', 'url', 'title', 'snippet'])
+
+_words = re.compile(r'[0-9a-z]+|[㐀-鿿]+')
+
+
+def tokenize(text):
+    """英文和数字按单词切分并转为小写, 中文按相邻两个字切分"""
+    for word in _words.findall((text or '').lower()):
+        if word[0] < '㐀':
+            yield word[:40]
+        elif len(word) == 1:
+            yield word
+        else:
+            for i in range(len(word) - 1):
+                yield word[i:i + 2]
+
+
+def document(obj):
+    """(文档编号, 标题, 正文), 未审核的评论不进入索引, 此时正文为 None"""
+    if isinstance(obj, Post):
+        return obj.id * 4 + KINDS['post'], obj.title, '%s\n%s' % (obj.subtitle or '', obj.body or '')
+    if isinstance(obj, Thought):
+        return obj.id * 4 + KINDS['thought'], '', obj.body
+    return obj.id * 4 + KINDS['comment'], obj.author, obj.body if obj.reviewed else None
+
+
+def fts5_available():
+    connection = sqlite3.connect(':memory:')
+    try:
+        connection.execute('CREATE VIRTUAL TABLE t USING fts5(x)')
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        connection.close()
+
+
+class Fts5Backend(object):
+    """SQLite FTS5 虚拟表, 存储切分后的词, 按 bm25 排序 (标题权重更高)"""
+    name = 'fts5'
+
+    @staticmethod
+    def create(connection):
+        connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(title, body)")
+
+    @staticmethod
+    def clear(connection):
+        connection.execute('DELETE FROM search_fts')
+
+    @staticmethod
+    def remove(connection, docs):
+        if docs:
+            connection.execute(text('DELETE FROM search_fts WHERE rowid = :doc'), [dict(doc=doc) for doc in docs])
+
+    @staticmethod
+    def add(connection, documents):
+        if documents:
+            connection.execute(text('INSERT INTO search_fts (rowid, title, body) VALUES (:doc, :title, :body)'),
+                               [dict(doc=doc, title=' '.join(tokenize(title)), body=' '.join(tokenize(body)))
+                                for doc, title, body in documents])
+
+    @staticmethod
+    def search(connection, terms, kinds, limit, offset):
+        where = 'search_fts MATCH :match AND rowid %% 4 IN (%s)' % ', '.join(str(kind) for kind in kinds)
+        match = ' '.join('"%s"' % term for term in terms)
+        total = connection.execute(text('SELECT count(*) FROM search_fts WHERE ' + where), match=match).scalar()
+        docs = [row[0] for row in connection.execute(
+            text('SELECT rowid FROM search_fts WHERE %s ORDER BY bm25(search_fts, %d.0, 1.0) '
+                 'LIMIT :limit OFFSET :offset' % (where, TITLE_WEIGHT)),
+            match=match, limit=limit, offset=offset)]
+        return total, docs
+
+
+class TermBackend(object):
+    """search_term 表中的倒排索引, 适用于任何数据库, 按词频加权排序"""
+    name = 'python'
+
+    @staticmethod
+    def create(connection):
+        SearchTerm.__table__.create(connection, checkfirst=True)
+
+    @staticmethod
+    def clear(connection):
+        connection.execute(SearchTerm.__table__.delete())
+
+    @staticmethod
+    def remove(connection, docs):
+        if docs:
+            connection.execute(SearchTerm.__table__.delete().where(SearchTerm.doc.in_(list(docs))))
+
+    @staticmethod
+    def add(connection, documents):
+        rows = []
+        for doc, title, body in documents:
+            weights = Counter(tokenize(body))
+            for term in tokenize(title):
+                weights[term] += TITLE_WEIGHT
+            rows.extend(dict(term=term, doc=doc, weight=weight) for term, weight in weights.items())
+        if rows:
+            connection.execute(SearchTerm.__table__.insert(), rows)
+
+    @staticmethod
+    def search(connection, terms, kinds, limit, offset):
+        table = SearchTerm.__table__
+        score = func.sum(table.c.weight).label('score')
+        matches = select([table.c.doc, score]) \
+            .where(table.c.term.in_(terms)).where((table.c.doc % 4).in_(kinds)) \
+            .group_by(table.c.doc).having(func.count(table.c.term) == len(terms))
+        total = connection.execute(select([func.count()]).select_from(matches.alias())).scalar()
+        docs = [row[0] for row in connection.execute(
+            matches.order_by(score.desc(), table.c.doc.desc()).limit(limit).offset(offset))]
+        return total, docs
+
+
+class SearchIndex(object):
+    """文章, 想法和已审核评论的全文搜索; SQLite 支持 FTS5 时使用 FTS5, 否则使用倒排索引表.
+    索引在 flush 时随数据修改增量更新, flask reindex 可以重建"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        name = app.config.get('MYBLOG_SEARCH_BACKEND')
+        if name is None:
+            uri = app.config['SQLALCHEMY_DATABASE_URI']
+            name = 'fts5' if uri.startswith('sqlite') and fts5_available() else 'python'
+        app.extensions['search'] = backends[name]
+
+    @property
+    def backend(self):
+        return current_app.extensions['search']
+
+    def rebuild(self, batch=500, progress=None):
+        """清空后按 id 分批重建索引, 每批提交一次, progress(表名, 已索引数量) 用于报告进度"""
+        backend = self.backend
+        backend.create(db.session.connection())
+        backend.clear(db.session.connection())
+        db.session.commit()
+
+        for model, attrs in TRACKED.items():
+            query = model.query.options(load_only(*attrs))
+            if model is Comment:
+                query = query.filter_by(reviewed=True)
+            last_id = indexed = 0
+            while True:
+                objects = query.filter(model.id > last_id).order_by(model.id).limit(batch).all()
+                if not objects:
+                    break
+                backend.add(db.session.connection(), [document(obj) for obj in objects])
+                last_id = objects[-1].id
+                indexed += len(objects)
+                db.session.commit()
+                db.session.expunge_all()
+                if progress is not None:
+                    progress(model.__tablename__, indexed)
+
+    def search(self, q, kind=None, page=1, per_page=10):
+        terms = sorted(set(tokenize(q)))[:MAX_TERMS]
+        kinds = [KINDS[kind]] if kind in KINDS else sorted(KINDS.values())
+        if page < 1:
+            abort(404)
+        if not terms:
+            return Pagination(None, page, per_page, 0, []), terms
+
+        total, docs = self.backend.search(db.session.connection(), terms, kinds, per_page, (page - 1) * per_page)
+        if not docs and page != 1:
+            abort(404)
+        return Pagination(None, page, per_page, total, load_hits(docs, terms)), terms
+
+
+def load_hits(docs, terms):
+    """每种类型一次查询取出对象, 保持排名顺序"""
+    objects = {}
+    for kind, model in MODELS.items():
+        ids = [doc // 4 for doc in docs if doc % 4 == kind]
+        if ids:
+            query = model.query.filter(model.id.in_(ids))
+            if model is Post:
+                query = query.options(undefer(Post.body))
+            elif model is Comment:
+                query = query.options(joinedload(Comment.post))
+            objects.update(((obj.id * 4 + kind), obj) for obj in query)
+
+    hits = []
+    for doc in docs:
+        obj = objects.get(doc)
+        if obj is None:
+            continue
+        if isinstance(obj, Post):
+            hits.append(SearchHit('post', obj, url_for('blog.show_post', post_id=obj.id), obj.title,
+                                  highlight(obj.subtitle + '\n' + obj.body if obj.subtitle else obj.body, terms)))
+        elif isinstance(obj, Thought):
+            hits.append(SearchHit('thought', obj, url_for('blog.thought'), None, highlight(obj.body, terms)))
+        else:
+            hits.append(SearchHit('comment', obj, url_for('blog.show_post', post_id=obj.post_id) + '#comments',
+                                  obj.post.title if obj.post else None, highlight(obj.body, terms)))
+    return hits
+
+
+def highlight(text, terms, width=200):
+    """截取第一个命中词附近的一段文字, 转义后用 <mark> 标出命中词"""
+    text = text or ''
+    if not terms:
+        return escape(text[:width])
+    pattern = re.compile('|'.join(r'\b%s\b' % re.escape(term) if term[0] < '㐀' else re.escape(term)
+                                  for term in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+    match = pattern.search(text)
+    start = max(match.start() - width // 4, 0) if match else 0
+    fragment = text[start:start + width]
+
+    parts = [Markup('&hellip;')] if start else []
+    last = 0
+    for match in pattern.finditer(fragment):
+        parts.append(escape(fragment[last:match.start()]))
+        parts.append(Markup('<mark>%s</mark>') % match.group())
+        last = match.end()
+    parts.append(escape(fragment[last:]))
+    if start + width < len(text):
+        parts.append(Markup('&hellip;'))
+    return Markup('').join(parts)
+
+
+backends = {'fts5': Fts5Backend, 'python': TermBackend}
+
+
+@event.listens_for(db.Model.metadata, 'after_create')
+def create_fts(target, connection, **kw):
+    if connection.dialect.name == 'sqlite' and fts5_available():
+        Fts5Backend.create(connection)
+
+
+@event.listens_for(db.Model.metadata, 'before_drop')
+def drop_fts(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        connection.execute('DROP TABLE IF EXISTS search_fts')
+
+
+def _changed(obj):
+    # 没有加载过的属性 (例如延迟加载的 body) 不可能被修改, 不为了比较而去加载它
+    return any(get_history(obj, attr, passive=PASSIVE_NO_INITIALIZE).has_changes()
+               for attr in TRACKED[type(obj)])
+
+
+@event.listens_for(SignallingSession, 'after_flush')
+def update_search_index(session, flush_context):
+    """在同一个事务中重新索引本次 flush 新增和修改了文本的对象, 删除被删除对象的索引"""
+    if not has_app_context() or 'search' not in current_app.extensions:
+        return
+    changed = [obj for obj in session.new if type(obj) in TRACKED]
+    changed += [obj for obj in session.dirty if type(obj) in TRACKED and _changed(obj)]
+    deleted = [obj.id * 4 + KINDS[obj.__tablename__] for obj in session.deleted if type(obj) in TRACKED]
+    if not changed and not deleted:
+        return
+
+    backend = current_app.extensions['search']
+    connection = session.connection()
+    documents = [document(obj) for obj in changed]
+    backend.remove(connection, deleted + [doc for doc, title, body in documents])
+    backend.add(connection, [(doc, title, body) for doc, title, body in documents if body is not None])
+
+
+search_index = SearchIndex()
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+import hmac
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import closing
+
+from flask import current_app
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash
+
+from myblog.utils import cache_path
+
+
+def password_method(app):
+    """配置的哈希方法, PBKDF2 没有写迭代次数时补上 werkzeug 的默认值, 与哈希值中记录的方法一致"""
+    method = app.config['MYBLOG_PASSWORD_METHOD']
+    if method.startswith('pbkdf2:') and method.count(':') == 1:
+        method += ':%d' % DEFAULT_PBKDF2_ITERATIONS
+    return method
+
+
+def hash_password(password):
+    app = current_app._get_current_object()
+    return generate_password_hash(password, password_method(app), app.config['MYBLOG_PASSWORD_SALT_LENGTH'])
+
+
+def needs_rehash(password_hash):
+    """哈希值的方法或盐的长度与当前配置不同"""
+    app = current_app._get_current_object()
+    if not password_hash or password_hash.count('$') < 2:
+        return True
+    method, salt = password_hash.split('$', 2)[:2]
+    return method != password_method(app) or len(salt) != app.config['MYBLOG_PASSWORD_SALT_LENGTH']
+
+
+class MemoryBackend(object):
+    """进程内的失败记录: 键 -> 时间戳队列, 键的数量超过上限时丢弃最久没有失败的键"""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key, now):
+        with self._lock:
+            self._entries.setdefault(key, deque()).append(now)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+
+    def recent(self, key, since):
+        with self._lock:
+            times = self._entries.get(key)
+            if times is None:
+                return []
+            while times and times[0] < since:
+                times.popleft()
+            if not times:
+                del self._entries[key]
+            return list(times)
+
+    def clear(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class SQLiteBackend(object):
+    """SQLite 文件中的失败记录, 多个 worker 共享, 与站点使用的数据库无关"""
+
+    def __init__(self, path, window):
+        self.path = path
+        self.window = window
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with closing(self._connect()) as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS login_failure (key TEXT, time REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_login_failure_key_time ON login_failure (key, time)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5, isolation_level=None)
+
+    def add(self, key, now):
+        with closing(self._connect()) as connection:
+            connection.execute('INSERT INTO login_failure (key, time) VALUES (?, ?)', (key, now))
+            # 顺便删除所有键中已经滑出窗口的记录
+            connection.execute('DELETE FROM login_failure WHERE time < ?', (now - self.window,))
+
+    def recent(self, key, since):
+        with closing(self._connect()) as connection:
+            return [row[0] for row in connection.execute(
+                'SELECT time FROM login_failure WHERE key = ? AND time >= ? ORDER BY time', (key, since))]
+
+    def clear(self, key):
+        with closing(self._connect()) as connection:
+            connection.execute('DELETE FROM login_failure WHERE key = ?', (key,))
+
+
+backends = {
+    'memory': lambda app: MemoryBackend(app.config['MYBLOG_LOGIN_THROTTLE_KEYS']),
+    'sqlite': lambda app: SQLiteBackend(cache_path(app, 'login.db'), app.config['MYBLOG_LOGIN_WINDOW']),
+}
+
+
+class LoginGuard(object):
+    """登录保护: 按 IP 和用户名分别统计滑动窗口内的失败次数, 超过限制时在查询数据库和计算哈希之前拒绝,
+    IP 取自 request.remote_addr, 部署在反向代理之后时需要配置 MYBLOG_PROXY_FIX;
+    用户名错误时不计算哈希, 而是等待与计算哈希相近的时间, 响应时间不会暴露用户名, 也不占用 CPU"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        name = app.config['MYBLOG_LOGIN_THROTTLE']
+        app.extensions['login_guard'] = _State(backends[name](app) if name else None)
+
+    @staticmethod
+    def _state():
+        return current_app.extensions['login_guard']
+
+    @staticmethod
+    def _keys(ip, username=None):
+        keys = [('ip:%s' % ip, current_app.config['MYBLOG_LOGIN_IP_LIMIT'])]
+        if username is not None:
+            keys.append(('user:%s' % username.lower(), current_app.config['MYBLOG_LOGIN_USER_LIMIT']))
+        return keys
+
+    def retry_after(self, ip, username=None):
+        """被限制时返回还需等待的秒数, 否则返回 0. 用户名超过限制时只拒绝最近也失败过的 IP,
+        否则任何人在别处失败几次就能把管理员锁在外面"""
+        backend = self._state().backend
+        if backend is None:
+            return 0
+        now = time.time()
+        window = current_app.config['MYBLOG_LOGIN_WINDOW']
+        keys = self._keys(ip, username)
+        ip_times = backend.recent(keys[0][0], now - window)
+        checks = [(ip_times, keys[0][1])]
+        if ip_times:
+            checks += [(backend.recent(key, now - window), limit) for key, limit in keys[1:]]
+        wait = 0
+        for times, limit in checks:
+            if len(times) >= limit:
+                # 最早的若干次失败滑出窗口后才能再次尝试
+                wait = max(wait, times[len(times) - limit] + window - now)
+        return int(wait) + 1 if wait else 0
+
+    def failed(self, ip, username):
+        backend = self._state().backend
+        if backend is not None:
+            now = time.time()
+            for key, limit in self._keys(ip, username):
+                backend.add(key, now)
+
+    def succeeded(self, ip, username):
+        backend = self._state().backend
+        if backend is not None:
+            for key, limit in self._keys(ip, username):
+                backend.clear(key)
+
+    def verify(self, admin, username, password):
+        state = self._state()
+        start = time.perf_counter()
+        if not hmac.compare_digest(username.encode('utf-8'), admin.username.encode('utf-8')):
+            if state.hash_seconds is None:
+                # 第一次时计算一次哈希来估计耗时
+                hash_password(password)
+                state.hash_seconds = time.perf_counter() - start
+            else:
+                time.sleep(max(state.hash_seconds - (time.perf_counter() - start), 0))
+            return False
+
+        valid = admin.validate_password(password)
+        elapsed = time.perf_counter() - start
+        state.hash_seconds = elapsed if state.hash_seconds is None else state.hash_seconds * 0.8 + elapsed * 0.2
+        return valid
+
+
+class _State(object):
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hash_seconds = None
@@ -2,6 +2,7 @@
 
 import os
 import sys
+import tempfile
 
 basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
 
@@ -17,30 +18,108 @@ class BaseConfig(object):
     DEBUG_TB_INTERCEPT_REDIRECTS = False
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    SQLALCHEMY_RECORD_QUERIES = True
+    SQLALCHEMY_RECORD_QUERIES = False
 
     SSL_DISABLED = True
 
     MYBLOG_THOUGHT_PER_PAGE = 15
     MYBLOG_POST_PER_PAGE = 10
+    MYBLOG_ARCHIVE_PER_PAGE = 100
     MYBLOG_MANAGE_THOUGHT_PER_PAGE = 20
     MYBLOG_MANAGE_POST_PER_PAGE = 15
     MYBLOG_COMMENT_PER_PAGE = 10
     MYBLOG_SLOW_QUERY_THRESHOLD = 1
 
+    # 多个 worker 共享缓存版本戳的目录, 为空时只在进程内缓存
+    MYBLOG_CACHE_DIR = os.getenv('MYBLOG_CACHE_DIR')
+    MYBLOG_LOG_FILE = os.path.join(basedir, 'logs/myblog.log')
+
+    # 匿名读者的整页缓存: 为空时关闭, 'memory' 为进程内 LRU, 'file' 为多个 worker 共享的磁盘缓存
+    MYBLOG_PAGE_CACHE = os.getenv('MYBLOG_PAGE_CACHE')
+    MYBLOG_PAGE_CACHE_SIZE = 512
+    MYBLOG_PAGE_CACHE_TIMEOUT = 300
+
+    # 查询统计: 按采样率抽取请求, 按 endpoint 聚合语句指纹, 每隔若干秒写入缓存目录
+    MYBLOG_QUERY_SAMPLE_RATE = float(os.getenv('MYBLOG_QUERY_SAMPLE_RATE', 1))
+    MYBLOG_QUERY_STATS_SIZE = 2000
+    MYBLOG_QUERY_STATS_FLUSH = 60
+
+    # 请求计时: Server-Timing 响应头, 以及按 endpoint 保存最近两个窗口 (秒) 的延迟直方图
+    MYBLOG_SERVER_TIMING = True
+    MYBLOG_TIMING_WINDOW = 300
+    MYBLOG_TIMING_FLUSH = 60
+
+    # 全文搜索: 为空时 SQLite 使用 FTS5, 其他数据库使用 'python' 倒排索引表
+    MYBLOG_SEARCH_BACKEND = os.getenv('MYBLOG_SEARCH_BACKEND')
+    MYBLOG_SEARCH_RESULT_PER_PAGE = 10
+
+    # 上传图片的处理: 生成的宽度, 格式 (按优先顺序, 最后一个用作回退) 和压缩质量
+    MYBLOG_IMAGE_WIDTHS = (480, 960, 1600)
+    MYBLOG_IMAGE_FORMATS = ('webp', 'jpeg')
+    MYBLOG_IMAGE_QUALITY = 80
+
+    # 后台任务: 进程内 worker 线程数 (为 0 时只由 flask worker 处理), 空闲时的轮询间隔 (秒),
+    # 最多尝试次数, 首次重试的延迟 (秒, 之后每次加倍), 认为 worker 已经退出的运行时间 (秒), 完成的任务保留的天数
+    MYBLOG_TASK_WORKERS = int(os.getenv('MYBLOG_TASK_WORKERS', 1))
+    MYBLOG_TASK_POLL = 5
+    MYBLOG_TASK_ATTEMPTS = 3
+    MYBLOG_TASK_RETRY_DELAY = 30
+    MYBLOG_TASK_TIMEOUT = 600
+    MYBLOG_TASK_KEEP_DAYS = 7
+
+    # 数据库引擎方案 (见 myblog/database.py), 可以用 MYBLOG_DB_PRAGMAS 覆盖其中的 PRAGMA;
+    # 方案带有只读连接池时, 这些蓝本的 GET 请求使用只读连接, MYBLOG_DB_READ_URI 为空时连接同一个数据库
+    MYBLOG_DB_PROFILE = os.getenv('MYBLOG_DB_PROFILE', 'default')
+    MYBLOG_DB_PRAGMAS = None
+    MYBLOG_DB_READ_URI = os.getenv('MYBLOG_DB_READ_URI')
+    MYBLOG_DB_READ_BLUEPRINTS = ('blog',)
+
+    # flask assets build 生成的带摘要文件的缓存时间 (秒)
+    MYBLOG_ASSETS_MAX_AGE = 365 * 24 * 3600
+
+    # ASGI 入口 (asgi.py): 这些 endpoint 的 GET 请求使用只读线程池, 同一 URL 的匿名请求合并为一次渲染;
+    # 其余请求使用另一个线程池
+    MYBLOG_ASGI_READ_ENDPOINTS = ('blog.index', 'blog.show_post', 'blog.thought', 'blog.archive',
+                                  'blog.show_topic', 'blog.show_category', 'blog.about')
+    MYBLOG_ASGI_READ_THREADS = int(os.getenv('MYBLOG_ASGI_READ_THREADS', 8))
+    MYBLOG_ASGI_THREADS = int(os.getenv('MYBLOG_ASGI_THREADS', 4))
+
+    # 登录保护: 失败记录保存在 'memory' (进程内) 或 'sqlite' (缓存目录, 多个 worker 共享), 为空时不限制;
+    # 窗口 (秒) 内同一 IP 或同一用户名失败达到次数后拒绝登录, 内存中最多保留的键数
+    MYBLOG_LOGIN_THROTTLE = os.getenv('MYBLOG_LOGIN_THROTTLE', 'memory')
+    MYBLOG_LOGIN_WINDOW = 15 * 60
+    MYBLOG_LOGIN_IP_LIMIT = 20
+    MYBLOG_LOGIN_USER_LIMIT = 5
+    MYBLOG_LOGIN_THROTTLE_KEYS = 10000
+    # 前面的反向代理层数, 大于 0 时按 X-Forwarded-For 等头还原客户端地址
+    MYBLOG_PROXY_FIX = int(os.getenv('MYBLOG_PROXY_FIX', 0))
+
+    # 密码哈希的方法和盐的长度, 修改后管理员下次登录时按新的参数重新计算
+    MYBLOG_PASSWORD_METHOD = 'pbkdf2:sha256:260000'
+    MYBLOG_PASSWORD_SALT_LENGTH = 16
+
 
 class DevelopmentConfig(BaseConfig):
     SQLALCHEMY_DATABASE_URI = prefix + os.path.join(basedir, 'data-dev.db')
+    MYBLOG_DB_PROFILE = os.getenv('MYBLOG_DB_PROFILE', 'sqlite-development')
 
 
 class TestingConfig(BaseConfig):
     TESTING = True
     WTF_CSRF_ENABLED = False
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'  # in-memory database
+    MYBLOG_TASK_WORKERS = 0
+    MYBLOG_PASSWORD_METHOD = 'pbkdf2:sha256:1000'
+    MYBLOG_LOG_FILE = None
+    # 每个测试进程使用自己的缓存目录, 不写入 instance 目录
+    MYBLOG_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'myblog-test-%d' % os.getpid())
 
 
 class ProductionConfig(BaseConfig):
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', prefix + os.path.join(basedir, 'data-dev.db'))
+    MYBLOG_CACHE_DIR = os.getenv('MYBLOG_CACHE_DIR', os.path.join(basedir, 'cache'))
+    MYBLOG_QUERY_SAMPLE_RATE = float(os.getenv('MYBLOG_QUERY_SAMPLE_RATE', 0.1))
+    MYBLOG_DB_PROFILE = os.getenv('MYBLOG_DB_PROFILE', 'sqlite-production')
 
 
 config = {
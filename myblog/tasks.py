@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+import json
+import math
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event, func
+from sqlalchemy.orm import undefer_group
+
+from myblog.extensions import db, image_pipeline, page_cache
+from myblog.models import Job, Post
+
+STATUSES = ('pending', 'running', 'done', 'failed')
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(math.ceil(q * len(values))) - 1)]
+
+
+class TaskQueue(object):
+    """保存在 job 表中的后台任务队列: 视图用 enqueue 登记任务, 随请求的事务一起提交, 重启后仍然存在;
+    worker 线程 (进程内或 flask worker) 逐个领取任务, 失败后按指数退避重试"""
+
+    def __init__(self, app=None):
+        self.tasks = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['task_queue'] = _State()
+
+        @app.before_first_request
+        def start_workers():
+            if app.config['MYBLOG_TASK_WORKERS']:
+                self.start(app, app.config['MYBLOG_TASK_WORKERS'])
+
+    @staticmethod
+    def _state():
+        return current_app.extensions['task_queue']
+
+    def task(self, name):
+        """注册任务函数, 参数为 enqueue 时给出的关键字参数"""
+        def decorator(f):
+            self.tasks[name] = f
+            return f
+        return decorator
+
+    def enqueue(self, name, **payload):
+        """登记一个任务, 由调用者提交事务; 提交后唤醒本进程的 worker"""
+        if name not in self.tasks:
+            raise ValueError('Unknown task %s.' % name)
+        job = Job(name=name, payload=json.dumps(payload, sort_keys=True),
+                  max_attempts=current_app.config['MYBLOG_TASK_ATTEMPTS'])
+        db.session.add(job)
+        db.session().info['enqueued'] = True
+        return job
+
+    def claim(self):
+        """领取最早可以执行的任务, 多个 worker 之间用带状态条件的 UPDATE 避免重复领取"""
+        table = Job.__table__
+        while True:
+            now = datetime.utcnow()
+            job_id = db.session.query(Job.id).filter(Job.status == 'pending', Job.run_at <= now) \
+                .order_by(Job.run_at, Job.id).limit(1).scalar()
+            if job_id is None:
+                db.session.commit()
+                return None
+            result = db.session.execute(
+                table.update().where((table.c.id == job_id) & (table.c.status == 'pending'))
+                .values(status='running', started=now, finished=None, attempts=table.c.attempts + 1))
+            db.session.commit()
+            if result.rowcount:
+                return Job.query.get(job_id)
+
+    def run(self, job):
+        """执行任务, 任务函数自己提交对数据的修改; 失败时回滚并安排重试, 用完尝试次数后标记为 failed"""
+        job_id = job.id
+        try:
+            task = self.tasks.get(job.name)
+            if task is None:
+                raise LookupError('Unknown task %s.' % job.name)
+            task(**json.loads(job.payload))
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.exception('Task %s #%d failed' % (job.name, job_id))
+            job = Job.query.get(job_id)
+            job.error = '%s: %s' % (type(e).__name__, e)
+            if job.attempts < job.max_attempts:
+                delay = current_app.config['MYBLOG_TASK_RETRY_DELAY'] * 2 ** (job.attempts - 1)
+                job.status, job.run_at = 'pending', datetime.utcnow() + timedelta(seconds=delay)
+            else:
+                job.status, job.finished = 'failed', datetime.utcnow()
+        else:
+            job = Job.query.get(job_id)
+            job.status, job.finished, job.error = 'done', datetime.utcnow(), None
+        db.session.commit()
+        return job.status
+
+    def run_pending(self, limit=None):
+        """执行到没有可以领取的任务为止, 返回执行的任务数"""
+        count = 0
+        while limit is None or count < limit:
+            job = self.claim()
+            if job is None:
+                break
+            self.run(job)
+            count += 1
+        return count
+
+    def recover(self):
+        """worker 退出时正在运行的任务重新排队, 并删除过期的已完成任务"""
+        now = datetime.utcnow()
+        config = current_app.config
+        recovered = Job.query.filter(Job.status == 'running',
+                                     Job.started < now - timedelta(seconds=config['MYBLOG_TASK_TIMEOUT'])) \
+            .update(dict(status='pending', run_at=now), synchronize_session=False)
+        Job.query.filter(Job.status == 'done', Job.finished < now - timedelta(days=config['MYBLOG_TASK_KEEP_DAYS'])) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+        return recovered
+
+    def work(self, app, stop=None):
+        """worker 循环: 有任务时连续执行, 空闲时等待唤醒或轮询间隔"""
+        state = app.extensions['task_queue']
+        with app.app_context():
+            self.recover()
+            while stop is None or not stop.is_set():
+                try:
+                    ran = self.run_pending()
+                except Exception:
+                    app.logger.exception('Task worker failed')
+                    db.session.rollback()
+                    ran = 0
+                finally:
+                    db.session.remove()
+                if not ran:
+                    state.wakeup.wait(app.config['MYBLOG_TASK_POLL'])
+                    state.wakeup.clear()
+
+    def start(self, app, threads=1, stop=None):
+        """在后台线程中运行 worker, 返回线程列表"""
+        workers = []
+        for i in range(threads):
+            thread = threading.Thread(target=self.work, args=(app, stop), name='task-worker-%d' % i, daemon=True)
+            thread.start()
+            workers.append(thread)
+        return workers
+
+    def stats(self, limit=500):
+        """状态页: 各状态的任务数, 最早的待执行任务, 以及最近完成的任务按任务名统计的等待和执行时间 (秒)"""
+        counts = dict((status, 0) for status in STATUSES)
+        counts.update(db.session.query(Job.status, func.count()).group_by(Job.status))
+        oldest = db.session.query(func.min(Job.created)).filter(Job.status == 'pending').scalar()
+
+        timings = {}
+        recent = db.session.query(Job.name, Job.created, Job.started, Job.finished) \
+            .filter(Job.status == 'done').order_by(Job.finished.desc()).limit(limit)
+        for name, created, started, finished in recent:
+            waits, runs = timings.setdefault(name, ([], []))
+            waits.append((started - created).total_seconds())
+            runs.append((finished - started).total_seconds())
+        rows = [dict(name=name, count=len(waits), wait_p50=percentile(waits, 0.5), wait_p95=percentile(waits, 0.95),
+                     run_p50=percentile(runs, 0.5), run_p95=percentile(runs, 0.95))
+                for name, (waits, runs) in sorted(timings.items())]
+        return dict(counts=counts, depth=counts['pending'] + counts['running'], oldest=oldest, tasks=rows)
+
+    def retry(self, job):
+        job.status, job.run_at, job.attempts = 'pending', datetime.utcnow(), 0
+        db.session.commit()
+        self._state().wakeup.set()
+
+
+class _State(object):
+
+    def __init__(self):
+        self.wakeup = threading.Event()
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def wake_workers(session):
+    if session.info.pop('enqueued', False):
+        state = session.app.extensions.get('task_queue')
+        if state is not None:
+            state.wakeup.set()
+
+
+task_queue = TaskQueue()
+
+
+@task_queue.task('images.process')
+def process_image(relpath):
+    """生成上传图片的各个版本, 没有安装 Pillow 时什么也不做"""
+    if image_pipeline.available:
+        image_pipeline.process(relpath)
+
+
+@task_queue.task('post.render')
+def render_post(post_id):
+    """渲染文章的 Markdown, 完成前文章页由浏览器渲染"""
+    post = Post.query.options(undefer_group('content')).get(post_id)
+    if post is not None and post.render_body():
+        db.session.commit()
+        page_cache.purge_post(post)
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from myblog.utils import WorkerFiles, cache_path
+
+METRICS = ('total', 'db', 'render', 'context')
+
+
+class Histogram(object):
+    """HDR 风格的对数分桶直方图 (毫秒): 每个 2 倍区间分成 SUB_BUCKETS 个桶,
+    相对误差约 9%, 桶稀疏存储, 内存与请求数无关"""
+
+    LOWEST = 0.01
+    SUB_BUCKETS = 8
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @classmethod
+    def index(cls, value):
+        if value <= cls.LOWEST:
+            return 0
+        return int(math.log2(value / cls.LOWEST) * cls.SUB_BUCKETS) + 1
+
+    @classmethod
+    def upper(cls, index):
+        return cls.LOWEST * 2 ** (index / float(cls.SUB_BUCKETS))
+
+    def record(self, value):
+        index = self.index(value)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        return self
+
+    def percentile(self, q):
+        """第 q 分位数所在桶的上界, 不超过最大值"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= target:
+                return min(self.upper(index), self.max)
+        return self.max
+
+    def to_dict(self):
+        return dict(buckets=self.buckets, count=self.count, total=self.total, max=self.max)
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        histogram.buckets = dict((int(index), count) for index, count in data['buckets'].items())
+        histogram.count, histogram.total, histogram.max = data['count'], data['total'], data['max']
+        return histogram
+
+
+class TimingStats(object):
+    """按 (endpoint, 指标) 保存直方图, 保留当前和上一个时间窗口, 因此报告覆盖最近一到两个窗口"""
+
+    def __init__(self, window=300):
+        self.window = window
+        self.lock = threading.Lock()
+        self.current, self.previous = {}, {}
+        self.started = time.monotonic()
+
+    def _rotate(self):
+        now = time.monotonic()
+        if now - self.started >= self.window * 2:
+            self.current, self.previous = {}, {}
+            self.started = now
+        elif now - self.started >= self.window:
+            self.current, self.previous = {}, self.current
+            self.started = now
+
+    def record(self, endpoint, timings):
+        with self.lock:
+            self._rotate()
+            for metric, value in timings.items():
+                histogram = self.current.get((endpoint, metric))
+                if histogram is None:
+                    histogram = self.current[(endpoint, metric)] = Histogram()
+                histogram.record(value)
+
+    def histograms(self):
+        with self.lock:
+            self._rotate()
+            merged = {}
+            for histograms in (self.previous, self.current):
+                for key, histogram in histograms.items():
+                    merged.setdefault(key, Histogram()).merge(histogram)
+            return merged
+
+    def clear(self):
+        with self.lock:
+            self.current, self.previous = {}, {}
+
+
+class RequestTimer(object):
+    """记录每个请求的总时间, 数据库时间, 模板渲染时间和上下文处理器时间,
+    写入 Server-Timing 响应头, 并按 endpoint 汇总为直方图"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['request_timer'] = _State(TimingStats(app.config['MYBLOG_TIMING_WINDOW']),
+                                                 WorkerFiles(cache_path(app, 'timing')))
+
+        @app.before_request
+        def start_timer():
+            g.timings = dict(start=time.perf_counter(), db=0.0, render=0.0, context=0.0)
+
+        @app.after_request
+        def finish_timer(response):
+            timings = g.pop('timings', None)
+            if timings is None:
+                return response
+            start = timings.pop('start')
+            timings['total'] = time.perf_counter() - start
+            timings = dict((metric, value * 1000) for metric, value in timings.items())
+
+            if app.config['MYBLOG_SERVER_TIMING']:
+                response.headers['Server-Timing'] = ', '.join(
+                    '%s;dur=%.1f' % (metric, timings[metric]) for metric in METRICS)
+
+            state = app.extensions['request_timer']
+            state.stats.record(request.endpoint or '<unmatched>', timings)
+            if time.monotonic() - state.files.flushed >= app.config['MYBLOG_TIMING_FLUSH']:
+                self.flush()
+            return response
+
+        before_render_template.connect(_start_render, app)
+        template_rendered.connect(_finish_render, app)
+
+    @staticmethod
+    def _state():
+        return current_app.extensions['request_timer']
+
+    @contextmanager
+    def track(self, metric):
+        """把一段代码的耗时计入当前请求的某项指标"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timings = g.get('timings') if has_request_context() else None
+            if timings is not None:
+                timings[metric] += time.perf_counter() - start
+
+    def flush(self):
+        """把本进程的直方图写入缓存目录"""
+        state = self._state()
+        if not state.files.current():
+            state.stats.clear()
+        state.files.write([[endpoint, metric, histogram.to_dict()]
+                           for (endpoint, metric), histogram in state.stats.histograms().items()])
+
+    def collect(self):
+        """汇总所有 worker 的直方图, 本进程使用内存中的最新结果"""
+        state = self._state()
+        if not state.files.current():
+            state.stats.clear()
+        merged = state.stats.histograms()
+        # 报告只覆盖最近一到两个窗口, 更早写入的文件不再参与汇总
+        for data in state.files.others(max_age=current_app.config['MYBLOG_TIMING_WINDOW'] * 2):
+            for endpoint, metric, histogram in data:
+                merged.setdefault((endpoint, metric), Histogram()).merge(Histogram.from_dict(histogram))
+        return merged
+
+    def report(self, endpoint=None):
+        """每个 endpoint 和指标的请求数, 平均值, p50, p90, p99 和最大值 (毫秒), 按总时间的 p99 倒序"""
+        rows = []
+        for (name, metric), histogram in self.collect().items():
+            if endpoint is not None and name != endpoint:
+                continue
+            rows.append(dict(endpoint=name, metric=metric, count=histogram.count,
+                             mean=histogram.total / histogram.count if histogram.count else 0.0,
+                             p50=histogram.percentile(0.5), p90=histogram.percentile(0.9),
+                             p99=histogram.percentile(0.99), max=histogram.max))
+        p99 = dict((row['endpoint'], row['p99']) for row in rows if row['metric'] == 'total')
+        rows.sort(key=lambda row: (-p99.get(row['endpoint'], 0), row['endpoint'], METRICS.index(row['metric'])))
+        return rows
+
+    def reset(self):
+        """清空所有 worker 的直方图"""
+        state = self._state()
+        state.stats.clear()
+        state.files.reset()
+
+
+class _State(object):
+
+    def __init__(self, stats, files):
+        self.stats = stats
+        self.files = files
+
+
+def _start_render(sender, template, context, **extra):
+    if 'timings' in g:
+        g.render_start = time.perf_counter()
+
+
+def _finish_render(sender, template, context, **extra):
+    start = g.pop('render_start', None)
+    if start is not None and 'timings' in g:
+        g.timings['render'] += time.perf_counter() - start
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_db_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info['timing_start'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _finish_db_timer(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop('timing_start', None)
+    if start is not None and has_request_context():
+        timings = g.get('timings')
+        if timings is not None:
+            timings['db'] += time.perf_counter() - start
@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import json
+import os
+import time
+import uuid
 from urllib.parse import urlparse, urljoin
 
-from flask import request, redirect, url_for
+from flask import request, redirect, url_for, session
+from flask_login import current_user
 
 
 def is_safe_url(target):
@@ -17,4 +22,113 @@ def redirect_back(default='blog.index', **kwargs):
             continue
         if is_safe_url(target):
             return redirect(target)
-    return redirect(url_for(default, **kwargs))
\ No newline at end of file
+    return redirect(url_for(default, **kwargs))
+
+
+def is_anonymous_read():
+    """匿名读者的 GET 请求, 且没有待显示的消息, 此时页面内容与访问者无关"""
+    if request.method != 'GET' or '_flashes' in session:
+        return False
+    return not current_user.is_authenticated
+
+
+def cache_path(app, *parts):
+    """缓存目录下的路径, 没有配置 MYBLOG_CACHE_DIR 时使用 instance 目录"""
+    return os.path.join(app.config['MYBLOG_CACHE_DIR'] or os.path.join(app.instance_path, 'cache'), *parts)
+
+
+class VersionStamp(object):
+    """版本戳: 配置了文件路径时各个 worker 通过文件共享, 否则只在本进程内有效"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._local = uuid.uuid4().hex
+
+    def read(self):
+        if self.path is None:
+            return self._local
+        try:
+            with open(self.path) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def bump(self):
+        self._local = uuid.uuid4().hex
+        if self.path is not None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                f.write(self._local)
+            os.replace(tmp_path, self.path)
+        return self._local
+
+
+class WorkerFiles(object):
+    """各个 worker 的统计文件: 每个进程把自己的统计写入 <目录>/<pid>.json, 汇总时读取其他进程的文件.
+    文件记录写入时的代次, 清空统计时更新代次, 旧代次的文件不再参与汇总, 所属进程下次写入前先清空内存中的统计"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.stamp = VersionStamp(os.path.join(directory, 'generation'))
+        self.generation = self.stamp.read()
+        self.flushed = time.monotonic()
+
+    def current(self):
+        """内存中的统计属于当前代次; 其他进程清空过统计时记下新的代次并返回 False, 调用方应清空内存中的统计"""
+        generation = self.stamp.read()
+        if generation == self.generation:
+            return True
+        self.generation = generation
+        return False
+
+    def write(self, data):
+        self.flushed = time.monotonic()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, '%d.json' % os.getpid())
+        with open(path + '.tmp', 'w') as f:
+            json.dump(dict(generation=self.generation, time=time.time(), data=data), f)
+        os.replace(path + '.tmp', path)
+
+    def others(self, max_age=None, alive=False):
+        """其他进程在当前代次写入的数据, 给出 max_age 时跳过超过这么多秒没有写入的文件
+        (已经退出或重启的 worker, 以及长时间空闲没有写入的 worker); alive 为真时跳过进程已经退出的文件"""
+        own = '%d.json' % os.getpid()
+        now = time.time()
+        names = os.listdir(self.directory) if os.path.isdir(self.directory) else []
+        for name in names:
+            if not name.endswith('.json') or name == own:
+                continue
+            if alive and not _process_alive(name[:-len('.json')]):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    content = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not isinstance(content, dict) or content.get('generation') != self.generation:
+                continue
+            if max_age is not None and now - content.get('time', 0) > max_age:
+                continue
+            yield content['data']
+
+    def reset(self):
+        """开始新的代次, 删除所有进程的文件"""
+        self.generation = self.stamp.bump()
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+
+def _process_alive(pid):
+    """本机上 pid 对应的进程是否存在"""
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        return True
+    return True
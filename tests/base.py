@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 import unittest
+from contextlib import contextmanager
 
 from flask import url_for
+from sqlalchemy import event
 
 from myblog import create_app
 from myblog.extensions import db
@@ -38,4 +40,18 @@ class BaseTestCase(unittest.TestCase):
         ), follow_redirects=True)
 
     def logout(self):
-        return self.client.get(url_for('auth.logout'), follow_redirects=True)
\ No newline at end of file
+        return self.client.get(url_for('auth.logout'), follow_redirects=True)
+
+    @contextmanager
+    def assertQueryCount(self, count):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        self.assertEqual(len(statements), count, '\n\n'.join(statements))
\ No newline at end of file
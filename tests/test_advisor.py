@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from myblog.advisor import advise, problems
+from myblog.counters import rebuild_counters
+from myblog.extensions import db
+from myblog.models import Category, Comment, Post, Thought, Topic
+
+from tests.base import BaseTestCase
+
+
+class AdvisorTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(AdvisorTestCase, self).setUp()
+        category = Category(name='Default')
+        topic = Topic(name='test', category=category)
+        for i in range(3):
+            post = Post(title='Post %d' % i, body='Blah...', category=category, topic=topic)
+            post.comments.append(Comment(body='A comment', reviewed=True))
+            post.comments.append(Comment(body='Unread', reviewed=False))
+            db.session.add(post)
+        db.session.add(Thought(body='Thinking'))
+        db.session.commit()
+        rebuild_counters()
+
+    def test_problems(self):
+        statement = 'SELECT c.id FROM comment AS c WHERE c.reviewed = ? ORDER BY c.id'
+        self.assertEqual(problems(['SCAN c', 'USE TEMP B-TREE FOR ORDER BY'], statement),
+                         [('comment', 'scan', 'SCAN c'), (None, 'sort', 'USE TEMP B-TREE FOR ORDER BY')])
+        self.assertEqual(problems(['SCAN comment USING INDEX ix_comment_timestamp'], statement),
+                         [('comment', 'index scan', 'SCAN comment USING INDEX ix_comment_timestamp')])
+        self.assertEqual(problems(['SCAN post USING INDEX ix_post_create_time'], 'SELECT post.id FROM post'), [])
+        self.assertEqual(problems(['SCAN anon_1', 'SCAN CONSTANT ROW'], 'SELECT anon_1.id FROM (...) AS anon_1'), [])
+
+    def test_hot_paths_use_indexes(self):
+        findings = advise()
+        endpoints = set(endpoint for finding in findings for endpoint in finding['endpoints'])
+        self.assertIn('blog.index', endpoints)
+        self.assertIn('admin.new_post', endpoints)
+
+        scanned = [(finding['detail'], finding['endpoints']) for finding in findings
+                   if finding['kind'] != 'sort' and finding['table'] == 'comment']
+        self.assertEqual(scanned, [])
+        scanned = [(finding['detail'], finding['endpoints']) for finding in findings
+                   if finding['table'] == 'post' and
+                   set(finding['endpoints']) & {'blog.show_topic', 'blog.show_category', 'blog.show_post'}]
+        self.assertEqual(scanned, [])
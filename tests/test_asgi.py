@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from urllib.parse import urlencode
+
+from myblog import create_app
+from myblog.asgi import AsgiApp, make_environ
+from myblog.extensions import db
+from myblog.models import Admin, Category, Post, Topic
+
+
+class AsgiTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = create_app('testing')
+        # 线程池中的请求需要看到同一个数据库, 不能使用内存数据库
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(self.directory, 'blog.db')
+        with self.app.app_context():
+            db.create_all()
+            admin = Admin(name='syntomic', username='zhouh', about='I am test', blog_title='Testlog')
+            admin.set_password('123')
+            category = Category(name='Default')
+            db.session.add_all([admin, Post(title='Hello ASGI', body='Blah...', category=category,
+                                            topic=Topic(name='test', category=category))])
+            db.session.commit()
+        self.asgi = AsgiApp(self.app)
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.asgi.read_pool.shutdown()
+        self.asgi.pool.shutdown()
+        self.loop.close()
+        with self.app.app_context():
+            db.get_engine().dispose()
+        shutil.rmtree(self.directory)
+
+    async def request(self, path, method='GET', headers=(), body=b''):
+        scope = dict(type='http', http_version='1.1', method=method, scheme='http', path=path, root_path='',
+                     query_string=b'', headers=[(name.encode(), value.encode()) for name, value in headers],
+                     server=('localhost', 80), client=('127.0.0.1', 1234))
+        messages = [dict(type='http.request', body=body, more_body=False)]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        await self.asgi(scope, receive, send)
+        return sent[0]['status'], dict(sent[0]['headers']), sent[1]['body']
+
+    def gather(self, *requests):
+        async def run():
+            return await asyncio.gather(*requests)
+        return self.loop.run_until_complete(run())
+
+    def count_calls(self, endpoint):
+        """让视图变慢以便请求重叠, 返回调用计数"""
+        calls = []
+        view = self.app.view_functions[endpoint]
+
+        def slow_view(**kwargs):
+            calls.append(kwargs)
+            time.sleep(0.1)
+            return view(**kwargs)
+
+        self.app.view_functions[endpoint] = slow_view
+        return calls
+
+    def test_read_and_write_requests(self):
+        (status, headers, body), = self.gather(self.request('/post/1'))
+        self.assertEqual(status, 200)
+        self.assertIn(b'Hello ASGI', body)
+        self.assertIn(b'etag', headers)
+
+        data = urlencode(dict(username='zhouh', password='123')).encode()
+        (status, headers, body), = self.gather(self.request(
+            '/auth/login', method='POST', body=data,
+            headers=[('content-type', 'application/x-www-form-urlencoded'), ('content-length', str(len(data)))]))
+        self.assertEqual(status, 302)
+        self.assertIn(b'set-cookie', headers)
+
+    def test_coalesce_anonymous_reads(self):
+        calls = self.count_calls('blog.show_post')
+        responses = self.gather(*[self.request('/post/1') for i in range(5)])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.asgi.coalesced, 4)
+        self.assertEqual(set(status for status, headers, body in responses), {200})
+        self.assertEqual(len(set(body for status, headers, body in responses)), 1)
+        self.assertEqual(self.asgi.inflight, {})
+
+    def test_logged_in_reads_are_not_shared(self):
+        calls = self.count_calls('blog.show_post')
+        cookie = self.app.session_interface.get_signing_serializer(self.app).dumps({'_user_id': '1'})
+        headers = [('cookie', '%s=%s' % (self.app.session_cookie_name, cookie))]
+        self.gather(*[self.request('/post/1', headers=headers) for i in range(3)])
+        self.assertEqual(len(calls), 3)
+
+        self.gather(*[self.request('/post/1', headers=[('if-none-match', '"x"')]) for i in range(2)])
+        self.assertEqual(len(calls), 5)
+        self.assertEqual(self.asgi.coalesced, 0)
+
+    def test_coalesce_per_host(self):
+        calls = self.count_calls('blog.show_post')
+        self.gather(*[self.request('/post/1', headers=[('host', host)])
+                      for host in ('a.example.com', 'b.example.com', 'a.example.com')])
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.asgi.coalesced, 1)
+
+    def test_repeated_headers(self):
+        scope = dict(method='GET', path='/', headers=[(b'cookie', b'a=1'), (b'cookie', b'b=2'),
+                                                      (b'accept', b'text/html'), (b'accept', b'*/*')])
+        environ = make_environ(scope, b'')
+        self.assertEqual(environ['HTTP_COOKIE'], 'a=1; b=2')
+        self.assertEqual(environ['HTTP_ACCEPT'], 'text/html,*/*')
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+from flask import current_app, render_template_string, url_for
+
+from myblog.assets import concat
+from myblog.extensions import static_assets
+
+from tests.base import BaseTestCase
+
+FILES = {
+    'css/site.css': 'body { background: url("../img/bg.png"); }\n/*# sourceMappingURL=site.css.map */',
+    'vendor/icons/css/icons.css': '@font-face { src: url(../fonts/icons.woff2) format("woff2"), url(data:x); }',
+    'js/a.js': 'var a = 1\n//# sourceMappingURL=a.js.map',
+    'js/b.js': '(function () { a += 1; })()',
+    'js/single.js': 'var single = true;',
+}
+
+
+class AssetsTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(AssetsTestCase, self).setUp()
+        self.static_folder = current_app.static_folder
+        current_app.static_folder = tempfile.mkdtemp()
+        for name, content in FILES.items():
+            path = os.path.join(current_app.static_folder, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(current_app.static_folder)
+        current_app.static_folder = self.static_folder
+        current_app.extensions['assets'] = static_assets.load(current_app)
+        super(AssetsTestCase, self).tearDown()
+
+    def build(self, clean=False):
+        return static_assets.build(clean, bundles={'site.css': ['css/site.css', 'vendor/icons/css/icons.css'],
+                                                   'site.js': ['js/a.js', 'js/b.js']},
+                                   singles=['js/single.js'])
+
+    def test_concat(self):
+        css = concat(current_app.static_folder, 'site.css', ['css/site.css', 'vendor/icons/css/icons.css'])
+        self.assertIn(b'url("../img/bg.png")', css)
+        self.assertIn(b'url(../vendor/icons/fonts/icons.woff2)', css)
+        self.assertIn(b'url(data:x)', css)
+        self.assertNotIn(b'sourceMappingURL', css)
+
+        js = concat(current_app.static_folder, 'site.js', ['js/a.js', 'js/b.js'])
+        self.assertEqual(js, b'var a = 1\n;\n(function () { a += 1; })()')
+
+    def test_build_and_serve(self):
+        results = self.build()
+        manifest = current_app.extensions['assets']
+        self.assertEqual(sorted(manifest), ['bundles/site.css', 'bundles/site.js', 'js/single.js'])
+        self.assertRegex(manifest['bundles/site.js'], r'^dist/site\.[0-9a-f]{10}\.js$')
+        self.assertEqual(len(results), 3)
+
+        self.assertEqual(url_for('static', filename='js/single.js'), '/static/' + manifest['js/single.js'])
+        self.assertEqual(render_template_string("{{ bundle('site.js') }}"),
+                         '<script src="/static/%s"></script>' % manifest['bundles/site.js'])
+
+        response = self.client.get(url_for('static', filename='js/single.js'), headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertEqual(gzip.decompress(response.data), b'var single = true;')
+
+        response = self.client.get(url_for('static', filename='js/single.js'), headers={'Accept-Encoding': 'identity'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.data, b'var single = true;')
+
+    def test_clean_old_builds(self):
+        self.build()
+        old = current_app.extensions['assets']['js/single.js']
+        with open(os.path.join(current_app.static_folder, 'js', 'single.js'), 'w') as f:
+            f.write('var single = false;')
+
+        self.build()
+        self.assertTrue(os.path.exists(os.path.join(current_app.static_folder, old)))
+        self.build(clean=True)
+        self.assertFalse(os.path.exists(os.path.join(current_app.static_folder, old)))
+        self.assertFalse(os.path.exists(os.path.join(current_app.static_folder, old + '.gz')))
+
+    def test_clean_keeps_previous_build(self):
+        self.build()
+        old = current_app.extensions['assets']['js/single.js']
+        with open(os.path.join(current_app.static_folder, 'js', 'single.js'), 'w') as f:
+            f.write('var single = false;')
+
+        self.build(clean=True)
+        self.assertNotEqual(current_app.extensions['assets']['js/single.js'], old)
+        self.assertTrue(os.path.exists(os.path.join(current_app.static_folder, old)))
+        self.build(clean=True)
+        self.assertFalse(os.path.exists(os.path.join(current_app.static_folder, old)))
+
+    def test_reload_changed_manifest(self):
+        self.build()
+        manifest = dict(current_app.extensions['assets'], **{'js/single.js': 'dist/js/single.0123456789.js'})
+        path = static_assets.manifest_path(current_app)
+        with open(path, 'w') as f:
+            json.dump(manifest, f)
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+        self.client.get(url_for('static', filename='js/a.js'))
+        self.assertEqual(current_app.extensions['assets'], manifest)
+        self.assertEqual(url_for('static', filename='js/single.js'), '/static/dist/js/single.0123456789.js')
+
+    def test_unbuilt_bundle(self):
+        current_app.extensions['assets'] = {}
+        tags = render_template_string("{{ bundle('base.js') }}")
+        self.assertEqual(tags.count('<script'), 3)
+        self.assertIn('/static/js/jquery.min.js', tags)
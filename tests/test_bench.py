@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from flask import current_app
+
+from benchmarks.bench import compare, endpoints, percentile, sample_ids, uncovered
+
+from tests.base import BaseTestCase
+
+
+class BenchTestCase(BaseTestCase):
+
+    def test_every_route_is_measured_or_skipped(self):
+        specs = endpoints(sample_ids())
+        self.assertEqual(uncovered(current_app, specs), [])
+
+    def test_percentile(self):
+        self.assertEqual(percentile([5, 1, 3, 2, 4], 0.5), 3)
+        self.assertEqual(percentile(list(range(1, 101)), 0.95), 95)
+
+    def test_compare(self):
+        baseline = {'blog.index': dict(p50_ms=10.0, p95_ms=12.0, queries=3, peak_kb=100.0)}
+        same = {'blog.index': dict(p50_ms=10.5, p95_ms=12.5, queries=3, peak_kb=110.0)}
+        self.assertEqual(compare(baseline, same), [])
+
+        worse = {'blog.index': dict(p50_ms=20.0, p95_ms=12.0, queries=4, peak_kb=100.0),
+                 'blog.new': dict(p50_ms=1.0, p95_ms=1.0, queries=1, peak_kb=1.0)}
+        self.assertEqual(compare(baseline, worse), [('blog.index', 'queries', 3, 4),
+                                                    ('blog.index', 'p50_ms', 10.0, 20.0)])
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from flask import url_for
+
+from myblog.extensions import db, site_context
+from myblog.models import Post, Category, Comment, Topic, Thought
+
+from tests.base import BaseTestCase
+
+
+class ConditionalTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(ConditionalTestCase, self).setUp()
+        post = Post(title='Hello Post', body='Blah...', category=Category(name='Default'), topic=Topic(name='test'))
+        db.session.add_all([post, Thought(body='First thought')])
+        db.session.commit()
+        site_context.get()
+
+    def test_not_modified(self):
+        response = self.client.get(url_for('blog.thought'))
+        etag = response.headers['ETag']
+        self.assertNotIn('Last-Modified', response.headers)
+
+        with self.assertQueryCount(1):
+            response = self.client.get(url_for('blog.thought'), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        # 最新时间不能说明页面没有改变, 只带 If-Modified-Since 的请求得到完整的响应
+        response = self.client.get(url_for('blog.thought'),
+                                   headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_edit_thought_changes_etag(self):
+        etag = self.client.get(url_for('blog.thought')).headers['ETag']
+        self.login()
+        self.client.post(url_for('admin.edit_thought', thought_id=1), data=dict(body='Edited thought'))
+        self.logout()
+
+        response = self.client.get(url_for('blog.thought'), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Edited thought', response.get_data(as_text=True))
+
+    def test_modified_after_change(self):
+        response = self.client.get(url_for('blog.show_post', post_id=1))
+        etag = response.headers['ETag']
+
+        comment = Comment(body='A comment', post=Post.query.get(1))
+        db.session.add(comment)
+        db.session.commit()
+        response = self.client.get(url_for('blog.show_post', post_id=1), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        comment.reviewed = True
+        db.session.commit()
+        response = self.client.get(url_for('blog.show_post', post_id=1), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('A comment', response.get_data(as_text=True))
+
+    def test_site_context_changes_etag(self):
+        etag = self.client.get(url_for('blog.index')).headers['ETag']
+        site_context.invalidate()
+        response = self.client.get(url_for('blog.index'), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_anonymous_comment_keeps_etag(self):
+        etag = self.client.get(url_for('blog.index')).headers['ETag']
+        db.session.add(Comment(body='Pending', post=Post.query.get(1)))
+        db.session.commit()
+        response = self.client.get(url_for('blog.index'), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        # 管理员的未读评论数仍然是最新的
+        self.login()
+        self.assertIn('<span class="badge badge-success">1</span>',
+                      self.client.get(url_for('blog.index')).get_data(as_text=True))
+
+    def test_authenticated_not_conditional(self):
+        self.login()
+        response = self.client.get(url_for('blog.index'))
+        self.assertNotIn('ETag', response.headers)
+
+    def test_missing_post(self):
+        response = self.client.get(url_for('blog.show_post', post_id=42))
+        self.assertEqual(response.status_code, 404)
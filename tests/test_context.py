@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+
+from flask import current_app, url_for
+from sqlalchemy import event
+
+from myblog.utils import VersionStamp
+from myblog.extensions import db, site_context
+from myblog.models import Category, Topic
+
+from tests.base import BaseTestCase
+
+
+class SiteContextTestCase(BaseTestCase):
+
+    def test_snapshot_is_reused(self):
+        snapshot = site_context.get()
+        self.assertIs(site_context.get(), snapshot)
+        self.assertEqual(snapshot.admin.name, 'syntomic')
+
+    def test_invalidate_rebuilds_snapshot(self):
+        snapshot = site_context.get()
+        db.session.add(Topic(name='test', category=Category(name='Default')))
+        db.session.commit()
+        self.assertEqual(site_context.get().topics, ())
+
+        site_context.invalidate()
+        new_snapshot = site_context.get()
+        self.assertIsNot(new_snapshot, snapshot)
+        self.assertEqual([topic.name for topic in new_snapshot.topics], ['test'])
+
+    def test_settings_update_invalidates(self):
+        self.login()
+        self.client.post(url_for('admin.settings'), data=dict(
+            name='Grey Li',
+            blog_title='Changed',
+            about='New about.'
+        ), follow_redirects=True)
+        self.assertEqual(site_context.get().admin.blog_title, 'Changed')
+        response = self.client.get(url_for('blog.index'))
+        self.assertIn('Changed', response.get_data(as_text=True))
+
+    def test_logged_in_requests_skip_identity_queries(self):
+        self.login()
+        self.client.get(url_for('admin.settings'))
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            for endpoint in ('admin.settings', 'admin.manage_post', 'blog.index'):
+                self.assertEqual(self.client.get(url_for(endpoint)).status_code, 200)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        self.assertTrue(statements)
+        self.assertEqual([statement for statement in statements if 'FROM admin' in statement], [])
+
+        # 管理员被修改后, 已登录的会话使用新的快照
+        self.client.post(url_for('admin.settings'), data=dict(name='New', blog_title='Testlog', about='About'))
+        self.assertIn('value="New"', self.client.get(url_for('admin.settings')).get_data(as_text=True))
+
+    def test_stamp_in_cache_dir(self):
+        stamp = current_app.extensions['site_context'].stamp
+        self.assertEqual(stamp.path, os.path.join(current_app.config['MYBLOG_CACHE_DIR'], 'context.version'))
+        # 另一个进程 (例如命令行) 的修改会改变文件中的版本, 正在运行的 worker 随之重建快照
+        version = site_context.get().version
+        VersionStamp(stamp.path).bump()
+        self.assertNotEqual(site_context.get().version, version)
+
+    def test_shared_version_stamp(self):
+        path = os.path.join(tempfile.mkdtemp(), 'context.version')
+        one, other = VersionStamp(path), VersionStamp(path)
+        self.assertIsNone(other.read())
+
+        version = one.bump()
+        self.assertEqual(other.read(), version)
+        self.assertNotEqual(other.bump(), version)
+        self.assertNotEqual(one.read(), version)
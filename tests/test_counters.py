@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+from flask import current_app, url_for
+
+from myblog import counters
+from myblog.counters import check_counters, rebuild_counters
+from myblog.extensions import db
+from myblog.models import Post, Category, Comment, Topic, Counter
+from myblog.utils import VersionStamp
+
+from tests.base import BaseTestCase
+
+
+def shared_version():
+    """其他 worker 看到的快照版本: 直接读取缓存目录中的版本戳文件, 而不是本进程内存中的版本"""
+    return VersionStamp(current_app.extensions['site_context'].stamp.path).read()
+
+
+class CounterTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(CounterTestCase, self).setUp()
+        category = Category(name='Default')
+        topic = Topic(name='test', category=category)
+        post = Post(title='Hello Post', body='Blah...', category=category, topic=topic)
+        db.session.add_all([
+            Comment(body='Reviewed', post=post, reviewed=True),
+            Comment(body='Unreviewed', post=post),
+            Comment(body='From admin', post=post, reviewed=True, from_admin=True)])
+        db.session.commit()
+        rebuild_counters()
+
+    def test_rebuild(self):
+        self.assertEqual(check_counters(), [])
+        self.assertEqual(counters.get('comment'), 3)
+        self.assertEqual(counters.get('comment.unreviewed'), 1)
+        self.assertEqual(counters.get('comment.admin'), 1)
+        self.assertEqual(Post.query.get(1).comment_count, 2)
+        self.assertEqual(Topic.query.get(1).post_count, 1)
+        self.assertEqual(Category.query.get(1).post_count, 1)
+
+    def test_admin_write_paths(self):
+        self.login()
+        self.client.post(url_for('admin.approve_comment', comment_id=2))
+        self.assertEqual(counters.get('comment.unreviewed'), 0)
+        self.assertEqual(Post.query.get(1).comment_count, 3)
+
+        self.client.post(url_for('admin.delete_comment', comment_id=1))
+        self.assertEqual(counters.get('comment'), 2)
+        self.assertEqual(Post.query.get(1).comment_count, 2)
+
+        self.client.post(url_for('admin.delete_post', post_id=1))
+        self.assertEqual(counters.get('post'), 0)
+        self.assertEqual(counters.get('comment'), 0)
+        self.assertEqual(Topic.query.get(1).post_count, 0)
+        self.assertEqual(check_counters(), [])
+
+    def test_unread_badge(self):
+        self.login()
+        response = self.client.get(url_for('admin.manage_comment', filter='unread'))
+        data = response.get_data(as_text=True)
+        self.assertIn('<span class="badge badge-success">1</span>', data)
+
+    def test_recount_command(self):
+        Counter.query.get('comment').value = 42
+        Post.query.get(1).comment_count = 7
+        db.session.commit()
+
+        result = self.runner.invoke(args=['recount', '--check'])
+        self.assertIn('comment: cached 42, actual 3', result.output)
+        self.assertIn('post.comment_count[1]: cached 7, actual 2', result.output)
+        self.assertIn('2 counters out of date.', result.output)
+        self.assertNotIn('Counters rebuilt.', result.output)
+
+        version = shared_version()
+        result = self.runner.invoke(args=['recount'])
+        self.assertIn('Counters rebuilt.', result.output)
+        self.assertEqual(check_counters(), [])
+        self.assertNotEqual(shared_version(), version)
+
+
+class TopicMergeTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(TopicMergeTestCase, self).setUp()
+        category = Category(name='Default')
+        default = Topic(name='default', category=category)
+        source = Topic(name='source', category=category)
+        target = Topic(name='target', category=category)
+        db.session.add_all([default, source, target])
+        for topic in [source, source, source, target]:
+            db.session.add(Post(title='Post', body='Blah...', category=category, topic=topic))
+        db.session.commit()
+        rebuild_counters()
+
+    def test_merge_without_loading_posts(self):
+        source, target = Topic.query.get(2), Topic.query.get(3)
+        with self.assertQueryCount(4) as statements:
+            self.assertEqual(source.merge_into(target), 3)
+        self.assertFalse(any(statement.startswith('SELECT') for statement in statements))
+        self.assertIsNone(Topic.query.get(2))
+        self.assertEqual(Topic.query.get(3).post_count, 4)
+        self.assertEqual(check_counters(), [])
+
+    def test_merge_into_itself(self):
+        topic = Topic.query.get(2)
+        self.assertRaises(ValueError, topic.merge_into, topic)
+
+    def test_delete_moves_posts_to_default(self):
+        Topic.query.get(2).delete()
+        self.assertEqual(Post.query.filter_by(topic_id=1).count(), 3)
+        self.assertEqual(counters.get('topic'), 2)
+        self.assertEqual(check_counters(), [])
+
+    def test_merge_view(self):
+        self.login()
+        response = self.client.post(url_for('admin.merge_topic', topic_id=2), data=dict(target=3),
+                                    follow_redirects=True)
+        self.assertIn('Topic merged, 3 posts moved.', response.get_data(as_text=True))
+        self.assertEqual(Topic.query.get(3).post_count, 4)
+
+        response = self.client.post(url_for('admin.merge_topic', topic_id=3), data=dict(target=3),
+                                    follow_redirects=True)
+        self.assertIn('You can not merge this topic.', response.get_data(as_text=True))
+
+    def test_merge_topic_command(self):
+        version = shared_version()
+        result = self.runner.invoke(args=['merge-topic', 'source', 'target'])
+        self.assertIn('Moved 3 posts into target.', result.output)
+        self.assertEqual(check_counters(), [])
+        # 命令行与 web 进程不同, 只有版本戳文件改变时 worker 才会重建快照中的专题列表
+        self.assertNotEqual(shared_version(), version)
+
+        result = self.runner.invoke(args=['merge-topic', 'missing', 'target'])
+        self.assertNotEqual(result.exit_code, 0)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import g, url_for
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import QueuePool
+
+from myblog import create_app
+from myblog.database import get_profile
+from myblog.extensions import db
+from myblog.models import Admin, Category, Post, Topic
+
+
+class DatabaseProfileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = create_app('testing')
+        self.app.config.update(SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(self.directory, 'blog.db'),
+                               MYBLOG_DB_PROFILE='sqlite-production', MYBLOG_DB_PRAGMAS={'cache_size': -1000})
+        self.context = self.app.test_request_context()
+        self.context.push()
+        db.create_all()
+        db.session.add(Admin(name='syntomic', username='zhouh', about='I am test', blog_title='Testlog'))
+        category = Category(name='Default')
+        db.session.add(Post(title='Hello', body='Blah...', category=category, topic=Topic(name='test', category=category)))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.get_engine().dispose()
+        read_engine = db.get_read_engine()
+        if read_engine is not None:
+            read_engine.dispose()
+        self.context.pop()
+        shutil.rmtree(self.directory)
+
+    def pragma(self, name, engine=None):
+        with (engine or db.engine).connect() as connection:
+            return connection.execute('PRAGMA %s' % name).scalar()
+
+    def test_pragmas_and_pool(self):
+        self.assertIsInstance(db.engine.pool, QueuePool)
+        self.assertEqual(self.pragma('journal_mode'), 'wal')
+        self.assertEqual(self.pragma('synchronous'), 1)
+        self.assertEqual(self.pragma('busy_timeout'), 5000)
+        self.assertEqual(self.pragma('cache_size'), -1000)
+        self.assertEqual(self.pragma('query_only'), 0)
+
+    def test_profile_overrides(self):
+        self.app.config['MYBLOG_DB_PRAGMAS'] = {'synchronous': 'FULL', 'foreign_keys': 'ON'}
+        pragmas = dict(get_profile(self.app)['pragmas'])
+        self.assertEqual(pragmas['synchronous'], 'FULL')
+        self.assertEqual(pragmas['foreign_keys'], 'ON')
+        self.assertEqual(pragmas['journal_mode'], 'WAL')
+
+    def test_read_pool(self):
+        read_engine = db.get_read_engine()
+        self.assertIsNot(read_engine, db.engine)
+        self.assertEqual(self.pragma('query_only', read_engine), 1)
+        with read_engine.connect() as connection:
+            self.assertRaises(OperationalError, connection.execute, "UPDATE post SET title = 'x'")
+
+        self.app.config['MYBLOG_DB_PROFILE'] = 'default'
+        self.assertIsNone(db.get_read_engine())
+
+    def test_read_only_views(self):
+        client = self.app.test_client()
+        with self.app.test_request_context(url_for('blog.show_post', post_id=1)):
+            self.app.preprocess_request()
+            self.assertTrue(g.db_read_only)
+            self.assertIs(db.session.get_bind(), db.get_read_engine())
+        with self.app.test_request_context(url_for('blog.show_post', post_id=1), method='POST'):
+            self.app.preprocess_request()
+            self.assertFalse(g.db_read_only)
+            self.assertIs(db.session.get_bind(), db.engine)
+
+        self.assertEqual(client.get(url_for('blog.show_post', post_id=1)).status_code, 200)
+        self.assertEqual(client.get(url_for('blog.index')).status_code, 200)
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from myblog.counters import check_counters
+from myblog.extensions import db
+from myblog.models import Admin, Category, Comment, Post, Thought, Topic
+
+from tests.base import BaseTestCase
+
+
+class BulkForgeTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(BulkForgeTestCase, self).setUp()
+        db.session.add_all([Category(name='Math'), Category(name='CS')])
+        db.session.commit()
+
+    def test_bulk_forge(self):
+        result = self.runner.invoke(args=['forge', '--bulk', '--batch', '30', '--topic', '4', '--post', '50',
+                                          '--comment', '100', '--thought', '5'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Generating 100 comments...', result.output)
+        self.assertIn('130/130 rows', result.output)
+        self.assertIn('rows/sec', result.output)
+
+        self.assertEqual(Admin.query.count(), 1)
+        self.assertEqual(Topic.query.count(), 4)
+        self.assertEqual(Post.query.count(), 50)
+        self.assertEqual(Comment.query.count(), 100 + 10 + 10 + 10)
+        self.assertEqual(Comment.query.filter(Comment.replied_id != None).count(), 10)
+        self.assertEqual(Thought.query.count(), 5)
+        self.assertEqual(check_counters(), [])
+
+    def test_bulk_forge_twice(self):
+        for i in range(2):
+            result = self.runner.invoke(args=['forge', '--bulk', '--topic', '3', '--post', '5', '--comment', '5'])
+            self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(Admin.query.count(), 1)
+        self.assertEqual(Topic.query.count(), 6)
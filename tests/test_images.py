@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import current_app, render_template_string
+
+from myblog.extensions import image_pipeline
+from myblog.images import Image, process_image, sidecar_path
+
+from tests.base import BaseTestCase
+
+
+@unittest.skipIf(Image is None, 'Pillow is not installed')
+class ImagePipelineTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(ImagePipelineTestCase, self).setUp()
+        self.root = tempfile.mkdtemp()
+        current_app.extensions['image_pipeline'].root = self.root
+        os.mkdir(os.path.join(self.root, 'life'))
+        image = Image.effect_noise((800, 500), 64).convert('RGB')
+        exif = Image.Exif()
+        exif[0x010e] = 'secret description'
+        image.save(os.path.join(self.root, 'life', 'theme.jpg'), quality=100, exif=exif)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        super(ImagePipelineTestCase, self).tearDown()
+
+    def test_process_image(self):
+        record = process_image(self.root, 'life/theme.jpg', widths=(480, 960, 1600))
+        self.assertEqual((record['width'], record['height']), (800, 500))
+        self.assertEqual([(variant['width'], variant['height']) for variant in record['variants']],
+                         [(480, 300), (800, 500)])
+        self.assertTrue(os.path.exists(sidecar_path(self.root, 'life/theme.jpg')))
+
+        for variant in record['variants']:
+            self.assertEqual(sorted(variant['files']), ['jpeg', 'webp'])
+            for item in variant['files'].values():
+                self.assertLess(item['bytes'], record['bytes'])
+                with Image.open(os.path.join(self.root, item['path'])) as image:
+                    self.assertEqual(image.width, variant['width'])
+                    self.assertNotIn(0x010e, image.getexif())
+
+    def test_masthead_style(self):
+        style = render_template_string("{{ masthead_style('life/theme.jpg') }}")
+        self.assertEqual(style, '<style>.masthead{background-image:url("/static/img/life/theme.jpg")}</style>')
+
+        image_pipeline.process('life/theme.jpg')
+        style = render_template_string("{{ masthead_style('life/theme.jpg ') }}")
+        self.assertIn('.masthead{background-image:url("/static/img/_variants/life/theme-800.jpeg");'
+                      'background-image:image-set(url("/static/img/_variants/life/theme-800.webp") type("image/webp"),'
+                      'url("/static/img/_variants/life/theme-800.jpeg") type("image/jpeg"))}', style)
+        self.assertIn('@media (max-width:480px){.masthead{background-image:url("/static/img/_variants/life/theme-480.jpeg")',
+                      style)
+
+    def test_images_command(self):
+        result = self.runner.invoke(args=['images'])
+        self.assertIn('life/theme.jpg: 800x500', result.output)
+        self.assertIn('Processed 1 images', result.output)
+
+        result = self.runner.invoke(args=['images'])
+        self.assertIn('Processed 0 images', result.output)
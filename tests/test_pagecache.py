@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import tempfile
+
+from flask import current_app, url_for
+
+from myblog.extensions import db, site_context, page_cache
+from myblog.models import Category, Post, Thought, Topic
+from myblog.pagecache import MemoryBackend, FileBackend
+
+from tests.base import BaseTestCase
+
+
+class PageCacheTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(PageCacheTestCase, self).setUp()
+        current_app.extensions['page_cache'] = MemoryBackend()
+        db.session.add(Thought(body='First thought'))
+        db.session.commit()
+        site_context.get()
+
+    def test_anonymous_hit(self):
+        response = self.client.get(url_for('blog.thought'))
+        self.assertIn('First thought', response.get_data(as_text=True))
+
+        # 命中时不查询数据库, 条件请求按缓存的 ETag 返回 304
+        with self.assertQueryCount(0):
+            response = self.client.get(url_for('blog.thought'))
+        self.assertIn('First thought', response.get_data(as_text=True))
+        etag = response.headers['ETag']
+        with self.assertQueryCount(0):
+            response = self.client.get(url_for('blog.thought'), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+
+    def test_bypass(self):
+        self.client.get(url_for('blog.thought', foo='bar'))
+        self.assertIsNone(page_cache.backend.get('blog.thought', 1))
+
+        self.login()
+        self.client.get(url_for('blog.thought'))
+        self.assertIsNone(page_cache.backend.get('blog.thought', 1))
+
+    def test_purge_on_new_thought(self):
+        self.client.get(url_for('blog.thought'))
+        self.assertIsNotNone(page_cache.backend.get('blog.thought', 1))
+
+        self.login()
+        self.client.post(url_for('admin.new_thought'), data=dict(body='Second thought'))
+        self.assertIsNone(page_cache.backend.get('blog.thought', 1))
+        self.logout()
+
+        response = self.client.get(url_for('blog.thought'))
+        self.assertIn('Second thought', response.get_data(as_text=True))
+
+    def test_file_backend(self):
+        directory = tempfile.mkdtemp()
+        one, other = FileBackend(directory), FileBackend(directory)
+        one.set('blog.show_post|post_id=1', 1, 'page one')
+        one.set('blog.show_post|post_id=1', 2, 'page two')
+        one.set('blog.index', 1, 'index')
+        self.assertEqual(other.get('blog.show_post|post_id=1', 2), 'page two')
+
+        other.purge('blog.show_post|post_id=1')
+        self.assertIsNone(one.get('blog.show_post|post_id=1', 1))
+        self.assertEqual(one.get('blog.index', 1), 'index')
+
+        one.set('blog.archive|month=1|year=2019', 1, 'january')
+        one.set('blog.archive', 1, 'archive')
+        other.purge_endpoint('blog.archive')
+        self.assertIsNone(one.get('blog.archive|month=1|year=2019', 1))
+        self.assertIsNone(one.get('blog.archive', 1))
+        self.assertEqual(one.get('blog.index', 1), 'index')
+
+        one.clear()
+        self.assertIsNone(other.get('blog.index', 1))
+
+    def test_purge_post_clears_every_archive_page(self):
+        backend = page_cache.backend
+        backend.set('blog.archive|month=1|year=2019', 1, 'january')
+        backend.set('blog.archive|month=3|year=2019', 1, 'march')
+        backend.set('blog.show_post|post_id=2', 1, 'other post')
+        post = Post(title='Hello Post', body='Blah...', category=Category(name='Default'), topic=Topic(name='test'))
+        db.session.add(post)
+        db.session.commit()
+
+        page_cache.purge_post(post)
+        self.assertIsNone(backend.get('blog.archive|month=1|year=2019', 1))
+        self.assertIsNone(backend.get('blog.archive|month=3|year=2019', 1))
+        self.assertEqual(backend.get('blog.show_post|post_id=2', 1), 'other post')
+
+    def test_comment_csrf(self):
+        current_app.config['WTF_CSRF_ENABLED'] = True
+        db.session.add(Post(title='Hello Post', body='Blah...', category=Category(name='Default'),
+                            topic=Topic(name='test')))
+        db.session.commit()
+        # 缺少正文, 通过 CSRF 校验后由表单重新显示
+        data = dict(author='Guest', email='guest@example.com')
+
+        # 文章页不带令牌, 可以被缓存
+        response = self.client.get(url_for('blog.show_post', post_id=1))
+        self.assertNotIn('name="csrf_token"', response.get_data(as_text=True))
+        self.assertIsNotNone(page_cache.backend.get('blog.show_post|post_id=1', 1))
+
+        # 没有令牌的评论被拒绝, 带上取回的令牌后通过校验
+        self.assertEqual(self.client.post(url_for('blog.show_post', post_id=1), data=data).status_code, 400)
+        response = self.client.get(url_for('blog.csrf_token'))
+        self.assertTrue(response.cache_control.no_store)
+        data['csrf_token'] = response.get_json()['token']
+        response = self.client.post(url_for('blog.show_post', post_id=1), data=data)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('This field is required.', response.get_data(as_text=True))
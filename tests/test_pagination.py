@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+
+from flask import current_app, url_for
+
+from myblog.extensions import db
+from myblog.models import Thought
+from myblog.pagination import KeysetPagination, encode_cursor, decode_cursor
+
+from tests.base import BaseTestCase
+
+
+class KeysetPaginationTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(KeysetPaginationTestCase, self).setUp()
+        now = datetime(2019, 6, 1, 12, 30)
+        for i in range(12):
+            # 每两条想法的时间相同, 由 id 决定先后
+            db.session.add(Thought(body='Thought %d' % i, timestamp=now + timedelta(minutes=i // 2)))
+        db.session.commit()
+
+    def paginate(self, cursor=None):
+        return KeysetPagination(Thought.query, Thought.timestamp, Thought.id, 5, cursor)
+
+    def test_walk_forward_and_back(self):
+        pages = [self.paginate()]
+        while pages[-1].has_next:
+            pages.append(self.paginate(pages[-1].next_cursor))
+
+        ids = [thought.id for pagination in pages for thought in pagination.items]
+        self.assertEqual(ids, list(range(12, 0, -1)))
+        self.assertEqual([len(p.items) for p in pages], [5, 5, 2])
+        self.assertFalse(pages[0].has_prev)
+        self.assertTrue(pages[-1].has_prev)
+
+        back = self.paginate(pages[-1].prev_cursor)
+        self.assertEqual([t.id for t in back.items], [t.id for t in pages[1].items])
+        back = self.paginate(back.prev_cursor)
+        self.assertEqual([t.id for t in back.items], [t.id for t in pages[0].items])
+        self.assertFalse(back.has_prev)
+        self.assertTrue(back.has_next)
+
+    def test_cursor_round_trip(self):
+        timestamp = datetime(2019, 6, 1, 12, 30, 15, 123)
+        self.assertEqual(decode_cursor(encode_cursor('next', timestamp, 3)), ('next', timestamp, 3))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(url_for('blog.thought', cursor='bogus'))
+        self.assertEqual(response.status_code, 400)
+
+    def test_thought_page(self):
+        current_app.config['MYBLOG_THOUGHT_PER_PAGE'] = 5
+        response = self.client.get(url_for('blog.thought'))
+        data = response.get_data(as_text=True)
+        self.assertIn('Thought 11', data)
+        self.assertNotIn('Thought 6<', data)
+
+        cursor = self.paginate().next_cursor
+        response = self.client.get(url_for('blog.thought', cursor=cursor))
+        data = response.get_data(as_text=True)
+        self.assertIn('Thought 6<', data)
+        self.assertNotIn('Thought 11<', data)
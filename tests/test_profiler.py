@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from flask import current_app, url_for
+
+from myblog.extensions import db, query_profiler
+from myblog.models import Category, Post, Topic
+from myblog.profiler import OVERFLOW, QueryStats, fingerprint, merge
+from myblog.utils import WorkerFiles
+
+from tests.base import BaseTestCase
+
+
+class QueryProfilerTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(QueryProfilerTestCase, self).setUp()
+        category = Category(name='Default')
+        db.session.add(Post(title='Hello', body='Blah...', category=category,
+                            topic=Topic(name='test', category=category)))
+        db.session.commit()
+        query_profiler._state().files = WorkerFiles(tempfile.mkdtemp())
+
+    def tearDown(self):
+        query_profiler.reset()
+        super(QueryProfilerTestCase, self).tearDown()
+
+    def test_fingerprint(self):
+        self.assertEqual(fingerprint("SELECT * FROM post\n WHERE id IN (1, 2, 3) AND title = 'it''s'"),
+                         'SELECT * FROM post WHERE id IN (?) AND title = ?')
+
+    def test_stats_size(self):
+        stats = QueryStats(size=1)
+        stats.add('blog.index', 'SELECT 1', 0.5, 0)
+        stats.add('blog.index', 'SELECT 2', 0.25, 0)
+        stats.add('blog.index', 'SELECT 3', 1.0, 2)
+        self.assertEqual(sorted(stats.records()), [['blog.index', OVERFLOW, 2, 1.25, 1.0, 2],
+                                                   ['blog.index', 'SELECT 1', 1, 0.5, 0.5, 0]])
+        self.assertEqual(merge(stats.records(), [['blog.index', 'SELECT 1', 3, 1.0, 0.75, 1]])[0],
+                         ['blog.index', 'SELECT 1', 4, 1.5, 0.75, 1])
+
+    def test_requests_are_aggregated(self):
+        for i in range(3):
+            self.client.get(url_for('blog.show_post', post_id=1))
+        rows = query_profiler.report('blog.show_post')
+        self.assertTrue(rows)
+        self.assertEqual(max(row['count'] for row in rows), 3)
+        self.assertTrue(any('FROM post' in row['statement'] for row in rows))
+
+    def test_sampling(self):
+        current_app.config['MYBLOG_QUERY_SAMPLE_RATE'] = 0
+        self.client.get(url_for('blog.index'))
+        self.assertEqual(query_profiler.report(), [])
+
+    def test_flush_and_collect(self):
+        self.client.get(url_for('blog.index'))
+        query_profiler.flush()
+        query_profiler._state().stats.clear()
+        self.assertEqual(query_profiler.report(), [])
+
+        self.client.get(url_for('blog.index'))
+        state = query_profiler._state()
+        records = state.stats.records()
+        # 父进程 (例如 gunicorn 的 master) 还在运行, 它写入的文件参与汇总
+        with open(os.path.join(state.files.directory, '%d.json' % os.getppid()), 'w') as f:
+            json.dump(dict(generation=state.files.generation, data=records), f)
+        self.assertTrue(all(row['count'] == 2 for row in query_profiler.report('blog.index')))
+
+        # 已经退出的进程留下的文件不参与汇总
+        process = subprocess.Popen([sys.executable, '-c', ''])
+        process.wait()
+        with open(os.path.join(state.files.directory, '%d.json' % process.pid), 'w') as f:
+            json.dump(dict(generation=state.files.generation, data=records), f)
+        self.assertTrue(all(row['count'] == 2 for row in query_profiler.report('blog.index')))
+
+    def test_reset_from_other_worker(self):
+        self.client.get(url_for('blog.index'))
+        query_profiler.flush()
+        state = query_profiler._state()
+        records = state.stats.records()
+
+        # 另一个 worker 清空统计后, 本进程不再把旧的统计写回
+        WorkerFiles(state.files.directory).reset()
+        self.assertEqual(query_profiler.report(), [])
+        query_profiler.flush()
+        self.assertEqual(query_profiler.report(), [])
+
+        # 旧代次的文件不参与汇总
+        with open(os.path.join(state.files.directory, '%d.json' % os.getppid()), 'w') as f:
+            json.dump(dict(generation='old', data=records), f)
+        self.assertEqual(query_profiler.report(), [])
+
+    def test_admin_page_and_command(self):
+        self.client.get(url_for('blog.index'))
+        self.login()
+        data = self.client.get(url_for('admin.query_stats')).get_data(as_text=True)
+        self.assertIn('blog.index', data)
+
+        result = self.runner.invoke(args=['query-stats', '--endpoint', 'blog.index', '--reset'])
+        self.assertIn('FROM post', result.output)
+        self.assertIn('Statistics cleared.', result.output)
+        self.assertEqual(query_profiler.report('blog.index'), [])
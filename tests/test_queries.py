@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+
+from flask import current_app, url_for
+
+from myblog.counters import check_counters, rebuild_counters
+from myblog.extensions import db, site_context
+from myblog.models import Post, Category, Comment, Topic
+
+from tests.base import BaseTestCase
+
+
+class ListingQueryTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(ListingQueryTestCase, self).setUp()
+        self.category = Category(name='Default')
+        self.topic = Topic(name='test', category=self.category)
+        db.session.add_all([self.category, self.topic])
+        db.session.commit()
+        rebuild_counters()
+        self.add_posts(2)
+
+    def add_posts(self, count):
+        for i in range(count):
+            post = Post(title='Post %d' % i, subtitle='sub', body='Blah...',
+                        category=Category(name='Category %d-%d' % (count, i)),
+                        topic=Topic(name='Topic %d-%d' % (count, i)))
+            post.comments.append(Comment(body='A comment', reviewed=True))
+            db.session.add(post)
+            db.session.add(Post(title='Post', body='Blah...', category=self.category, topic=self.topic))
+        db.session.commit()
+        site_context.get()
+        db.session.remove()
+
+    def assertViewQueryCount(self, count, endpoint, **values):
+        """同一视图在文章变多以后查询次数保持不变, 并且不读取文章内容"""
+        with self.assertQueryCount(count) as statements:
+            response = self.client.get(url_for(endpoint, **values))
+        self.assertEqual(response.status_code, 200)
+        for column in ['post.body AS', 'post.body_html', 'post.toc_html']:
+            self.assertFalse(any(column in statement for statement in statements), column)
+
+        self.add_posts(8)
+        with self.assertQueryCount(count):
+            self.client.get(url_for(endpoint, **values))
+
+    def test_index(self):
+        self.assertViewQueryCount(3, 'blog.index')
+
+    def test_archive(self):
+        self.assertViewQueryCount(3, 'blog.archive')
+
+    def test_show_category(self):
+        self.assertViewQueryCount(3, 'blog.show_category', category_id=1)
+
+    def test_show_topic(self):
+        self.assertViewQueryCount(3, 'blog.show_topic', topic_id=1)
+
+    def test_manage_post(self):
+        self.login()
+        # 列表, 以及导航栏的未读评论数
+        self.assertViewQueryCount(3, 'admin.manage_post')
+        self.assertIn('<td>7</td>', self.client.get(url_for('admin.manage_post')).get_data(as_text=True))
+
+    def test_post_detail(self):
+        from myblog.queries import post_detail
+        with self.assertQueryCount(1):
+            post = post_detail().get(1)
+            self.assertEqual(post.body, 'Blah...')
+            self.assertIsNone(post.body_html)
+
+
+class CommentTreeTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(CommentTreeTestCase, self).setUp()
+        self.post = Post(title='Hello Post', body='Blah...', category=Category(name='Default'),
+                         topic=Topic(name='test'))
+        db.session.add(self.post)
+        db.session.commit()
+        rebuild_counters()
+        self.add_replies(2)
+
+    def add_replies(self, count):
+        replied = Comment(body='A comment', post=self.post, reviewed=True)
+        db.session.add(replied)
+        for i in range(count):
+            replied = Comment(body='Reply %d' % i, post=self.post, reviewed=True, replied=replied)
+            db.session.add(replied)
+        db.session.commit()
+        site_context.get()
+        db.session.remove()
+
+    def test_build_tree(self):
+        roots = Comment.build_tree(Post.query.get(1).reviewed_comments().all())
+        self.assertEqual(len(roots), 1)
+        self.assertEqual(roots[0].comment.body, 'A comment')
+        self.assertEqual(roots[0].children[0].comment.body, 'Reply 0')
+        self.assertEqual(roots[0].children[0].children[0].comment.body, 'Reply 1')
+
+    def test_reply_outside_page_is_root(self):
+        pagination, roots = Post.query.get(1).comment_tree(2, 2)
+        self.assertEqual([node.comment.body for node in roots], ['Reply 1'])
+        self.assertEqual(roots[0].comment.replied.body, 'Reply 0')
+
+    def test_show_post_query_count(self):
+        with self.assertQueryCount(4):
+            response = self.client.get(url_for('blog.show_post', post_id=1))
+        self.assertIn('Reply 1', response.get_data(as_text=True))
+
+        self.add_replies(6)
+        with self.assertQueryCount(4):
+            self.client.get(url_for('blog.show_post', post_id=1))
+
+
+class TopicSummaryTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(TopicSummaryTestCase, self).setUp()
+        category = Category(name='Default')
+        for name, count in [('beta', 3), ('alpha', 1), ('empty', 0)]:
+            topic = Topic(name=name, category=category)
+            db.session.add(topic)
+            for i in range(count):
+                db.session.add(Post(title='Post', body='Blah...', category=category, topic=topic))
+        db.session.commit()
+        site_context.get()
+        db.session.remove()
+
+    def test_topic_summaries(self):
+        from myblog.queries import topic_summaries
+        self.assertEqual([(topic.name, topic.category_name, topic.post_count) for topic in topic_summaries()],
+                         [('alpha', 'Default', 1), ('beta', 'Default', 3), ('empty', 'Default', 0)])
+
+    def test_manage_topic_query_count(self):
+        self.login()
+        rebuild_counters()
+        db.session.remove()
+        # 话题汇总, 以及导航栏的未读评论数
+        with self.assertQueryCount(2):
+            response = self.client.get(url_for('admin.manage_topic'))
+        data = response.get_data(as_text=True)
+        self.assertIn('<td>beta</td>', data)
+        self.assertIn('<td>3</td>', data)
+
+
+class ArchiveTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(ArchiveTestCase, self).setUp()
+        category = Category(name='Default')
+        topic = Topic(name='test', category=category)
+        for title, create_time in [('Old', datetime(2018, 12, 31, 23)), ('New year', datetime(2019, 1, 1)),
+                                   ('Later', datetime(2019, 1, 20)), ('Spring', datetime(2019, 3, 5))]:
+            db.session.add(Post(title=title, body='Blah...', category=category, topic=topic,
+                                create_time=create_time))
+        db.session.commit()
+
+    def test_archive_index(self):
+        from myblog.queries import archive_index
+        self.assertEqual([(entry.year, entry.count, [(item.month, item.count) for item in entry.months])
+                          for entry in archive_index()],
+                         [(2019, 3, [(3, 1), (1, 2)]), (2018, 1, [(12, 1)])])
+
+    def test_month_counts_follow_writes(self):
+        from myblog.queries import archive_index
+        rebuild_counters()
+        post = Post.query.filter_by(title='Spring').first()
+        post.create_time = datetime(2018, 12, 1)
+        db.session.delete(Post.query.filter_by(title='Old').first())
+        db.session.add(Post(title='Today', body='Blah...'))
+        db.session.commit()
+        self.assertEqual(check_counters(), [])
+        with self.assertQueryCount(1):
+            index = archive_index()
+        self.assertEqual(index[0].year, datetime.utcnow().year)
+        self.assertEqual([(item.month, item.count) for item in index[-1].months], [(12, 1)])
+
+    def test_archive_posts(self):
+        from myblog.queries import archive_posts
+        with self.assertQueryCount(1) as statements:
+            pagination = archive_posts(2019, 1, 10)
+        self.assertEqual([post.title for post in pagination.items], ['Later', 'New year'])
+        self.assertNotIn('post.body', statements[0])
+        self.assertEqual([post.title for post in archive_posts(2018, 12, 10).items], ['Old'])
+
+    def test_archive_month_pages(self):
+        current_app.config['MYBLOG_ARCHIVE_PER_PAGE'] = 1
+        data = self.client.get(url_for('blog.archive', year=2019, month=1)).get_data(as_text=True)
+        self.assertIn('Later', data)
+        self.assertNotIn('New year', data)
+
+        from myblog.queries import archive_posts
+        cursor = archive_posts(2019, 1, 1).next_cursor
+        data = self.client.get(url_for('blog.archive', year=2019, month=1, cursor=cursor)).get_data(as_text=True)
+        self.assertIn('New year', data)
+        self.assertNotIn('Later', data)
+
+    def test_archive_views(self):
+        data = self.client.get(url_for('blog.archive')).get_data(as_text=True)
+        self.assertIn('Spring', data)
+        self.assertNotIn('Later', data)
+        self.assertIn('2018', data)
+
+        data = self.client.get(url_for('blog.archive', year=2019, month=1)).get_data(as_text=True)
+        self.assertIn('Later', data)
+        self.assertNotIn('Spring', data)
+
+        self.assertEqual(self.client.get(url_for('blog.archive', year=2019, month=2)).status_code, 404)
+        self.assertEqual(self.client.get(url_for('blog.archive', year=2019, month=13)).status_code, 404)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+from flask import url_for
+
+from myblog.extensions import db
+from myblog.models import Post, Category, Topic
+from myblog.render import needs_client_render, render_markdown
+
+from tests.base import BaseTestCase
+
+
+class RenderTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(RenderTestCase, self).setUp()
+        category = Category(name='Default')
+        topic = Topic(name='test', category=category)
+        for i in range(3):
+            db.session.add(Post(title='Post %d' % i, body='# Heading %d\n\nBlah...' % i,
+                                category=category, topic=topic))
+        db.session.commit()
+
+    def test_render_body(self):
+        post = Post.query.get(1)
+        self.assertTrue(post.render_body())
+        self.assertIn('<h1 id="heading-0">Heading 0</h1>', post.body_html)
+        self.assertIn('href="#heading-0"', post.toc_html)
+        self.assertFalse(post.render_body())
+
+        post.body = 'Changed'
+        self.assertTrue(post.render_body())
+        self.assertEqual(post.body_html, '<p>Changed</p>')
+
+    def test_editormd_features(self):
+        html, toc = render_markdown('- [x] done\n- [ ] todo\n\n<script>alert(1)</script>\n\n'
+                                    'Text <iframe src="x"></iframe><style>p {}</style>\n\n    <script>code</script>')
+        self.assertIn('<li><input type="checkbox" disabled checked> done</li>', html)
+        self.assertIn('<li><input type="checkbox" disabled> todo</li>', html)
+        self.assertNotIn('<script>', html)
+        self.assertNotIn('<iframe', html)
+        self.assertNotIn('<style>', html)
+        self.assertIn('&lt;script&gt;code&lt;/script&gt;', html)
+
+        for body in ('$$E=mc^2$$', '```flow\nst=>start: Start\n```', '```seq\nA->B: Hi\n```', 'Hi :smile:'):
+            self.assertTrue(needs_client_render(body), body)
+        self.assertFalse(needs_client_render('Price is $5\n\n```python\nx = 1\n```'))
+
+    def test_emoji_shortcodes(self):
+        self.assertTrue(needs_client_render('Nice :smile: and :+1:'))
+        # 时间和冒号分隔的文字不是 emoji, 仍然在服务端渲染
+        self.assertFalse(needs_client_render('Started at 10:30:45, see a:b:c'))
+        post = Post.query.get(1)
+        post.body = 'Started at 10:30:45'
+        post.render_body()
+        self.assertIn('10:30:45', post.body_html)
+
+    def test_client_rendered_post(self):
+        post = Post.query.get(1)
+        post.body = 'Math: $$E=mc^2$$'
+        self.assertTrue(post.render_body())
+        self.assertIsNone(post.body_html)
+        self.assertFalse(post.render_body())
+        db.session.commit()
+        self.assertIn('editormd.min.js', self.client.get(url_for('blog.show_post', post_id=1)).get_data(as_text=True))
+
+        # 之前在服务端渲染过的文章会改回浏览器渲染
+        post.body_html = '<p>Math: $$E=mc^2$$</p>'
+        self.assertTrue(post.render_body())
+        self.assertIsNone(post.body_html)
+
+    def test_show_rendered_post(self):
+        response = self.client.get(url_for('blog.show_post', post_id=1))
+        self.assertIn('editormd.min.js', response.get_data(as_text=True))
+
+        Post.query.get(1).render_body()
+        db.session.commit()
+        response = self.client.get(url_for('blog.show_post', post_id=1))
+        data = response.get_data(as_text=True)
+        self.assertIn('<h1 id="heading-0">Heading 0</h1>', data)
+        self.assertNotIn('editormd.min.js', data)
+
+    def test_render_command(self):
+        result = self.runner.invoke(args=['render', '--batch', '2'])
+        self.assertIn('Rendered 2 posts...', result.output)
+        self.assertIn('Rendered 3 posts...', result.output)
+        self.assertEqual(Post.query.filter(Post.body_html.is_(None)).count(), 0)
+
+        result = self.runner.invoke(args=['render'])
+        self.assertIn('Rendered 0 posts...', result.output)
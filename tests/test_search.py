@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+from flask import current_app, url_for
+from sqlalchemy import inspect
+
+from myblog.extensions import db
+from myblog.models import Category, Comment, Post, SearchTerm, Thought, Topic
+from myblog.search import Fts5Backend, TermBackend, highlight, search_index, tokenize
+
+from tests.base import BaseTestCase
+
+
+class SearchTestCase(BaseTestCase):
+    backend = Fts5Backend
+
+    def setUp(self):
+        super(SearchTestCase, self).setUp()
+        current_app.extensions['search'] = self.backend
+        category = Category(name='Default')
+        topic = Topic(name='test', category=category)
+        post = Post(title='Flask caching', subtitle='Notes', body='How the page cache works.',
+                    category=category, topic=topic)
+        db.session.add_all([
+            post,
+            Post(title='Other', body='Mentions caching once.', category=category, topic=topic),
+            Thought(body='缓存是个好东西'),
+            Comment(body='Great caching article', post=post, reviewed=True),
+            Comment(body='Spam caching', post=post)])
+        db.session.commit()
+
+    def search(self, q, kind=None, page=1, per_page=10):
+        pagination, terms = search_index.search(q, kind, page, per_page)
+        return [(hit.kind, hit.obj.id) for hit in pagination.items], pagination.total
+
+    def test_tokenize(self):
+        self.assertEqual(list(tokenize('Flask 1.1, 缓存好')), ['flask', '1', '1', '缓存', '存好'])
+
+    def test_ranking_and_kinds(self):
+        results, total = self.search('caching')
+        self.assertEqual(total, 3)
+        self.assertEqual(results[0], ('post', 1))
+        self.assertNotIn(('comment', 2), results)
+        self.assertEqual(self.search('caching', kind='comment')[0], [('comment', 1)])
+        self.assertEqual(self.search('缓存')[0], [('thought', 1)])
+        self.assertEqual(self.search('caching flask')[0], [('post', 1)])
+        self.assertEqual(self.search('...')[1], 0)
+
+    def test_incremental_updates(self):
+        post = Post.query.get(1)
+        post.title = 'Renamed'
+        Comment.query.get(2).reviewed = True
+        db.session.delete(Thought.query.get(1))
+        db.session.commit()
+        self.assertEqual(self.search('flask')[1], 0)
+        self.assertEqual(self.search('renamed')[0], [('post', 1)])
+        self.assertIn(('comment', 2), self.search('spam')[0])
+        self.assertEqual(self.search('缓存')[1], 0)
+
+        db.session.delete(post)
+        db.session.commit()
+        self.assertEqual(self.search('caching')[0], [('post', 2)])
+
+    def test_untouched_body_is_not_loaded(self):
+        db.session.expunge_all()
+        post = Post.query.get(1)
+        self.assertNotIn('body', inspect(post).dict)
+        post.can_comment = False
+        db.session.flush()
+        self.assertNotIn('body', inspect(post).dict)
+        db.session.commit()
+
+    def test_pagination(self):
+        results, total = self.search('caching', per_page=2, page=2)
+        self.assertEqual(total, 3)
+        self.assertEqual(len(results), 1)
+
+    def test_rebuild_command(self):
+        search_index.backend.clear(db.session.connection())
+        db.session.commit()
+        self.assertEqual(self.search('caching')[1], 0)
+        result = self.runner.invoke(args=['reindex'])
+        self.assertIn('Indexed 2 posts...', result.output)
+        self.assertEqual(self.search('caching')[1], 3)
+
+    def test_search_view(self):
+        response = self.client.get(url_for('blog.search', q='page cache'))
+        data = response.get_data(as_text=True)
+        self.assertIn('1 results for', data)
+        self.assertIn('<mark>page</mark> <mark>cache</mark>', data)
+
+        response = self.client.get(url_for('blog.search', q='caching', page=5))
+        self.assertEqual(response.status_code, 404)
+
+    def test_highlight_escapes(self):
+        self.assertEqual(highlight('<b>cache</b> me', ['cache']), '&lt;b&gt;<mark>cache</mark>&lt;/b&gt; me')
+
+
+class TermBackendTestCase(SearchTestCase):
+    backend = TermBackend
+
+    def test_terms_are_weighted(self):
+        weights = dict((row.doc, row.weight) for row in SearchTerm.query.filter_by(term='caching'))
+        self.assertEqual(weights[1 * 4 + 1], 10)
+        self.assertEqual(weights[2 * 4 + 1], 1)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+from flask import current_app, url_for
+from werkzeug.security import generate_password_hash
+
+from myblog import create_app
+from myblog.extensions import db, login_guard
+from myblog.models import Admin
+from myblog.security import MemoryBackend, SQLiteBackend, needs_rehash
+from myblog.settings import TestingConfig
+
+from tests.base import BaseTestCase
+
+
+class LoginGuardTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(LoginGuardTestCase, self).setUp()
+        current_app.config.update(MYBLOG_LOGIN_IP_LIMIT=4, MYBLOG_LOGIN_USER_LIMIT=2)
+        self.validations = 0
+        validate_password = Admin.validate_password
+
+        def counting(admin, password):
+            self.validations += 1
+            return validate_password(admin, password)
+        Admin.validate_password = counting
+        self.addCleanup(setattr, Admin, 'validate_password', validate_password)
+
+    def post_login(self, username, password, ip='127.0.0.1', headers=None, client=None):
+        return (client or self.client).post(url_for('auth.login'), data=dict(username=username, password=password),
+                                            environ_base={'REMOTE_ADDR': ip}, headers=headers)
+
+    def test_throttle_by_username(self):
+        for i in range(2):
+            self.assertEqual(self.post_login('zhouh', 'wrong').status_code, 200)
+        self.assertEqual(self.validations, 2)
+
+        # 最近失败过的 IP 被拒绝
+        response = self.post_login('zhouh', '123')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Too many failed logins', response.get_data(as_text=True))
+        self.assertLessEqual(int(response.headers['Retry-After']), current_app.config['MYBLOG_LOGIN_WINDOW'])
+        self.assertEqual(self.validations, 2)
+
+        # 用户名不区分大小写, 其他用户名不受影响
+        self.assertEqual(self.post_login('ZHOUH', '123').status_code, 429)
+        self.assertEqual(self.post_login('other', 'wrong').status_code, 200)
+
+    def test_username_limit_does_not_lock_out_admin(self):
+        for i in range(4):
+            self.post_login('zhouh', 'wrong', ip='10.0.0.%d' % i)
+        response = self.post_login('zhouh', '123', ip='10.0.1.1')
+        self.assertEqual(response.status_code, 302)
+
+    def test_proxy_fix(self):
+        with mock.patch.object(TestingConfig, 'MYBLOG_PROXY_FIX', 1):
+            app = create_app('testing')
+        with app.test_request_context():
+            db.create_all()
+            admin = Admin(name='syntomic', username='zhouh')
+            admin.set_password('123')
+            db.session.add(admin)
+            db.session.commit()
+            self.post_login('zhouh', 'wrong', ip='10.0.0.1', headers={'X-Forwarded-For': '203.0.113.7'},
+                            client=app.test_client())
+            backend = app.extensions['login_guard'].backend
+            self.assertEqual(len(backend.recent('ip:203.0.113.7', 0)), 1)
+            self.assertEqual(backend.recent('ip:10.0.0.1', 0), [])
+            db.drop_all()
+
+    def test_throttle_by_ip(self):
+        for i in range(4):
+            self.assertEqual(self.post_login('user%d' % i, 'wrong').status_code, 200)
+        with self.assertQueryCount(0):
+            response = self.post_login('zhouh', '123')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(self.validations, 0)
+
+    def test_success_clears_failures(self):
+        self.post_login('zhouh', 'wrong')
+        self.assertIn('Welcome back.', self.login().get_data(as_text=True))
+        self.logout()
+        self.post_login('zhouh', 'wrong')
+        self.assertEqual(self.post_login('zhouh', '123').status_code, 302)
+
+    def test_unknown_username_skips_hashing(self):
+        current_app.extensions['login_guard'].hash_seconds = 0.05
+        start = time.perf_counter()
+        response = self.post_login('nobody', '123')
+        self.assertGreaterEqual(time.perf_counter() - start, 0.05)
+        self.assertIn('Invalid username or password.', response.get_data(as_text=True))
+        self.assertEqual(self.validations, 0)
+
+    def test_rehash_on_login(self):
+        admin = Admin.query.first()
+        admin.password_hash = generate_password_hash('123', 'pbkdf2:sha256:500')
+        db.session.commit()
+        self.assertTrue(admin.needs_rehash())
+
+        self.login()
+        password_hash = Admin.query.first().password_hash
+        self.assertTrue(password_hash.startswith('pbkdf2:sha256:1000$'))
+        self.assertEqual(len(password_hash.split('$')[1]), 16)
+        self.assertFalse(needs_rehash(password_hash))
+
+        current_app.config['MYBLOG_PASSWORD_METHOD'] = 'pbkdf2:sha256'
+        self.assertTrue(needs_rehash(password_hash))
+        self.assertFalse(needs_rehash(generate_password_hash('123', 'pbkdf2:sha256', 16)))
+
+    def test_disabled(self):
+        current_app.extensions['login_guard'].backend = None
+        for i in range(3):
+            self.post_login('zhouh', 'wrong')
+        self.assertEqual(login_guard.retry_after('127.0.0.1', 'zhouh'), 0)
+
+
+class BackendTestCase(BaseTestCase):
+
+    def check_backend(self, backend):
+        backend.add('user:a', 100)
+        backend.add('user:a', 200)
+        backend.add('user:b', 150)
+        self.assertEqual(backend.recent('user:a', 0), [100, 200])
+        self.assertEqual(backend.recent('user:a', 150), [200])
+        backend.clear('user:a')
+        self.assertEqual(backend.recent('user:a', 0), [])
+        self.assertEqual(backend.recent('user:b', 0), [150])
+
+    def test_memory_backend(self):
+        backend = MemoryBackend(max_keys=2)
+        self.check_backend(backend)
+        backend.add('user:c', 300)
+        backend.add('user:d', 300)
+        self.assertEqual(backend.recent('user:b', 0), [])
+
+    def test_sqlite_backend(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'login.db')
+        self.check_backend(SQLiteBackend(path, window=1000))
+        # 另一个 worker 打开同一个文件看到相同的记录
+        self.assertEqual(SQLiteBackend(path, window=1000).recent('user:b', 0), [150])
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+
+from flask import current_app, url_for
+
+from myblog.extensions import db
+from myblog.models import Category, Job, Post, Topic
+from myblog.tasks import task_queue
+
+from tests.base import BaseTestCase
+
+
+class TaskQueueTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(TaskQueueTestCase, self).setUp()
+        self.calls = []
+        self.failures = 0
+
+        def record(**payload):
+            self.calls.append(payload)
+
+        def flaky():
+            self.failures += 1
+            raise RuntimeError('boom %d' % self.failures)
+
+        task_queue.task('test.record')(record)
+        task_queue.task('test.flaky')(flaky)
+        current_app.config['MYBLOG_TASK_RETRY_DELAY'] = 0
+
+    def tearDown(self):
+        task_queue.tasks.pop('test.record')
+        task_queue.tasks.pop('test.flaky')
+        super(TaskQueueTestCase, self).tearDown()
+
+    def test_enqueue_and_run(self):
+        self.assertRaises(ValueError, task_queue.enqueue, 'test.missing')
+        task_queue.enqueue('test.record', value=1)
+        task_queue.enqueue('test.record', value=2)
+        db.session.commit()
+        self.assertTrue(current_app.extensions['task_queue'].wakeup.is_set())
+
+        self.assertEqual(task_queue.run_pending(), 2)
+        self.assertEqual(self.calls, [dict(value=1), dict(value=2)])
+        self.assertEqual(Job.query.filter_by(status='done').count(), 2)
+        self.assertEqual(task_queue.run_pending(), 0)
+
+        stats = task_queue.stats()
+        self.assertEqual(stats['depth'], 0)
+        self.assertEqual(stats['counts']['done'], 2)
+        self.assertEqual([row['name'] for row in stats['tasks']], ['test.record'])
+
+    def test_retry_until_failed(self):
+        task_queue.enqueue('test.flaky')
+        db.session.commit()
+        self.assertEqual(task_queue.run_pending(), 3)
+        job = Job.query.one()
+        self.assertEqual((job.status, job.attempts), ('failed', 3))
+        self.assertEqual(job.error, 'RuntimeError: boom 3')
+
+        task_queue.retry(job)
+        self.assertEqual(task_queue.run_pending(limit=1), 1)
+        self.assertEqual(Job.query.one().attempts, 1)
+
+    def test_retry_backoff(self):
+        current_app.config['MYBLOG_TASK_RETRY_DELAY'] = 60
+        task_queue.enqueue('test.flaky')
+        db.session.commit()
+        self.assertEqual(task_queue.run_pending(), 1)
+        job = Job.query.one()
+        self.assertEqual(job.status, 'pending')
+        self.assertGreater(job.run_at, datetime.utcnow() + timedelta(seconds=50))
+
+    def test_recover_abandoned_jobs(self):
+        db.session.add(Job(name='test.record', payload='{}', status='running',
+                           started=datetime.utcnow() - timedelta(hours=1)))
+        db.session.add(Job(name='test.record', payload='{}', status='done',
+                           finished=datetime.utcnow() - timedelta(days=30)))
+        db.session.commit()
+        self.assertEqual(task_queue.recover(), 1)
+        self.assertEqual(Job.query.count(), 1)
+        self.assertEqual(task_queue.run_pending(), 1)
+
+    def test_worker_command(self):
+        task_queue.enqueue('test.record', value=1)
+        db.session.commit()
+        result = self.runner.invoke(args=['worker', '--once'])
+        self.assertIn('Ran 1 tasks.', result.output)
+
+    def test_edited_post_renders_in_background(self):
+        category = Category(name='Default')
+        post = Post(title='Hello', body='Old', category=category, topic=Topic(name='test', category=category))
+        post.render_body()
+        db.session.add(post)
+        db.session.commit()
+        self.login()
+        self.client.post(url_for('admin.edit_post', post_id=1), data=dict(
+            title='Hello', subtitle='sub', body='# Heading', category=1, topic=1))
+        post = Post.query.one()
+        self.assertIsNone(post.body_html)
+        self.assertEqual(Job.query.one().name, 'post.render')
+
+        task_queue.run_pending()
+        db.session.expire_all()
+        self.assertIn('Heading</h1>', Post.query.one().body_html)
+
+        response = self.client.get(url_for('admin.task_stats'))
+        self.assertIn('post.render', response.get_data(as_text=True))
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import tempfile
+import time
+
+from flask import current_app, url_for
+
+from myblog.extensions import request_timer
+from myblog.timing import Histogram, TimingStats
+from myblog.utils import WorkerFiles
+
+from tests.base import BaseTestCase
+
+
+class RequestTimerTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(RequestTimerTestCase, self).setUp()
+        request_timer._state().files = WorkerFiles(tempfile.mkdtemp())
+
+    def tearDown(self):
+        request_timer.reset()
+        super(RequestTimerTestCase, self).tearDown()
+
+    def test_histogram(self):
+        histogram = Histogram()
+        for value in range(1, 101):
+            histogram.record(float(value))
+        self.assertEqual(histogram.count, 100)
+        self.assertEqual(histogram.max, 100.0)
+        self.assertAlmostEqual(histogram.percentile(0.5), 50, delta=50 * 0.1)
+        self.assertAlmostEqual(histogram.percentile(0.99), 99, delta=99 * 0.1)
+        self.assertEqual(histogram.percentile(1), 100.0)
+
+        restored = Histogram.from_dict(json.loads(json.dumps(histogram.to_dict())))
+        self.assertEqual(restored.merge(histogram).count, 200)
+        self.assertLessEqual(len(restored.buckets), 60)
+
+    def test_window_rotation(self):
+        stats = TimingStats(window=60)
+        stats.record('blog.index', dict(total=1.0))
+        stats.started -= 60
+        stats.record('blog.index', dict(total=2.0))
+        self.assertEqual(stats.histograms()[('blog.index', 'total')].count, 2)
+        stats.started -= 60
+        self.assertEqual(stats.histograms()[('blog.index', 'total')].count, 1)
+        stats.started -= 120
+        self.assertEqual(stats.histograms(), {})
+
+    def test_server_timing_header(self):
+        response = self.client.get(url_for('blog.about'))
+        header = response.headers['Server-Timing']
+        for metric in ('total', 'db', 'render', 'context'):
+            self.assertIn('%s;dur=' % metric, header)
+
+        current_app.config['MYBLOG_SERVER_TIMING'] = False
+        self.assertNotIn('Server-Timing', self.client.get(url_for('blog.about')).headers)
+
+    def test_report_covers_workers(self):
+        self.client.get(url_for('blog.about'))
+        request_timer.flush()
+        files = request_timer._state().files
+        with open(os.path.join(files.directory, 'other.json'), 'w') as f:
+            json.dump(dict(generation=files.generation, time=time.time(), data=[
+                ['blog.about', 'total', Histogram().to_dict()],
+                ['blog.index', 'total', Histogram.from_dict(dict(
+                    buckets={'100': 3}, count=3, total=30.0, max=12.0)).to_dict()]]), f)
+
+        rows = dict(((row['endpoint'], row['metric']), row) for row in request_timer.report())
+        self.assertEqual(rows[('blog.about', 'total')]['count'], 1)
+        self.assertGreater(rows[('blog.about', 'render')]['max'], 0)
+        self.assertEqual(rows[('blog.index', 'total')]['count'], 3)
+
+        # 超过两个窗口没有写入的 worker 不再计入
+        window = current_app.config['MYBLOG_TIMING_WINDOW']
+        with open(os.path.join(files.directory, 'other.json'), 'w') as f:
+            json.dump(dict(generation=files.generation, time=time.time() - window * 2 - 1,
+                           data=[['blog.index', 'total', Histogram().to_dict()]]), f)
+        self.assertNotIn('blog.index', [row['endpoint'] for row in request_timer.report()])
+
+        # 另一个 worker 清空后, 本进程和其他进程的旧直方图都不再出现
+        WorkerFiles(files.directory).reset()
+        self.assertEqual(request_timer.report(), [])
+        request_timer.flush()
+        self.assertEqual(request_timer.report(), [])
+
+    def test_admin_page_and_command(self):
+        self.client.get(url_for('blog.about'))
+        self.login()
+        data = self.client.get(url_for('admin.timing_stats')).get_data(as_text=True)
+        self.assertIn('blog.about', data)
+
+        result = self.runner.invoke(args=['perf', '--endpoint', 'blog.about', '--reset'])
+        self.assertIn('blog.about', result.output)
+        self.assertIn('Histograms cleared.', result.output)
+        self.assertEqual(request_timer.report('blog.about'), [])